@@ -0,0 +1,138 @@
+"""Admission control for calculation requests."""
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+from .execution import PROCESS_WORKERS, THREAD_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Calculation requests handled at the same time by one worker
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", str(THREAD_WORKERS + PROCESS_WORKERS)))
+
+# Calculation requests allowed to wait for a slot before new ones are turned away
+ADMISSION_MAX_WAITING = int(os.getenv("ADMISSION_MAX_WAITING", str(2 * ADMISSION_MAX_IN_FLIGHT)))
+
+# Seconds a request may wait for a slot before it is turned away
+ADMISSION_WAIT_TIMEOUT = float(os.getenv("ADMISSION_WAIT_TIMEOUT", "2.0"))
+
+# Value of the Retry-After header sent with rejections
+ADMISSION_RETRY_AFTER = os.getenv("ADMISSION_RETRY_AFTER", "1")
+
+class AdmissionLimiter:
+    """Bounds the calculation requests a worker runs and queues.
+
+    Up to ``max_in_flight`` requests run at once. Further requests wait in
+    FIFO order, but only ``max_waiting`` of them and for at most
+    ``wait_timeout`` seconds; anything beyond that is rejected right away
+    so a burst degrades into fast 503s instead of an ever longer queue.
+    The limiter lives on the event loop and needs no locking.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+        max_waiting: int = ADMISSION_MAX_WAITING,
+        wait_timeout: float = ADMISSION_WAIT_TIMEOUT
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._counts = {"admitted": 0, "queued": 0, "rejected": 0}
+
+    async def acquire(self) -> bool:
+        """Wait for a slot; return False if the request should be rejected"""
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            self._counts["admitted"] += 1
+            return True
+        if len(self._waiters) >= self.max_waiting:
+            self._counts["rejected"] += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.wait_timeout)
+        except asyncio.TimeoutError:
+            self._counts["rejected"] += 1
+            return False
+        except BaseException:
+            # A slot handed over just as the request was cancelled is passed on
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+        self._counts["admitted"] += 1
+        self._counts["queued"] += 1
+        return True
+
+    def release(self) -> None:
+        """Hand the slot to the oldest waiting request, or free it"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """Get admission counts and the current number of running and waiting requests"""
+        return {**self._counts, "in_flight": self.in_flight, "waiting": len(self._waiters)}
+
+class AdmissionMiddleware:
+    """ASGI middleware that passes requests under ``path_prefixes`` through an ``AdmissionLimiter``.
+
+    Rejected requests get a 503 with a Retry-After header and the same
+    ``{"detail": ...}`` body as other API errors.
+    """
+
+    def __init__(
+        self,
+        app,
+        limiter: AdmissionLimiter,
+        path_prefixes: Tuple[str, ...] = ("/calculate",),
+        retry_after: Optional[str] = None
+    ):
+        self.app = app
+        self.limiter = limiter
+        self.path_prefixes = path_prefixes
+        self.retry_after = retry_after or ADMISSION_RETRY_AFTER
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        if not await self.limiter.acquire():
+            logger.warning("Rejecting %s: too many calculations in progress", scope["path"])
+            await self._reject(send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.limiter.release()
+
+    async def _reject(self, send) -> None:
+        body = json.dumps({"detail": "Too many calculations in progress, please retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", self.retry_after.encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+# Limiter shared by every calculation endpoint in this process
+admission_limiter = AdmissionLimiter()
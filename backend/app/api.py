@@ -1,21 +1,65 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field, validator
-from typing import Dict, List, Optional, Union
+from fastapi.responses import Response, StreamingResponse
+from pydantic import (
+    BaseModel, Discriminator, Field, Tag, TypeAdapter, ValidationError,
+    model_validator, validator
+)
+from typing import Annotated, Any, AsyncIterator, Dict, List, Optional, Union
 from enum import Enum
 from .models import Estate, FamilyTree, FamilyNode, Person, ParentType, MarriageInfo
-from .calculations import InheritanceCalculator
+from .calculations import RULES_VERSION, InheritanceCalculator
+from .graph import FamilyGraph
+from .execution import (
+    PROCESS_WORKERS, ExecutionQueueFull, execution_policy, get_process_pool, shutdown_pools
+)
+from .admission import AdmissionMiddleware, admission_limiter
+from .deadline import (
+    CALCULATION_TIMEOUT, CalculationAborted, Deadline, cancel_on_disconnect, checkpoint, reset_deadline, set_deadline
+)
+from .telemetry import StageTimingMiddleware, mark_stage
+from .encoding import (
+    JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, encode_family_tree, negotiate_media_type, pack_response
+)
+from .ingest import REQUEST_MAX_DEPTH, estimate_nodes, json_depth, read_body, split_json_array
+from .cache import request_fingerprint, result_cache, single_flight
+from .shared_cache import get_shared_result_cache
+from .scenarios import (
+    SCENARIO_CACHE_CONTROL, canonical_json, decode_scenario, encode_scenario, etag_matches, scenario_etag
+)
+from .plans import share_plan_cache
+from functools import partial
+from pydantic_core import to_json
+import asyncio
+import json
 import logging
+import os
 
 # Configure logger
 logger = logging.getLogger(__name__)
 
+# Maximum number of estates accepted by a single batch request
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+
+# Maximum number of streamed records being calculated at the same time
+STREAM_MAX_IN_FLIGHT = int(os.getenv("STREAM_MAX_IN_FLIGHT", str(2 * PROCESS_WORKERS)))
+
+# Maximum size of a single streamed record
+STREAM_MAX_LINE_BYTES = int(os.getenv("STREAM_MAX_LINE_BYTES", str(10 * 1024 * 1024)))
+
 app = FastAPI(
     title="Turkish Inheritance Calculator API",
     description="API for calculating inheritance distribution according to Turkish Civil Law",
     version="1.0.0"
 )
 
+# Bound the calculations running and waiting in this worker
+app.add_middleware(AdmissionMiddleware, limiter=admission_limiter)
+
+# Record sampled per-stage timings (enabled with LOG_FORMAT=json)
+app.add_middleware(StageTimingMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -76,11 +120,24 @@ class PersonSchema(BaseModel):
         }
 
 class FamilyNodeSchema(BaseModel):
-    person: PersonSchema
+    person: Optional[PersonSchema] = Field(None, description="Person at this node (required unless ref is given)")
+    ref: Optional[str] = Field(
+        None,
+        description="ID of a person whose node is defined elsewhere in the payload, used instead of repeating it"
+    )
     spouse: Optional[PersonSchema] = Field(None, description="Spouse information")
     children: List['FamilyNodeSchema'] = Field(default_factory=list, description="List of children")
     parents: Optional[Dict[str, 'FamilyNodeSchema']] = Field(None, description="Parent information")
 
+    @model_validator(mode="after")
+    def validate_reference(self):
+        if self.ref is None:
+            if self.person is None:
+                raise ValueError("A family node needs either a person or a ref")
+        elif self.person is not None or self.spouse is not None or self.children or self.parents:
+            raise ValueError("A ref node cannot have a person, spouse, children or parents")
+        return self
+
     class Config:
         schema_extra = {
             "example": {
@@ -154,6 +211,113 @@ class InheritanceRequest(BaseModel):
             }
         }
 
+class FlatPersonSchema(BaseModel):
+    id: str = Field(..., description="Unique identifier for the person")
+    name: Optional[str] = Field(None, min_length=1, description="Full name of the person")
+    is_alive: bool = Field(default=True, description="Whether the person is alive")
+    mother_id: Optional[str] = Field(None, description="ID of the person's mother")
+    father_id: Optional[str] = Field(None, description="ID of the person's father")
+    spouse_id: Optional[str] = Field(None, description="ID of the person's spouse")
+    share: float = Field(default=0, description="Share of the inheritance")
+    share_percentage: Optional[float] = Field(None, description="Percentage of the total inheritance")
+
+class FlatInheritanceRequest(BaseModel):
+    estate_value: float = Field(..., gt=0, description="Total value of the estate in TRY")
+    deceased_id: str = Field(..., description="ID of the deceased person in the persons table")
+    persons: List[FlatPersonSchema] = Field(..., description="Every person of the family, one row each")
+
+    @validator('estate_value')
+    def validate_estate_value(cls, v):
+        if v <= 0:
+            raise ValueError("Estate value must be greater than 0")
+        return v
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "estate_value": 1000000,
+                "deceased_id": "d1",
+                "persons": [
+                    {"id": "d1", "name": "Deceased Person", "is_alive": False, "spouse_id": "s1"},
+                    {"id": "s1", "name": "Spouse"},
+                    {"id": "c1", "name": "Child 1", "father_id": "d1"}
+                ]
+            }
+        }
+
+def request_format(payload: Any) -> str:
+    """Tell flat requests (with a persons table) from nested ones"""
+    if isinstance(payload, dict):
+        return "flat" if "persons" in payload else "nested"
+    return "flat" if isinstance(payload, FlatInheritanceRequest) else "nested"
+
+# Request accepted by the calculation endpoints, in either format
+CalculationRequest = Annotated[
+    Union[
+        Annotated[InheritanceRequest, Tag("nested")],
+        Annotated[FlatInheritanceRequest, Tag("flat")],
+    ],
+    Discriminator(request_format)
+]
+
+calculation_request_adapter = TypeAdapter(CalculationRequest)
+
+# Where the definitions of the calculation request schema sit in the OpenAPI document
+_REQUEST_DEFS_POINTER = "#/paths/~1calculate/post/requestBody/content/application~1json/schema/$defs/{model}"
+
+def calculation_request_body_schema() -> Dict[str, Any]:
+    """Get the OpenAPI request body of the calculation endpoints.
+
+    Their bodies are read raw, so FastAPI cannot derive it; the schema's
+    own definitions are referenced where they sit in the document.
+    """
+    schema = calculation_request_adapter.json_schema(ref_template=_REQUEST_DEFS_POINTER)
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": schema}}}}
+
+def batch_request_body_schema() -> Dict[str, Any]:
+    """Get the OpenAPI request body of /calculate/batch, an array of calculation requests"""
+    schema = calculation_request_adapter.json_schema(ref_template=_REQUEST_DEFS_POINTER)
+    schema.pop("$defs", None)
+    schema = {"type": "array", "items": schema, "maxItems": BATCH_MAX_ITEMS}
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": schema}}}}
+
+def parse_calculation_request(raw: bytes) -> CalculationRequest:
+    """Validate a raw JSON body into a calculation request.
+
+    Nesting is checked on the raw bytes before anything is parsed. The body
+    is then decoded with ``json.loads`` and validated from Python objects:
+    with the pinned pydantic-core, validating straight from JSON bytes
+    (``validate_json``) measured about twice as slow for family trees,
+    with a higher memory peak, and it stops at 200 levels of nesting.
+    """
+    depth = json_depth(raw)
+    if depth > REQUEST_MAX_DEPTH:
+        raise HTTPException(
+            status_code=422,
+            detail=f"Request is nested {depth} levels deep; the maximum is {REQUEST_MAX_DEPTH}. "
+                   "Send deep families as a flat persons table or with refs"
+        )
+    try:
+        payload = json.loads(raw)
+    except ValueError as e:
+        # Same shape as FastAPI's own JSON decode errors
+        raise RequestValidationError([{
+            "type": "json_invalid",
+            "loc": ["body", getattr(e, "pos", 0)],
+            "msg": "JSON decode error",
+            "input": {},
+            "ctx": {"error": getattr(e, "msg", str(e))}
+        }])
+    try:
+        return calculation_request_adapter.validate_python(payload)
+    except ValidationError as e:
+        raise body_validation_error(e)
+
+def body_validation_error(error: ValidationError) -> RequestValidationError:
+    """Report a body validation error the way FastAPI reports those it validates itself"""
+    errors = json.loads(error.json(include_url=False))
+    return RequestValidationError([{**entry, "loc": ["body", *entry["loc"]]} for entry in errors])
+
 class StructuredInheritanceResponse(BaseModel):
     total_distributed: float = Field(..., description="Total amount distributed from the estate")
     family_tree: FamilyNodeSchema = Field(..., description="Family tree with inheritance shares")
@@ -210,73 +374,176 @@ class StructuredInheritanceResponse(BaseModel):
             }
         }
 
-def update_node_with_shares(
-    node: FamilyNodeSchema, 
-    shares: Dict[str, float], 
-    total_distributed: float
-) -> None:
-    """Update a family node and its descendants with their inheritance shares"""
-    # Update person's share
-    if node.person.id in shares:
-        node.person.share = shares[node.person.id]
-        node.person.share_percentage = (shares[node.person.id] / total_distributed) * 100
-
-    # Update spouse's share
-    if node.spouse and node.spouse.id in shares:
-        node.spouse.share = shares[node.spouse.id]
-        node.spouse.share_percentage = (shares[node.spouse.id] / total_distributed) * 100
-
-    # Update children's shares
-    for child in node.children:
-        update_node_with_shares(child, shares, total_distributed)
-
-    # Update parents' shares
-    if node.parents:
-        for parent in node.parents.values():
-            if parent:
-                update_node_with_shares(parent, shares, total_distributed)
-
-def create_inheritance_summary(
+class FlatInheritanceResponse(BaseModel):
+    total_distributed: float = Field(..., description="Total amount distributed from the estate")
+    persons: List[FlatPersonSchema] = Field(..., description="Persons table with inheritance shares")
+    summary: Dict[str, Dict[str, Union[str, float]]] = Field(
+        ...,
+        description="Summary of inheritance distribution by person"
+    )
+
+class ResponseView(str, Enum):
+    """Parts of a calculation result returned to the client"""
+    SUMMARY = "summary"
+    SHARES = "shares"
+    TREE = "tree"
+    FULL = "full"
+
+VIEW_DESCRIPTION = "Parts of the result to return: summary, shares, tree or full"
+
+class SummaryResponse(BaseModel):
+    total_distributed: float = Field(..., description="Total amount distributed from the estate")
+    summary: Dict[str, Dict[str, Union[str, float]]] = Field(
+        ...,
+        description="Summary of inheritance distribution by person"
+    )
+
+class SharesResponse(BaseModel):
+    total_distributed: float = Field(..., description="Total amount distributed from the estate")
+    shares: Dict[str, float] = Field(..., description="Amount inherited by every heir, keyed by person id")
+
+class TreeResponse(BaseModel):
+    total_distributed: float = Field(..., description="Total amount distributed from the estate")
+    family_tree: FamilyNodeSchema = Field(..., description="Family tree with inheritance shares")
+
+class FlatTreeResponse(BaseModel):
+    total_distributed: float = Field(..., description="Total amount distributed from the estate")
+    persons: List[FlatPersonSchema] = Field(..., description="Persons table with inheritance shares")
+
+class ScenarioResponse(BaseModel):
+    scenario: str = Field(..., description="Canonical URL-safe encoding of the request")
+    path: str = Field(..., description="Path of the cacheable GET calculation for the request")
+
+# Response of the calculation endpoints, depending on the request format and view
+CalculationResponse = Union[
+    StructuredInheritanceResponse, FlatInheritanceResponse,
+    TreeResponse, FlatTreeResponse, SummaryResponse, SharesResponse
+]
+
+class BatchItemError(BaseModel):
+    status_code: int = Field(..., description="HTTP status the item would have produced on /calculate")
+    detail: Any = Field(..., description="Error details")
+
+class BatchItemResult(BaseModel):
+    index: int = Field(..., description="Position of the item in the request array")
+    result: Optional[CalculationResponse] = Field(
+        None, description="Calculation result, if successful"
+    )
+    error: Optional[BatchItemError] = Field(None, description="Error details, if the item failed")
+
+class BatchInheritanceResponse(BaseModel):
+    results: List[BatchItemResult] = Field(..., description="Per-item results in request order")
+
+def iter_family_nodes(root: FamilyNodeSchema, relation: Optional[str] = None):
+    """Yield ``(node, relation)`` for every node of a tree in depth-first order.
+
+    Children are visited before parents, both in input order. The walk
+    uses an explicit stack, so arbitrarily deep trees do not recurse.
+    """
+    stack = [(root, relation)]
+    while stack:
+        checkpoint()
+        node, node_relation = stack.pop()
+        yield node, node_relation
+
+        if node.parents:
+            parents = [(parent, parent_type) for parent_type, parent in node.parents.items() if parent]
+            stack.extend(reversed(parents))
+        stack.extend((child, "child") for child in reversed(node.children))
+
+def fill_response_tree(
     node: FamilyNodeSchema,
     shares: Dict[str, float],
     total_distributed: float,
-    summary: Dict[str, Dict[str, Union[str, float]]] = None,
-    relation: str = None
+    with_summary: bool = True
 ) -> Dict[str, Dict[str, Union[str, float]]]:
-    """Create a summary of inheritance distribution"""
-    if summary is None:
-        summary = {}
-
-    # Add person if they have a share
-    if node.person.id in shares:
-        summary[node.person.id] = {
-            "name": node.person.name,
-            "relation": relation or "deceased",
-            "share": shares[node.person.id],
-            "share_percentage": (shares[node.person.id] / total_distributed) * 100
-        }
+    """Fill in shares on a family tree and build the inheritance summary in one pass.
 
-    # Add spouse if they have a share
-    if node.spouse and node.spouse.id in shares:
-        summary[node.spouse.id] = {
-            "name": node.spouse.name,
-            "relation": "spouse",
-            "share": shares[node.spouse.id],
-            "share_percentage": (shares[node.spouse.id] / total_distributed) * 100
-        }
+    Percentages are computed once per heir, however often the heir
+    appears in the tree. The summary stays empty unless ``with_summary``.
+    """
+    percentages = {
+        person_id: (share / total_distributed) * 100 for person_id, share in shares.items()
+    }
+    summary: Dict[str, Dict[str, Union[str, float]]] = {}
 
-    # Process children
-    for child in node.children:
-        create_inheritance_summary(child, shares, total_distributed, summary, "child")
+    for current, relation in iter_family_nodes(node):
+        # Person's share; references are filled where the person is defined
+        person = current.person
+        if person is not None and person.id in shares:
+            person.share = shares[person.id]
+            person.share_percentage = percentages[person.id]
+            if with_summary:
+                summary[person.id] = {
+                    "name": person.name,
+                    "relation": relation or "deceased",
+                    "share": person.share,
+                    "share_percentage": person.share_percentage
+                }
 
-    # Process parents
-    if node.parents:
-        for parent_type, parent in node.parents.items():
-            if parent:
-                create_inheritance_summary(parent, shares, total_distributed, summary, parent_type)
+        # Spouse's share
+        spouse = current.spouse
+        if spouse and spouse.id in shares:
+            spouse.share = shares[spouse.id]
+            spouse.share_percentage = percentages[spouse.id]
+            if with_summary:
+                summary[spouse.id] = {
+                    "name": spouse.name,
+                    "relation": "spouse",
+                    "share": spouse.share,
+                    "share_percentage": spouse.share_percentage
+                }
 
     return summary
 
+def fill_response_persons(
+    request: FlatInheritanceRequest,
+    shares: Dict[str, float],
+    total_distributed: float,
+    with_summary: bool = True
+) -> Dict[str, Dict[str, Union[str, float]]]:
+    """Fill in shares on a persons table and build the inheritance summary.
+
+    Relations match the nested format: ancestors of the deceased are a
+    ``mother`` or ``father``, the deceased's spouse is ``spouse`` and every
+    other heir is a ``child`` of someone in the table. The summary stays
+    empty unless ``with_summary``.
+    """
+    summary: Dict[str, Dict[str, Union[str, float]]] = {}
+    if not with_summary:
+        for row in request.persons:
+            if row.id in shares:
+                row.share = shares[row.id]
+                row.share_percentage = (row.share / total_distributed) * 100
+        return summary
+
+    rows = {row.id: row for row in request.persons}
+    deceased = rows[request.deceased_id]
+    relations = {deceased.id: "deceased"}
+    if deceased.spouse_id is not None:
+        relations[deceased.spouse_id] = "spouse"
+
+    pending = [deceased]
+    while pending:
+        row = pending.pop()
+        for relation, parent_id in (("mother", row.mother_id), ("father", row.father_id)):
+            if parent_id is not None and parent_id not in relations:
+                relations[parent_id] = relation
+                pending.append(rows[parent_id])
+
+    for row in request.persons:
+        checkpoint()
+        if row.id in shares:
+            row.share = shares[row.id]
+            row.share_percentage = (row.share / total_distributed) * 100
+            summary[row.id] = {
+                "name": row.name or row.id,
+                "relation": relations.get(row.id, "child"),
+                "share": row.share,
+                "share_percentage": row.share_percentage
+            }
+    return summary
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -293,72 +560,442 @@ async def get_relative_types():
         "relative_types": [type.value for type in RelativeType]
     }
 
-@app.post("/calculate", response_model=StructuredInheritanceResponse)
-async def calculate_inheritance(
+def run_calculation(
     request: InheritanceRequest,
-) -> StructuredInheritanceResponse:
+    view: ResponseView = ResponseView.FULL
+) -> CalculationResponse:
+    """Calculate the inheritance distribution for a validated request.
+
+    Only the parts of the response in ``view`` are built.
+    """
+    logger.debug("Received calculation request for estate value: %s", request.estate_value)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Full request data: %s", request.model_dump())
+
+    # Work out the heir class on the schema and drop branches without heirs
+    resolve = RefResolver(request.family_tree)
+    heir_class = classify_heirs(request.family_tree, resolve)
+    pruned_tree = prune_family_tree(request.family_tree, heir_class, resolve)
+    logger.debug("Heir class %d; converting the branches that can inherit", heir_class)
+
+    # Convert schema to model
+    logger.debug("Converting schema to model...")
+    root_node = convert_schema_to_model(pruned_tree, resolve)
+    logger.debug("Root node created: %s", root_node.person.id)
+    
+    # Build the compact graph the calculator runs on
+    logger.debug("Building family graph...")
+    graph = FamilyGraph.from_family_node(root_node)
+    logger.debug("Family graph built with %d persons", len(graph))
+    mark_stage("convert")
+    
+    # Calculate inheritance
+    logger.debug("Calculating inheritance shares...")
+    calculator = InheritanceCalculator(graph=graph, total_value=request.estate_value)
+    result = calculator.calculate()
+    logger.debug("Calculation result: %s", result)
+    
+    # Get shares from the flat share array
+    shares = result.share_map()
+    logger.debug("Collected shares: %s", shares)
+    mark_stage("calculate")
+    if view is ResponseView.SHARES:
+        return SharesResponse.model_construct(total_distributed=request.estate_value, shares=shares)
+    
+    # Fill in shares and build the summary in a single pass over the whole
+    # request tree, so heirs repeated in pruned branches are filled too
+    logger.debug("Filling family tree with calculated shares...")
+    updated_tree = request.family_tree
+    summary = fill_response_tree(
+        updated_tree, shares, request.estate_value, with_summary=view is not ResponseView.TREE
+    )
+    logger.debug("Created summary: %s", summary)
+    
+    # Everything in it has been validated already
+    if view is ResponseView.SUMMARY:
+        response = SummaryResponse.model_construct(total_distributed=request.estate_value, summary=summary)
+    elif view is ResponseView.TREE:
+        response = TreeResponse.model_construct(total_distributed=request.estate_value, family_tree=updated_tree)
+    else:
+        response = StructuredInheritanceResponse.model_construct(
+            total_distributed=request.estate_value,
+            family_tree=updated_tree,
+            summary=summary
+        )
+    mark_stage("build")
+    logger.debug("Successfully calculated inheritance distribution")
+    return response
+
+def run_flat_calculation(
+    request: FlatInheritanceRequest,
+    view: ResponseView = ResponseView.FULL
+) -> CalculationResponse:
+    """Calculate the inheritance distribution for a validated flat request.
+
+    Only the parts of the response in ``view`` are built.
+    """
+    logger.debug(
+        "Received flat calculation request for estate value: %s with %d persons",
+        request.estate_value, len(request.persons)
+    )
+
+    # Build the compact graph straight from the persons table
+    graph = FamilyGraph.from_persons(request.persons, request.deceased_id)
+    logger.debug("Family graph built with %d persons", len(graph))
+    mark_stage("convert")
+
+    calculator = InheritanceCalculator(graph=graph, total_value=request.estate_value)
+    shares = calculator.calculate().share_map()
+    logger.debug("Collected shares: %s", shares)
+    mark_stage("calculate")
+    if view is ResponseView.SHARES:
+        return SharesResponse.model_construct(total_distributed=request.estate_value, shares=shares)
+
+    summary = fill_response_persons(
+        request, shares, request.estate_value, with_summary=view is not ResponseView.TREE
+    )
+    if view is ResponseView.SUMMARY:
+        response = SummaryResponse.model_construct(total_distributed=request.estate_value, summary=summary)
+    elif view is ResponseView.TREE:
+        response = FlatTreeResponse.model_construct(total_distributed=request.estate_value, persons=request.persons)
+    else:
+        response = FlatInheritanceResponse.model_construct(
+            total_distributed=request.estate_value,
+            persons=request.persons,
+            summary=summary
+        )
+    mark_stage("build")
+    return response
+
+def calculate_request(
+    request: CalculationRequest,
+    view: ResponseView = ResponseView.FULL
+) -> CalculationResponse:
+    """Calculate a validated request in whichever format it came in"""
+    if isinstance(request, FlatInheritanceRequest):
+        return run_flat_calculation(request, view)
+    return run_calculation(request, view)
+
+def encode_response(response: CalculationResponse) -> bytes:
+    """Serialize a calculation response to JSON.
+
+    Trees are written by ``encode_family_tree``, which gives nodes their
+    response shape; every other field goes straight through pydantic-core.
+    """
+    fields = []
+    for name in type(response).model_fields:
+        value = getattr(response, name)
+        if name == "family_tree":
+            encoded = encode_family_tree(value, PersonSchema.__pydantic_serializer__.to_json)
+        else:
+            encoded = to_json(value)
+        fields.append(b'"' + name.encode() + b'":' + encoded)
+    return b"{" + b",".join(fields) + b"}"
+
+class WorkerHTTPException(HTTPException):
+    """An HTTPException that can be sent back from a worker process.
+
+    HTTPException itself cannot be unpickled, as its arguments are not
+    kept in ``args``.
+    """
+
+    def __reduce__(self):
+        return type(self), (self.status_code, self.detail, self.headers)
+
+def calculate_response_body(
+    raw: bytes,
+    media_type: str = JSON_MEDIA_TYPE,
+    view: ResponseView = ResponseView.FULL
+) -> bytes:
+    """Parse and calculate a raw JSON request and serialize its response.
+
+    Everything from parsing to serializing runs here, in the tier chosen
+    for the request, so none of it blocks the event loop: only bytes go
+    to a worker process and only bytes come back.
+    """
+    try:
+        request = parse_calculation_request(raw)
+        mark_stage("parse")
+        response = calculate_request(request, view)
+    except HTTPException as e:
+        raise WorkerHTTPException(e.status_code, e.detail, e.headers) from None
+    if media_type == MSGPACK_MEDIA_TYPE:
+        body = pack_response(response, partial(PersonSchema.__pydantic_serializer__.to_python, mode="json"))
+    else:
+        body = encode_response(response)
+    mark_stage("serialize")
+    return body
+
+async def calculate_and_cache(
+    raw: bytes,
+    cache_key: bytes,
+    media_type: str,
+    view: ResponseView
+) -> bytes:
+    """Calculate a raw request in the tier for its estimated size and cache the response body"""
+    encode = partial(calculate_response_body, media_type=media_type, view=view)
+    body = await execution_policy.run(encode, raw, estimate_nodes(raw))
+    result_cache.put(cache_key, body)
+    get_shared_result_cache().put(cache_key, body)
+    return body
+
+def batch_item_error(error: Exception) -> Dict[str, Any]:
+    """Describe a failed batch item by the error /calculate would have answered"""
+    if isinstance(error, RequestValidationError):
+        status_code, detail = 422, error.errors()
+    elif isinstance(error, HTTPException):
+        status_code, detail = error.status_code, error.detail
+    elif isinstance(error, CalculationAborted):
+        status_code, detail = error.status_code, str(error)
+    elif isinstance(error, ExecutionQueueFull):
+        status_code, detail = 503, str(error)
+    elif isinstance(error, ValueError):
+        logger.error(f"Validation error: {str(error)}", exc_info=error)
+        status_code, detail = 400, str(error)
+    else:
+        logger.error(f"Unexpected error during inheritance calculation: {str(error)}", exc_info=error)
+        status_code, detail = 500, f"An error occurred while calculating inheritance: {str(error)}"
+    return {"error": {"status_code": status_code, "detail": detail}}
+
+def calculate_batch_item(raw: bytes, view: ResponseView = ResponseView.FULL) -> Dict[str, Any]:
+    """Parse and calculate a single raw batch item.
+
+    May run in a worker process, so failures are returned as data
+    instead of being raised and results come back already encoded.
+    """
+    try:
+        return {"result": calculate_response_body(raw, view=view)}
+    except Exception as e:
+        return batch_item_error(e)
+
+def encode_batch_results(outcomes: List[Dict[str, Any]]) -> bytes:
+    """Encode batch outcomes as a BatchInheritanceResponse around their encoded results"""
+    items = []
+    for index, outcome in enumerate(outcomes):
+        result = outcome.get("result", b"null")
+        error = to_json(outcome["error"]) if "error" in outcome else b"null"
+        items.append(b'{"index":%d,"result":%b,"error":%b}' % (index, result, error))
+    return b'{"results":[' + b",".join(items) + b"]}"
+
+class DuplexStreamingResponse(StreamingResponse):
+    """Streaming response that leaves the request body to the endpoint.
+
+    StreamingResponse watches for disconnects by reading from ``receive``,
+    which would swallow request body chunks the endpoint has not read yet.
+    Endpoints using this response read the body themselves and see a
+    disconnect as ``ClientDisconnect`` from ``request.stream()``.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+def calculate_ndjson_line(line: bytes) -> str:
+    """Calculate one NDJSON record and encode the outcome as a JSON line.
+
+    Successful records become a StructuredInheritanceResponse (or
+    FlatInheritanceResponse) object,
+    failed records become an ``{"error": {...}}`` object. Records are
+    checked like /calculate bodies, nesting included, before they are
+    decoded, and any failure only affects its own line.
+    """
+    try:
+        return calculate_response_body(line).decode()
+    except RequestValidationError as e:
+        error = e.errors()[0]
+        if error["type"] != "json_invalid":
+            outcome = batch_item_error(e)
+        else:
+            outcome = {"error": {"status_code": 400, "detail": f"Invalid JSON record: {error['ctx']['error']}"}}
+    except Exception as e:
+        outcome = batch_item_error(e)
+    return json.dumps(outcome)
+
+async def iter_ndjson_records(request: Request) -> AsyncIterator[Optional[bytes]]:
+    """Split a streamed request body into NDJSON records.
+
+    Records larger than STREAM_MAX_LINE_BYTES are skipped and reported
+    as ``None`` so the caller can emit an error for that position.
+    """
+    buffer = bytearray()
+    oversized = False
+    async for chunk in request.stream():
+        start = 0
+        while True:
+            newline = chunk.find(b"\n", start)
+            if newline == -1:
+                break
+            if oversized or len(buffer) + newline - start > STREAM_MAX_LINE_BYTES:
+                oversized = False
+                yield None
+            else:
+                buffer += chunk[start:newline]
+                if buffer.strip():
+                    yield bytes(buffer)
+            buffer.clear()
+            start = newline + 1
+
+        if not oversized:
+            buffer += chunk[start:]
+            if len(buffer) > STREAM_MAX_LINE_BYTES:
+                oversized = True
+                buffer.clear()
+
+    if oversized:
+        yield None
+    elif buffer.strip():
+        yield bytes(buffer)
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    """Stop calculation worker processes with the application"""
+    shutdown_pools()
+
+@app.get("/metrics")
+async def get_metrics():
+    """Get cache counters for this worker"""
+    return {
+        "result_cache": result_cache.stats(),
+        "shared_result_cache": get_shared_result_cache().stats(),
+        "share_plan_cache": share_plan_cache.stats(),
+        "execution": execution_policy.stats(),
+        "admission": admission_limiter.stats(),
+        "single_flight": single_flight.stats(),
+    }
+
+@app.post(
+    "/calculate",
+    response_model=CalculationResponse,
+    openapi_extra=calculation_request_body_schema()
+)
+async def calculate_inheritance(
+    http_request: Request,
+    view: ResponseView = Query(ResponseView.FULL, description=VIEW_DESCRIPTION)
+) -> Response:
     """
     Calculate inheritance distribution based on the provided family tree and estate value.
     
     The calculation follows Turkish Civil Law rules for inheritance distribution.
     Returns the distribution in the context of the family tree structure.
+    The family can also be sent as a flat persons table with mother, father
+    and spouse ids (a request with ``persons`` and ``deceased_id``); shares
+    are then returned on that table.
+    The ``view`` parameter picks what is returned: only the ``summary``,
+    only the ``shares`` by person id, only the ``tree`` (or persons table)
+    with shares filled in, or the ``full`` response; parts that are not
+    returned are not built either.
+    Responses are JSON, or MessagePack for clients that prefer
+    ``application/msgpack`` in their Accept header.
+    The body may be gzip-encoded; its size and nesting are checked on the
+    raw bytes before it is parsed.
+    ``POST /scenarios`` encodes a request for the cacheable
+    ``GET /calculate/{scenario}``.
+    Identical requests are answered from an in-process result cache,
+    backed by one shared with the container's other workers, and
+    identical requests arriving while one is being calculated wait for
+    its result instead of calculating it again.
+    Small trees are parsed and calculated inline, medium ones in a thread
+    pool and large ones in a process pool, the size being estimated from
+    the raw body; a full pool, or more concurrent calculations than the
+    worker admits, answers 503.
+    A calculation that runs past its deadline answers 408, and one whose
+    client disconnected is abandoned with a 499.
+    """
+    raw = await read_body(http_request)
+    media_type = negotiate_media_type(http_request.headers.get("accept"))
+    body = await calculate_or_reuse(http_request, raw, media_type, view)
+    return Response(content=body, media_type=media_type, headers={"Vary": "Accept"})
+
+@app.get("/calculate/{scenario}", response_model=CalculationResponse)
+async def calculate_scenario(
+    http_request: Request,
+    scenario: str,
+    view: ResponseView = Query(ResponseView.FULL, description=VIEW_DESCRIPTION)
+) -> Response:
+    """
+    Calculate a request encoded in the URL, as returned by ``POST /scenarios``.
+
+    The result is the JSON /calculate would return, byte for byte the same
+    for the same scenario and view, with a strong ETag and a long-lived
+    Cache-Control so browsers and CDNs can keep it. A scenario that is
+    valid but not in canonical form, or was made for an older rules
+    version, is redirected (308) to the current canonical URL, so every
+    cache holds one copy per request and rules. The ETag is derived from
+    the scenario and view, so a matching If-None-Match answers 304
+    before the request is even parsed.
+    """
+    version, raw = decode_scenario(scenario)
+    headers = {"ETag": scenario_etag(raw, view.value), "Cache-Control": SCENARIO_CACHE_CONTROL}
+    if version == RULES_VERSION and etag_matches(http_request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    request = parse_calculation_request(raw)
+    mark_stage("parse")
+    if version != RULES_VERSION or raw != canonical_json(request):
+        location = app.url_path_for("calculate_scenario", scenario=encode_scenario(request))
+        if http_request.url.query:
+            location += "?" + http_request.url.query
+        return Response(status_code=308, headers={"Location": location})
+
+    body = await calculate_or_reuse(http_request, raw, JSON_MEDIA_TYPE, view)
+    return Response(content=body, media_type=JSON_MEDIA_TYPE, headers=headers)
+
+@app.post("/scenarios", response_model=ScenarioResponse, openapi_extra=calculation_request_body_schema())
+async def create_scenario(http_request: Request) -> ScenarioResponse:
+    """
+    Encode a calculation request for ``GET /calculate/{scenario}``.
+
+    Takes the same body as /calculate. Equal requests get the same
+    scenario however their JSON was laid out.
+    """
+    request = parse_calculation_request(await read_body(http_request))
+    scenario = encode_scenario(request)
+    return ScenarioResponse(scenario=scenario, path=app.url_path_for("calculate_scenario", scenario=scenario))
+
+async def calculate_or_reuse(
+    http_request: Request,
+    raw: bytes,
+    media_type: str,
+    view: ResponseView
+) -> bytes:
+    """Get the encoded response for a raw JSON request.
+
+    The body comes from the result cache, which is keyed by the raw bytes
+    and so is looked up before anything is parsed, from an identical
+    calculation already in flight, or from parsing and calculating the
+    request under a deadline that is cancelled if the client disconnects.
+    Failures become HTTP errors.
     """
+    deadline = Deadline(CALCULATION_TIMEOUT)
+    deadline_token = set_deadline(deadline)
+    watcher = asyncio.create_task(cancel_on_disconnect(http_request.receive, deadline))
     try:
-        logger.info(f"Received calculation request for estate value: {request.estate_value}")
-        logger.debug(f"Full request data: {request.dict()}")
-
-        # Convert schema to model
-        logger.debug("Converting schema to model...")
-        root_node = convert_schema_to_model(request.family_tree)
-        logger.debug(f"Root node created: {root_node}")
-        
-        # Create estate and family tree
-        logger.debug("Creating estate and family tree...")
-        family_tree = FamilyTree(root=root_node)
-        estate = Estate(total_value=request.estate_value, family_tree=family_tree)
-        logger.debug(f"Estate created with value: {estate.total_value}")
-        
-        # Calculate inheritance
-        logger.info("Calculating inheritance shares...")
-        calculator = InheritanceCalculator(estate=estate)
-        result = calculator.calculate()
-        logger.debug(f"Calculation result: {result}")
-        
-        # Get shares from the nodes
-        shares = {}
-        def collect_shares(node: FamilyNode):
-            if node.person and node.person.share > 0:
-                shares[node.person.id] = node.person.share
-            if node.spouse and node.spouse.share > 0:
-                shares[node.spouse.id] = node.spouse.share
-            for child in node.children:
-                collect_shares(child)
-            if node.parents:
-                for parent in node.parents.values():
-                    if parent:
-                        collect_shares(parent)
-        
-        collect_shares(root_node)
-        logger.debug(f"Collected shares: {shares}")
-        
-        # Update family tree with shares
-        logger.debug("Updating family tree with calculated shares...")
-        updated_tree = request.family_tree
-        update_node_with_shares(updated_tree, shares, estate.total_value)
-        
-        # Create summary
-        logger.debug("Creating inheritance summary...")
-        summary = create_inheritance_summary(updated_tree, shares, estate.total_value)
-        logger.debug(f"Created summary: {summary}")
-        
-        response = StructuredInheritanceResponse(
-            total_distributed=estate.total_value,
-            family_tree=updated_tree,
-            summary=summary
-        )
-        logger.info("Successfully calculated inheritance distribution")
-        return response
+        cache_key = request_fingerprint(raw)
+        if media_type != JSON_MEDIA_TYPE:
+            cache_key += media_type.encode()
+        if view is not ResponseView.FULL:
+            cache_key += b"view=" + view.value.encode()
+        body = result_cache.get(cache_key)
+        if body is None:
+            body = get_shared_result_cache().get(cache_key)
+            if body is not None:
+                result_cache.put(cache_key, body)
+        mark_stage("cache")
+        if body is None:
+            body = await single_flight.run(
+                cache_key, lambda: calculate_and_cache(raw, cache_key, media_type, view)
+            )
+        return body
 
+    except (HTTPException, RequestValidationError):
+        raise
+    except CalculationAborted as e:
+        logger.warning("Abandoning calculation: %s", e)
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ExecutionQueueFull as e:
+        logger.warning("Rejecting calculation: %s", e)
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except ValueError as e:
         logger.error(f"Validation error: {str(e)}", exc_info=True)
         raise HTTPException(status_code=400, detail=str(e))
@@ -368,67 +1005,403 @@ async def calculate_inheritance(
             status_code=500,
             detail=f"An error occurred while calculating inheritance: {str(e)}"
         )
+    finally:
+        watcher.cancel()
+        reset_deadline(deadline_token)
+
+@app.post(
+    "/calculate/batch",
+    response_model=BatchInheritanceResponse,
+    openapi_extra=batch_request_body_schema()
+)
+async def calculate_inheritance_batch(
+    http_request: Request,
+    view: ResponseView = Query(ResponseView.FULL, description=VIEW_DESCRIPTION)
+) -> Response:
+    """
+    Calculate inheritance distributions for many estates in one request.
+
+    The body is read and checked as on /calculate, then split into its
+    items without being parsed. Each item is parsed and calculated like a
+    /calculate request, in the tier for its size and under its own
+    deadline, with no more items in flight than the process pool admits.
+    Results are returned in request order; an item that fails for any
+    reason produces an error entry with the status /calculate would have
+    answered instead of failing the whole batch. ``view`` works as on
+    /calculate.
+    """
+    raw = await read_body(http_request)
+    try:
+        items = split_json_array(raw)
+    except ValueError as e:
+        raise RequestValidationError([{"type": "list_type", "loc": ["body"], "msg": str(e), "input": None}])
+    if len(items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch contains {len(items)} items; the maximum is {BATCH_MAX_ITEMS}"
+        )
 
-def convert_schema_to_model(node_schema: FamilyNodeSchema) -> FamilyNode:
-    """Convert FamilyNodeSchema to FamilyNode model"""
+    logger.info("Received batch calculation request with %d items", len(items))
+    calculate_item = partial(calculate_batch_item, view=view)
+    slots = asyncio.Semaphore(min(execution_policy.limits.values()))
+    disconnected = Deadline(None)
+
+    async def run_item(item: bytes) -> Dict[str, Any]:
+        async with slots:
+            deadline = Deadline(CALCULATION_TIMEOUT)
+            disconnected.on_cancel(deadline.cancel)
+            token = set_deadline(deadline)
+            try:
+                deadline.raise_if_aborted()
+                return await execution_policy.run(calculate_item, item, estimate_nodes(item))
+            except Exception as e:
+                return batch_item_error(e)
+            finally:
+                reset_deadline(token)
+                disconnected.remove_on_cancel(deadline.cancel)
+
+    watcher = asyncio.create_task(cancel_on_disconnect(http_request.receive, disconnected))
     try:
-        logger.debug(f"Converting node schema: {node_schema}")
-        
-        # Convert person
-        person = Person(
-            id=node_schema.person.id,
-            name=node_schema.person.name,
-            is_alive=node_schema.person.is_alive,
-            parent_id=node_schema.person.parent_id
+        outcomes = await asyncio.gather(*(run_item(item) for item in items))
+    finally:
+        watcher.cancel()
+
+    return Response(content=encode_batch_results(outcomes), media_type=JSON_MEDIA_TYPE)
+
+@app.post("/calculate/stream")
+async def calculate_inheritance_stream(request: Request) -> DuplexStreamingResponse:
+    """
+    Calculate inheritance distributions for a stream of estates.
+
+    The request body is newline-delimited JSON with one InheritanceRequest
+    (or FlatInheritanceRequest) per line. Each record is calculated as soon
+    as it has been received and its response (or an ``{"error": ...}``
+    object) is written back as one line, in request order; a record that
+    fails, however it fails, never ends the stream. At most
+    STREAM_MAX_IN_FLIGHT records are calculated at once; while that limit
+    is reached the request body is not read further.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    in_flight: asyncio.Queue = asyncio.Queue(maxsize=STREAM_MAX_IN_FLIGHT)
+
+    def oversized_record() -> asyncio.Future:
+        future = loop.create_future()
+        future.set_result(json.dumps({"error": {
+            "status_code": 413,
+            "detail": f"Record exceeds the maximum size of {STREAM_MAX_LINE_BYTES} bytes"
+        }}))
+        return future
+
+    async def read_records():
+        try:
+            async for record in iter_ndjson_records(request):
+                if record is None:
+                    future = oversized_record()
+                else:
+                    future = loop.run_in_executor(pool, calculate_ndjson_line, record)
+                await in_flight.put(future)
+        except Exception as e:
+            logger.error(f"Error while reading streamed records: {str(e)}", exc_info=True)
+        finally:
+            await in_flight.put(None)
+
+    async def write_results() -> AsyncIterator[str]:
+        reader = asyncio.create_task(read_records())
+        try:
+            while True:
+                future = await in_flight.get()
+                if future is None:
+                    break
+                try:
+                    line = await future
+                except Exception as e:
+                    # The record never ran, e.g. its worker process died
+                    line = json.dumps(batch_item_error(e))
+                yield line + "\n"
+        finally:
+            reader.cancel()
+
+    logger.info("Received streaming calculation request")
+    return DuplexStreamingResponse(write_results(), media_type="application/x-ndjson")
+
+def convert_person(person_schema: PersonSchema) -> Person:
+    """Convert PersonSchema to Person model"""
+    marriage_info = None
+    if person_schema.marriage_info:
+        marriage_info = MarriageInfo(
+            marriage_order=person_schema.marriage_info.marriage_order,
+            is_current=person_schema.marriage_info.is_current
         )
-        if node_schema.person.marriage_info:
-            person.marriage_info = MarriageInfo(
-                marriage_order=node_schema.person.marriage_info.marriage_order,
-                is_current=node_schema.person.marriage_info.is_current
-            )
+    return Person(
+        id=person_schema.id,
+        name=person_schema.name,
+        is_alive=person_schema.is_alive,
+        parent_id=person_schema.parent_id,
+        marriage_info=marriage_info
+    )
 
-        # Convert spouse if exists
-        spouse = None
-        if node_schema.spouse:
-            spouse = Person(
-                id=node_schema.spouse.id,
-                name=node_schema.spouse.name,
-                is_alive=node_schema.spouse.is_alive,
-                parent_id=node_schema.spouse.parent_id
-            )
-            if node_schema.spouse.marriage_info:
-                spouse.marriage_info = MarriageInfo(
-                    marriage_order=node_schema.spouse.marriage_info.marriage_order,
-                    is_current=node_schema.spouse.marriage_info.is_current
-                )
+def person_key(person_schema: Optional[PersonSchema]) -> Optional[tuple]:
+    """Get the fields of a person that end up in the converted model"""
+    if person_schema is None:
+        return None
+    marriage_info = person_schema.marriage_info
+    return (
+        person_schema.id,
+        person_schema.name,
+        person_schema.is_alive,
+        person_schema.parent_id,
+        (marriage_info.marriage_order, marriage_info.is_current) if marriage_info else None
+    )
 
-        # Convert children
-        children = [convert_schema_to_model(child) for child in node_schema.children]
-
-        # Convert parents
-        parents = {}
-        if node_schema.parents:
-            for parent_type_str, parent_node in node_schema.parents.items():
-                if parent_node:
-                    try:
-                        parent_type = ParentType(parent_type_str.lower())
-                        parents[parent_type] = convert_schema_to_model(parent_node)
-                    except ValueError:
-                        logger.error(f"Invalid parent type: {parent_type_str}")
-                        raise HTTPException(
-                            status_code=400,
-                            detail=f"Invalid parent type: {parent_type_str}. Must be either 'mother' or 'father'"
-                        )
-
-        node = FamilyNode(
-            person=person,
-            spouse=spouse,
-            children=children,
-            parents=parents
+def parse_parent_type(parent_type: str) -> ParentType:
+    """Parse a ``parents`` key, rejecting anything but mother and father"""
+    try:
+        return ParentType(parent_type.lower())
+    except ValueError:
+        logger.error("Invalid parent type: %s", parent_type)
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid parent type: {parent_type}. Must be either 'mother' or 'father'"
         )
-        logger.debug(f"Successfully converted node: {node}")
-        return node
-        
+
+class RefResolver:
+    """Resolves ``{"ref": ...}`` nodes to the node defining that person.
+
+    The payload is only indexed when the first ref is resolved, so
+    requests without refs never pay for it. ``replaced`` maps the object id
+    of a node to a pruned copy that should be used in its place.
+    """
+
+    def __init__(self, root: FamilyNodeSchema, replaced: Optional[Dict[int, FamilyNodeSchema]] = None):
+        self.root = root
+        self.replaced = replaced or {}
+        self._definitions: Optional[Dict[str, FamilyNodeSchema]] = None
+
+    def __call__(self, schema: FamilyNodeSchema) -> FamilyNodeSchema:
+        if schema.ref is None:
+            return schema
+        if self._definitions is None:
+            # First node defining each person wins
+            self._definitions = {}
+            for node, _ in iter_family_nodes(self.root):
+                if node.person is not None:
+                    self._definitions.setdefault(node.person.id, node)
+        target = self._definitions.get(schema.ref)
+        if target is None:
+            raise ValueError(f"Reference to unknown person '{schema.ref}'")
+        return self.replaced.get(id(target), target)
+
+def has_living_person(node: FamilyNodeSchema, resolve: RefResolver) -> bool:
+    """Check if a node's person or any of their descendants is alive, stopping at the first one"""
+    seen = set()
+    pending = [resolve(node)]
+    while pending:
+        checkpoint()
+        current = pending.pop()
+        if current.person.is_alive:
+            return True
+        for child in current.children:
+            child = resolve(child)
+            if id(child) not in seen:
+                seen.add(id(child))
+                pending.append(child)
+    return False
+
+def schema_parents(node: FamilyNodeSchema, resolve: RefResolver) -> List[FamilyNodeSchema]:
+    """Get the resolved parent nodes of a node"""
+    if not node.parents:
+        return []
+    return [resolve(parent) for parent in node.parents.values() if parent]
+
+def classify_heirs(root: FamilyNodeSchema, resolve: RefResolver) -> int:
+    """Get the closest heir class with a living member, working on the request schema.
+
+    Mirrors ``InheritanceCalculator._classify_heirs``: 1 for living
+    descendants, 2 for living parents or siblings' branches, 3 for living
+    grandparents or uncles/aunts, 0 if there is none.
+    """
+    root = resolve(root)
+    if any(has_living_person(child, resolve) for child in root.children):
+        return 1
+
+    parents = schema_parents(root, resolve)
+    for parent in parents:
+        if parent.person.is_alive:
+            return 2
+        for sibling in parent.children:
+            sibling = resolve(sibling)
+            if sibling.person.id != root.person.id and has_living_person(sibling, resolve):
+                return 2
+
+    for parent in parents:
+        for grandparent in schema_parents(parent, resolve):
+            if grandparent.person.is_alive:
+                return 3
+            for uncle in grandparent.children:
+                uncle = resolve(uncle)
+                if uncle.person.is_alive and uncle.person.id != parent.person.id:
+                    return 3
+    return 0
+
+def prune_family_tree(
+    root: FamilyNodeSchema,
+    heir_class: int,
+    resolve: RefResolver
+) -> FamilyNodeSchema:
+    """Get a shallow copy of the tree without the branches no heir of ``heir_class`` is in.
+
+    Only nodes at the cut are copied; everything below them is shared
+    with the request. Copies are recorded in ``resolve.replaced`` so refs
+    to the originals resolve to them.
+
+    - class 1 (and 0): the ancestor side is dropped
+    - class 2: the deceased's children and grandparents are dropped
+    - class 3: only grandparents and their other children themselves are kept
+    """
+    def replace(node: FamilyNodeSchema, **update) -> FamilyNodeSchema:
+        copy = node.model_copy(update=update)
+        resolve.replaced[id(node)] = copy
+        return copy
+
+    root = resolve(root)
+    # Parent keys are checked wherever the tree is looked at, even if the side is dropped
+    for parent_type in root.parents or {}:
+        parse_parent_type(parent_type)
+
+    if heir_class == 1:
+        return replace(root, parents=None)
+    if heir_class == 0:
+        return replace(root, parents=None, children=[])
+
+    parents = {}
+    for parent_type, parent in (root.parents or {}).items():
+        if not parent:
+            continue
+        parent = resolve(parent)
+        if heir_class == 2:
+            parents[parent_type] = replace(parent, parents=None)
+            continue
+
+        parent_copy = replace(parent, children=[], parents=None)
+        grandparents = {}
+        for grandparent_type, grandparent in (parent.parents or {}).items():
+            parse_parent_type(grandparent_type)
+            if grandparent:
+                grandparent = resolve(grandparent)
+                # The parent is left out of their own siblings; uncles/aunts exclude them anyway
+                uncles = []
+                for uncle in grandparent.children:
+                    uncle = resolve(uncle)
+                    if uncle is not parent and uncle is not parent_copy:
+                        uncles.append(replace(uncle, children=[], parents=None))
+                grandparents[grandparent_type] = replace(grandparent, children=uncles, parents=None)
+        parent_copy.parents = grandparents
+        parents[parent_type] = parent_copy
+
+    return replace(root, children=[], parents=parents)
+
+def convert_schema_to_model(
+    node_schema: FamilyNodeSchema,
+    resolve: Optional[RefResolver] = None
+) -> FamilyNode:
+    """Convert FamilyNodeSchema to FamilyNode model.
+
+    Nodes are built bottom-up with an explicit stack, so arbitrarily deep
+    trees convert without recursion. ``{"ref": ...}`` nodes resolve to the
+    node defining that person, and structurally identical subtrees, such
+    as a sibling listed under both parents, are hash-consed; either way
+    every place they appear shares one converted node. A ref back to an
+    ancestor, like the deceased inside their parents' child lists, is
+    linked once the ancestor has been built.
+    """
+    try:
+        if resolve is None:
+            resolve = RefResolver(node_schema)
+
+        # Converted node for every distinct subtree, keyed by its structure
+        interned: Dict[tuple, FamilyNode] = {}
+        # Converted node for every schema node, keyed by object id
+        converted: Dict[int, FamilyNode] = {}
+        # Schema nodes whose subtree is being converted
+        active = set()
+        # Links to ancestors, made once everything is built
+        back_links = []
+
+        root_schema = resolve(node_schema)
+        stack = [(root_schema, False)]
+        while stack:
+            checkpoint()
+            schema, expanded = stack.pop()
+            if id(schema) in converted:
+                continue
+
+            child_schemas = [resolve(child) for child in schema.children]
+            parent_schemas = {}
+            if schema.parents:
+                for parent_type_str, parent_schema in schema.parents.items():
+                    if parent_schema:
+                        parent_schemas[parse_parent_type(parent_type_str)] = resolve(parent_schema)
+
+            if not expanded:
+                active.add(id(schema))
+                stack.append((schema, True))
+                stack.extend(
+                    (child, False) for child in reversed(child_schemas) if id(child) not in active
+                )
+                stack.extend(
+                    (parent, False) for parent in parent_schemas.values() if id(parent) not in active
+                )
+                continue
+
+            # Convert children and parents; ancestors are not built yet and are linked later
+            links = []
+            children = []
+            for position, child_schema in enumerate(child_schemas):
+                child = converted.get(id(child_schema))
+                if child is None:
+                    links.append(("children", position, child_schema))
+                children.append(child)
+            parents = {}
+            for parent_type, parent_schema in parent_schemas.items():
+                parent = converted.get(id(parent_schema))
+                if parent is None:
+                    links.append(("parents", parent_type, parent_schema))
+                parents[parent_type] = parent
+
+            if links:
+                # Nodes linking to ancestors are never shared
+                key = ("linked", id(schema))
+            else:
+                key = (
+                    person_key(schema.person),
+                    person_key(schema.spouse),
+                    tuple(id(child) for child in children),
+                    tuple((parent_type, id(parent)) for parent_type, parent in parents.items())
+                )
+            node = interned.get(key)
+            if node is None:
+                # Placeholders for ancestors would not validate, so linked nodes skip validation
+                build = FamilyNode.model_construct if links else FamilyNode
+                node = build(
+                    person=convert_person(schema.person),
+                    spouse=convert_person(schema.spouse) if schema.spouse else None,
+                    children=children,
+                    parents=parents
+                )
+                interned[key] = node
+            converted[id(schema)] = node
+            active.discard(id(schema))
+            back_links.extend((node, field, slot, target) for field, slot, target in links)
+
+        for node, field, slot, target in back_links:
+            getattr(node, field)[slot] = converted[id(target)]
+
+        logger.debug("Converted %d nodes into %d distinct subtrees", len(converted), len(interned))
+        return converted[id(root_schema)]
+
+    except CalculationAborted:
+        raise
     except Exception as e:
         logger.error(f"Error converting schema to model: {str(e)}", exc_info=True)
-        raise 
\ No newline at end of file
+        raise
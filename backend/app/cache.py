@@ -0,0 +1,165 @@
+"""In-process cache of serialized calculation results."""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from .deadline import ClientDisconnected
+
+# Total size of cached response bodies, in bytes
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Seconds a cached result stays valid
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300"))
+
+def request_fingerprint(raw: bytes) -> bytes:
+    """Get a digest of a raw (decompressed) request body.
+
+    Hashing the bytes already read costs a small fraction of serializing
+    the validated request again, which would block the event loop for
+    as long as the calculation itself on large trees. Identical bodies
+    share a digest; equal requests laid out differently do not.
+    """
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+class ResultCache:
+    """Thread-safe LRU cache with a time-to-live and a cap on total bytes stored"""
+
+    def __init__(
+        self,
+        max_bytes: int = RESULT_CACHE_MAX_BYTES,
+        ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._clock = clock
+        self._size = 0
+        self._entries: "OrderedDict[bytes, Tuple[float, bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        """Get a cached value if it has not expired, marking it as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= self._clock():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: bytes, value: bytes) -> None:
+        """Store a value, evicting the least recently used ones to stay under max_bytes"""
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (self._clock() + self.ttl_seconds, value)
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every entry and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Get hit/miss counters and current usage"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _remove(self, key: bytes) -> None:
+        _, value = self._entries.pop(key)
+        self._size -= len(value)
+
+class _LeaderGone(Exception):
+    """The computation being waited on was abandoned by its own request"""
+
+class SingleFlight:
+    """Lets concurrent callers with the same key share one computation.
+
+    The first caller for a key (the leader) runs the computation; callers
+    arriving while it runs wait for its result or exception instead of
+    starting their own. If the leader's client disconnects, or its task
+    is cancelled, the waiting callers start over and one of them takes
+    the lead. Runs on the event loop, so it needs no locking.
+    """
+
+    def __init__(self):
+        self.leaders = 0
+        self.coalesced = 0
+        self._flights: Dict[bytes, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def run(self, key: bytes, compute: Callable[[], Awaitable[bytes]]) -> bytes:
+        """Get ``await compute()``, sharing the computation with identical calls in flight"""
+        while True:
+            flight = self._flights.get(key)
+            if flight is None:
+                break
+            self.coalesced += 1
+            try:
+                # Shielded, so one waiter giving up does not cancel the flight for the others
+                return await asyncio.shield(flight)
+            except _LeaderGone:
+                self.coalesced -= 1
+
+        flight = asyncio.get_running_loop().create_future()
+        self._flights[key] = flight
+        self.leaders += 1
+        try:
+            value = await compute()
+        except ClientDisconnected:
+            flight.set_exception(_LeaderGone())
+            raise
+        except Exception as e:
+            flight.set_exception(e)
+            raise
+        except BaseException:
+            flight.set_exception(_LeaderGone())
+            raise
+        else:
+            flight.set_result(value)
+            return value
+        finally:
+            del self._flights[key]
+            # Nobody else may be waiting; mark the exception retrieved so asyncio does not log it
+            flight.exception()
+
+    def stats(self) -> Dict[str, int]:
+        """Get the number of computations run and of callers that shared one"""
+        return {"leaders": self.leaders, "coalesced": self.coalesced, "in_flight": len(self._flights)}
+
+# Cache of /calculate response bodies for this process
+result_cache = ResultCache()
+
+# Identical /calculate requests being calculated in this process
+single_flight = SingleFlight()
@@ -1,332 +1,340 @@
-from typing import Dict, List, Optional
+from array import array
+from fractions import Fraction
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
 from .models import Estate, FamilyTree, FamilyNode, Person, ParentType
+from .graph import FamilyGraph, NO_PERSON
+from .deadline import checkpoint
+from .liveness import LivenessIndex
+from .plans import SharePlan, SharePlanCache, share_plan_cache
+
+# Fixed fraction of the estate the spouse receives next to each heir class
+SPOUSE_FRACTIONS = {
+    1: Fraction(1, 4),
+    2: Fraction(1, 2),
+    3: Fraction(3, 4),
+}
+
+# Version of the inheritance rules and their rounding. Bump it with any change
+# that gives some family different shares, so results cached under the old
+# rules, such as scenario URLs, are not reused.
+RULES_VERSION = "1"
+
+class ShareLedger(Mapping[str, float]):
+    """Calculated shares keyed by person id, kept apart from the family tree.
+
+    Every person of the family graph has an entry, 0 for those who do not
+    inherit. The ledger is read-only, so it can be handed out freely.
+    """
+    __slots__ = ("_index", "_shares")
+
+    def __init__(self, graph: FamilyGraph, shares: array):
+        self._index = graph.index
+        self._shares = shares
+
+    def __getitem__(self, person_id: str) -> float:
+        return self._shares[self._index[person_id]]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def heirs(self) -> Dict[str, float]:
+        """Get the shares of everyone who inherits"""
+        return {person_id: share for person_id, share in self.items() if share > 0}
 
 class InheritanceResult:
     def __init__(self):
         self.total_distributed: float = 0
+        self.graph: Optional[FamilyGraph] = None
+        self.shares: array = array("d")
+        self.plan: Optional[SharePlan] = None
+        self.ledger: Optional[ShareLedger] = None
+
+    def share_map(self) -> Dict[str, float]:
+        """Get the shares of everyone who inherits, keyed by person id"""
+        ids = self.graph.ids
+        return {ids[person]: share for person, share in enumerate(self.shares) if share > 0}
 
 class InheritanceCalculator:
-    def __init__(self, estate: Estate):
+    def __init__(
+        self,
+        estate: Optional[Estate] = None,
+        graph: Optional[FamilyGraph] = None,
+        total_value: Optional[float] = None,
+        plan_cache: Optional[SharePlanCache] = share_plan_cache
+    ):
+        """Create a calculator for an estate, or directly for a compact family graph.
+
+        The family tree is never modified: shares are returned in the
+        result's ``ledger``, so one tree can be calculated many times and
+        from several threads at once. Share plans are looked up in and
+        stored to ``plan_cache``; pass ``None`` to always compile.
+        """
         self.estate = estate
-        self.family_tree = estate.family_tree
-        self.total_value = estate.total_value
+        if estate is not None:
+            self.family_tree = estate.family_tree
+            self.total_value = estate.total_value if total_value is None else total_value
+            self.graph = graph or FamilyGraph.from_family_node(self.family_tree.root)
+        elif graph is not None and total_value is not None:
+            self.family_tree = None
+            self.total_value = total_value
+            self.graph = graph
+        else:
+            raise ValueError("InheritanceCalculator needs an estate, or a graph and a total value")
+
+        self.plan_cache = plan_cache
         self.result = InheritanceResult()
+        self.shares = array("d")
+        self._fractions: Dict[int, Fraction] = {}
+        self._distributed = Fraction(0)
+        self._descendant_memo: Dict[int, List[Tuple[int, Fraction]]] = {}
+        self._liveness: Optional[LivenessIndex] = None
+        self._heir_degree: int = 0
 
     def calculate(self) -> InheritanceResult:
         """Calculate inheritance shares for all heirs"""
-        root = self.family_tree.root
-        
-        # Reset all shares
-        self._reset_shares(root)
-        
-        # Determine inheritance degree and distribute accordingly
-        if self._has_first_degree_heirs(root):
+        plan = self.share_plan()
+        amounts, total_distributed = plan.apply(self.total_value)
+
+        self.shares = array("d", [0.0]) * len(self.graph)
+        for heir, amount in amounts:
+            self.shares[heir] = amount
+
+        self.result = InheritanceResult()
+        self.result.total_distributed = total_distributed
+        self.result.graph = self.graph
+        self.result.shares = self.shares
+        self.result.plan = plan
+        self.result.ledger = ShareLedger(self.graph, self.shares)
+
+        return self.result
+
+    def share_plan(self) -> SharePlan:
+        """Get the share plan for this family graph, from the cache if possible"""
+        if self.plan_cache is None:
+            return self.compile_plan()
+
+        fingerprint = self.graph.fingerprint()
+        plan = self.plan_cache.get(fingerprint)
+        if plan is None:
+            plan = self.compile_plan()
+            self.plan_cache.put(fingerprint, plan)
+        return plan
+
+    def compile_plan(self) -> SharePlan:
+        """Work out the exact fraction of the estate every heir receives"""
+        root = self.graph.root
+        self._fractions = {}
+        self._distributed = Fraction(0)
+
+        # Index living descendants and find the heir class
+        self._annotate()
+        checkpoint()
+
+        # Distribute according to the heir class found by the annotation pass
+        if self._heir_degree == 1:
             self._distribute_first_degree(root)
-        elif self._has_second_degree_heirs(root):
+        elif self._heir_degree == 2:
             self._distribute_second_degree(root)
-        elif self._has_third_degree_heirs(root):
+        elif self._heir_degree == 3:
             self._distribute_third_degree(root)
         else:
             # If no heirs except spouse, spouse gets everything
-            if root.spouse and root.spouse.is_alive:
-                root.spouse.share = self.total_value
-                self.result.total_distributed = self.total_value
-        
-        return self.result
-
-    def _reset_shares(self, node: FamilyNode):
-        """Reset all shares to 0"""
-        if node.person:
-            node.person.share = 0
-        if node.spouse:
-            node.spouse.share = 0
-        for child in node.children:
-            self._reset_shares(child)
-        if node.parents:
-            for parent in node.parents.values():
-                if parent:
-                    self._reset_shares(parent)
-
-    def _has_first_degree_heirs(self, root: FamilyNode) -> bool:
+            spouse = self.graph.spouse[root]
+            if spouse != NO_PERSON and self.graph.alive[spouse]:
+                self._give(spouse, Fraction(1))
+
+        return SharePlan(list(self._fractions), list(self._fractions.values()))
+
+    def _annotate(self):
+        """Index the living descendants of every person and find the heir class of the root"""
+        graph = self.graph
+        self._liveness = LivenessIndex(graph)
+        # Descendant splits depend on liveness, so they start over with the index
+        self._descendant_memo = {}
+        self._heir_degree = self._classify_heirs(graph.root)
+
+    def _classify_heirs(self, root: int) -> int:
+        """Get the closest heir class with a living member, or 0 if there is none"""
+        if self._has_first_degree_heirs(root):
+            return 1
+        if self._has_second_degree_heirs(root):
+            return 2
+        if self._has_third_degree_heirs(root):
+            return 3
+        return 0
+
+    def _has_first_degree_heirs(self, root: int) -> bool:
         """Check if there are any living children or their descendants"""
-        return any(self._has_living_descendants(child) for child in root.children)
+        return any(self._has_living_descendants(child) for child in self.graph.children(root))
 
-    def _has_second_degree_heirs(self, root: FamilyNode) -> bool:
+    def _has_second_degree_heirs(self, root: int) -> bool:
         """Check if there are any living parents or siblings"""
-        if not root.parents:
-            return False
-        
-        for parent_node in root.parents.values():
-            if parent_node:
-                if parent_node.person and parent_node.person.is_alive:
+        graph = self.graph
+        for parent in graph.parents(root):
+            if graph.alive[parent]:
+                return True
+            for sibling in graph.children(parent):
+                if sibling != root and self._has_living_descendants(sibling):
                     return True
-                for sibling in parent_node.children:
-                    if sibling.person.id != root.person.id and self._has_living_descendants(sibling):
-                        return True
         return False
 
-    def _has_third_degree_heirs(self, root: FamilyNode) -> bool:
+    def _has_third_degree_heirs(self, root: int) -> bool:
         """Check if there are any living grandparents or uncles/aunts"""
-        if not root.parents:
-            return False
-
-        for parent_node in root.parents.values():
-            if not parent_node or not parent_node.parents:
-                continue
-            
-            for grandparent in parent_node.parents.values():
-                if grandparent:
-                    if grandparent.person and grandparent.person.is_alive:
+        graph = self.graph
+        for parent in graph.parents(root):
+            for grandparent in graph.parents(parent):
+                if graph.alive[grandparent]:
+                    return True
+                # Only check for living uncles/aunts, not their descendants
+                for uncle in graph.children(grandparent):
+                    if graph.alive[uncle] and uncle != parent:
                         return True
-                    # Only check for living uncles/aunts, not their descendants
-                    for uncle in grandparent.children:
-                        if (uncle.person and uncle.person.is_alive and 
-                            uncle.person.id != parent_node.person.id):
-                            return True
         return False
 
-    def _has_living_descendants(self, node: FamilyNode) -> bool:
-        """Check if a node has any living descendants"""
-        if node.person and node.person.is_alive:
-            return True
-        return any(self._has_living_descendants(child) for child in node.children)
+    def _has_living_descendants(self, person: int) -> bool:
+        """Check if a person is alive or has any living descendants"""
+        return self._liveness.has_living(person)
 
-    def _distribute_first_degree(self, root: FamilyNode):
-        """Distribute inheritance to first degree heirs (spouse and children)"""
-        spouse_share = 0.25 if root.spouse and root.spouse.is_alive else 0
-
-        if spouse_share > 0:
-            root.spouse.share = round(self.total_value * spouse_share, 2)
-            self.result.total_distributed += root.spouse.share
-
-        remaining_amount = self.total_value - self.result.total_distributed
-
-        # Get all valid branches (living children or deceased with heirs)
-        valid_branches = []
-        for child in root.children:
-            if child.person.is_alive:
-                valid_branches.append(child)
-            elif self._has_living_descendants(child):
-                valid_branches.append(child)
-
-        if valid_branches:
-            share_per_branch = remaining_amount / len(valid_branches)
-            total_distributed = 0
-
-            for i, branch in enumerate(valid_branches):
-                # Last branch gets the remainder to ensure total is exact
-                if i == len(valid_branches) - 1:
-                    branch_amount = round(remaining_amount - total_distributed, 2)
-                else:
-                    branch_amount = round(share_per_branch, 2)
-                    total_distributed += branch_amount
-
-                if branch.person.is_alive:
-                    branch.person.share = branch_amount
-                    self.result.total_distributed += branch_amount
-                else:
-                    self._distribute_to_children(branch.children, branch_amount)
-
-    def _distribute_to_children(self, children: List[FamilyNode], amount: float):
-        """Distribute amount equally among children or their descendants"""
-        valid_children = []
-        for child in children:
-            if child.person.is_alive:
-                valid_children.append(child)
-            elif self._has_living_descendants(child):
-                valid_children.append(child)
-
-        if not valid_children:
-            return
+    def _give(self, person: int, fraction: Fraction):
+        """Add a fraction of the estate to a person's share"""
+        self._fractions[person] = self._fractions.get(person, 0) + fraction
+        self._distributed += fraction
 
-        share_per_child = round(amount / len(valid_children), 2)
-        total_distributed = share_per_child * (len(valid_children) - 1)
-        
-        for i, child in enumerate(valid_children):
-            if i == len(valid_children) - 1:
-                # Last child gets the exact remainder
-                child_amount = round(amount - total_distributed, 2)
+    def _distribute_spouse_share(self, root: int):
+        """Give the spouse of the deceased their fixed fraction, if they are alive"""
+        graph = self.graph
+        spouse = graph.spouse[root]
+        if spouse != NO_PERSON and graph.alive[spouse]:
+            self._give(spouse, SPOUSE_FRACTIONS[self._heir_degree])
+
+    def _distribute_first_degree(self, root: int):
+        """Distribute inheritance to first degree heirs (spouse and children)"""
+        self._distribute_spouse_share(root)
+        self._distribute_to_children(self.graph.children(root), 1 - self._distributed)
+
+    def _distribute_to_children(self, children: List[int], fraction: Fraction):
+        """Distribute a fraction equally among children or their descendants"""
+        for child, child_fraction in self._split_among_children(children, fraction):
+            if self.graph.alive[child]:
+                self._give(child, child_fraction)
             else:
-                child_amount = share_per_child
+                for heir, heir_fraction in self._descendant_shares(child):
+                    self._give(heir, heir_fraction * child_fraction)
+
+    def _descendant_shares(self, person: int) -> List[Tuple[int, Fraction]]:
+        """Get how a portion passed to a deceased person splits among their descendants.
+
+        Results are fractions of the portion, in depth-first order, and are
+        memoized per person, so a branch reached through several relatives
+        is only walked once. The walk keeps a stack of pending portions
+        instead of recursing.
+        """
+        shares = self._descendant_memo.get(person)
+        if shares is not None:
+            return shares
+
+        graph = self.graph
+        shares = []
+        pending = [self._split_among_children(graph.children(person), Fraction(1))]
+        while pending:
+            checkpoint()
+            portion = next(pending[-1], None)
+            if portion is None:
+                pending.pop()
+                continue
 
-            if child.person.is_alive:
-                child.person.share = child_amount
-                self.result.total_distributed += child_amount
+            child, child_fraction = portion
+            if graph.alive[child]:
+                shares.append((child, child_fraction))
+            elif child in self._descendant_memo:
+                shares.extend(
+                    (heir, heir_fraction * child_fraction)
+                    for heir, heir_fraction in self._descendant_memo[child]
+                )
             else:
-                self._distribute_to_children(child.children, child_amount)
+                pending.append(self._split_among_children(graph.children(child), child_fraction))
 
-    def _distribute_second_degree(self, root: FamilyNode):
-        """Distribute inheritance to second degree heirs (spouse, parents, siblings)"""
-        spouse_share = 0.5 if root.spouse and root.spouse.is_alive else 0
+        self._descendant_memo[person] = shares
+        return shares
 
-        if spouse_share > 0:
-            root.spouse.share = round(self.total_value * spouse_share, 2)
-            self.result.total_distributed += root.spouse.share
+    def _split_among_children(self, children: List[int], fraction: Fraction):
+        """Yield ``(child, fraction)`` for every child with living descendants"""
+        valid_children = [child for child in children if self._has_living_descendants(child)]
+        for child in valid_children:
+            yield child, fraction / len(valid_children)
 
-        remaining_amount = self.total_value - self.result.total_distributed
-        maternal_amount = remaining_amount / 2
-        paternal_amount = remaining_amount - round(maternal_amount, 2)
+    def _distribute_second_degree(self, root: int):
+        """Distribute inheritance to second degree heirs (spouse, parents, siblings)"""
+        self._distribute_spouse_share(root)
+
+        side_fraction = (1 - self._distributed) / 2
 
         # Distribute maternal side
-        if root.parents.get(ParentType.MOTHER):
-            self._distribute_parent_share(
-                root.parents[ParentType.MOTHER],
-                root.person.id,
-                round(maternal_amount, 2)
-            )
+        mother = self.graph.mother[root]
+        if mother != NO_PERSON:
+            self._distribute_parent_share(mother, root, side_fraction)
 
         # Distribute paternal side
-        if root.parents.get(ParentType.FATHER):
-            self._distribute_parent_share(
-                root.parents[ParentType.FATHER],
-                root.person.id,
-                round(paternal_amount, 2)
-            )
-
-    def _distribute_parent_share(self, parent_node: FamilyNode, deceased_id: str, amount: float):
-        """Distribute a parent's share to them or their descendants"""
-        if parent_node.person and parent_node.person.is_alive:
-            parent_node.person.share = round(amount, 2)
-            self.result.total_distributed += amount
-            return
-
-        # Get valid siblings (excluding deceased)
-        valid_siblings = []
-        for child in parent_node.children:
-            if child.person.id != deceased_id:
-                if child.person.is_alive:
-                    valid_siblings.append(child)
-                elif self._has_living_descendants(child):
-                    valid_siblings.append(child)
+        father = self.graph.father[root]
+        if father != NO_PERSON:
+            self._distribute_parent_share(father, root, side_fraction)
 
-        if not valid_siblings:
+    def _distribute_parent_share(self, parent: int, deceased: int, fraction: Fraction):
+        """Distribute a parent's share to them or their descendants"""
+        graph = self.graph
+        if graph.alive[parent]:
+            self._give(parent, fraction)
             return
 
-        share_per_sibling = round(amount / len(valid_siblings), 2)
-        total_distributed = share_per_sibling * (len(valid_siblings) - 1)
-
-        for i, sibling in enumerate(valid_siblings):
-            if i == len(valid_siblings) - 1:
-                sibling_amount = round(amount - total_distributed, 2)
-            else:
-                sibling_amount = share_per_sibling
-
-            if sibling.person.is_alive:
-                sibling.person.share = sibling_amount
-                self.result.total_distributed += sibling_amount
-            else:
-                self._distribute_to_children(sibling.children, sibling_amount)
+        # Siblings (excluding deceased) and their descendants
+        siblings = [child for child in graph.children(parent) if child != deceased]
+        self._distribute_to_children(siblings, fraction)
 
-    def _distribute_third_degree(self, root: FamilyNode):
+    def _distribute_third_degree(self, root: int):
         """Distribute inheritance to third degree heirs (spouse, grandparents, uncles/aunts)"""
-        spouse_share = 0.75 if root.spouse and root.spouse.is_alive else 0
+        self._distribute_spouse_share(root)
 
-        if spouse_share > 0:
-            root.spouse.share = round(self.total_value * spouse_share, 2)
-            self.result.total_distributed += root.spouse.share
+        remaining = 1 - self._distributed
+        sides = self.graph.parents(root)
 
-        remaining_amount = self.total_value - self.result.total_distributed
+        # Split the remainder between the sides that exist
+        for parent in sides:
+            self._distribute_grandparents_share(parent, remaining / len(sides))
 
-        # Count living sides
-        maternal_side = root.parents and root.parents.get(ParentType.MOTHER)
-        paternal_side = root.parents and root.parents.get(ParentType.FATHER)
-
-        if maternal_side and paternal_side:
-            # Both sides exist, split remaining amount
-            maternal_amount = remaining_amount / 2
-            paternal_amount = remaining_amount - round(maternal_amount, 2)
-
-            # Distribute maternal side
-            self._distribute_grandparents_share(root.parents[ParentType.MOTHER], round(maternal_amount, 2))
-
-            # Distribute paternal side
-            self._distribute_grandparents_share(root.parents[ParentType.FATHER], round(paternal_amount, 2))
-        elif maternal_side:
-            # Only maternal side exists, give all remaining amount
-            self._distribute_grandparents_share(root.parents[ParentType.MOTHER], round(remaining_amount, 2))
-        elif paternal_side:
-            # Only paternal side exists, give all remaining amount
-            self._distribute_grandparents_share(root.parents[ParentType.FATHER], round(remaining_amount, 2))
-
-    def _distribute_grandparents_share(self, parent_node: FamilyNode, amount: float):
+    def _distribute_grandparents_share(self, parent: int, fraction: Fraction):
         """Distribute a side's share among grandparents or their children (uncles/aunts)"""
-        if not parent_node.parents:
+        graph = self.graph
+        grandparents = graph.parents(parent)
+        if not grandparents:
             return
 
-        grandmother = parent_node.parents.get(ParentType.MOTHER)
-        grandfather = parent_node.parents.get(ParentType.FATHER)
-
         # Count living grandparents
-        living_grandparents = []
-        if grandmother and grandmother.person and grandmother.person.is_alive:
-            living_grandparents.append(grandmother)
-        if grandfather and grandfather.person and grandfather.person.is_alive:
-            living_grandparents.append(grandfather)
+        living_grandparents = [grandparent for grandparent in grandparents if graph.alive[grandparent]]
 
         # Count living uncles/aunts
         living_uncles = []
-        for grandparent in [grandmother, grandfather]:
-            if grandparent:
-                for uncle in grandparent.children:
-                    if (uncle.person and uncle.person.is_alive and 
-                        uncle.person.id != parent_node.person.id):
-                        living_uncles.append(uncle)
+        for grandparent in grandparents:
+            for uncle in graph.children(grandparent):
+                if graph.alive[uncle] and uncle != parent:
+                    living_uncles.append(uncle)
 
         if living_grandparents and living_uncles:
-            # Split amount between grandparents and uncles/aunts
-            grandparent_share = round(amount / 2, 2)
-            uncle_share = round(amount - grandparent_share, 2)
-
-            # Distribute grandparent share
-            share_per_grandparent = round(grandparent_share / len(living_grandparents), 2)
-            total_distributed = share_per_grandparent * (len(living_grandparents) - 1)
-
-            for i, grandparent in enumerate(living_grandparents):
-                if i == len(living_grandparents) - 1:
-                    share = round(grandparent_share - total_distributed, 2)
-                else:
-                    share = share_per_grandparent
-
-                grandparent.person.share = share
-                self.result.total_distributed += share
-
-            # Distribute uncle share
-            share_per_uncle = round(uncle_share / len(living_uncles), 2)
-            total_distributed = share_per_uncle * (len(living_uncles) - 1)
-
-            for i, uncle in enumerate(living_uncles):
-                if i == len(living_uncles) - 1:
-                    share = round(uncle_share - total_distributed, 2)
-                else:
-                    share = share_per_uncle
-
-                uncle.person.share = share
-                self.result.total_distributed += share
+            # Split between grandparents and uncles/aunts
+            self._split_equally(living_grandparents, fraction / 2)
+            self._split_equally(living_uncles, fraction / 2)
 
         elif living_grandparents:
             # Only living grandparents get the share
-            share_per_grandparent = round(amount / len(living_grandparents), 2)
-            total_distributed = share_per_grandparent * (len(living_grandparents) - 1)
-
-            for i, grandparent in enumerate(living_grandparents):
-                if i == len(living_grandparents) - 1:
-                    share = round(amount - total_distributed, 2)
-                else:
-                    share = share_per_grandparent
-
-                grandparent.person.share = share
-                self.result.total_distributed += share
+            self._split_equally(living_grandparents, fraction)
 
         elif living_uncles:
             # Only living uncles/aunts get the share
-            share_per_uncle = round(amount / len(living_uncles), 2)
-            total_distributed = share_per_uncle * (len(living_uncles) - 1)
-
-            for i, uncle in enumerate(living_uncles):
-                if i == len(living_uncles) - 1:
-                    share = round(amount - total_distributed, 2)
-                else:
-                    share = share_per_uncle
+            self._split_equally(living_uncles, fraction)
 
-                uncle.person.share = share
-                self.result.total_distributed += share 
\ No newline at end of file
+    def _split_equally(self, heirs: List[int], fraction: Fraction):
+        """Split a fraction equally among living heirs"""
+        for heir in heirs:
+            self._give(heir, fraction / len(heirs))
@@ -0,0 +1,126 @@
+"""Per-request compute deadlines and cooperative cancellation."""
+import os
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, List, Optional
+
+# Seconds of compute a single calculation request may use; 0 disables the deadline
+CALCULATION_TIMEOUT = float(os.getenv("CALCULATION_TIMEOUT", "30"))
+
+# Checkpoints passed between two looks at the clock
+CHECK_INTERVAL = 256
+
+_current_deadline: ContextVar[Optional["Deadline"]] = ContextVar("deadline", default=None)
+
+class CalculationAborted(Exception):
+    """Raised at a checkpoint when the work of a request is no longer wanted"""
+    status_code = 500
+
+class DeadlineExceeded(CalculationAborted):
+    """The request used up its compute deadline"""
+    status_code = 408
+
+class ClientDisconnected(CalculationAborted):
+    """The client went away before the response was ready"""
+    # Non-standard status used by nginx for requests the client closed
+    status_code = 499
+
+class Deadline:
+    """Time budget of one request, plus a flag to cancel it early.
+
+    Long loops call ``checkpoint()``; the clock is only read every
+    ``CHECK_INTERVAL`` checkpoints, so checks are cheap enough for inner
+    loops. Deadlines use the monotonic clock, which on Linux is shared by
+    every process of the host, so they stay valid when pickled into a
+    worker process; cancellation only reaches threads of this process.
+    Work handed to a pool can register ``on_cancel`` callbacks to be
+    withdrawn while it is still queued.
+    """
+    __slots__ = ("timeout", "expires_at", "cancelled", "_countdown", "_on_cancel")
+
+    def __init__(self, timeout: Optional[float]):
+        self.timeout = timeout
+        self.expires_at = time.monotonic() + timeout if timeout else None
+        self.cancelled = False
+        self._countdown = CHECK_INTERVAL
+        self._on_cancel: List[Callable[[], Any]] = []
+
+    def cancel(self) -> None:
+        """Make the next look at the clock abort the work, and run the cancel callbacks"""
+        self.cancelled = True
+        self._countdown = 0
+        callbacks, self._on_cancel = self._on_cancel, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback: Callable[[], Any]) -> None:
+        """Call ``callback`` once the deadline is cancelled, right away if it already is"""
+        if self.cancelled:
+            callback()
+        else:
+            self._on_cancel.append(callback)
+
+    def remove_on_cancel(self, callback: Callable[[], Any]) -> None:
+        """Forget a callback registered with ``on_cancel``, if it has not run yet"""
+        if callback in self._on_cancel:
+            self._on_cancel.remove(callback)
+
+    def __getstate__(self):
+        # Callbacks belong to this process and are not sent to workers
+        return self.timeout, self.expires_at, self.cancelled, self._countdown
+
+    def __setstate__(self, state) -> None:
+        self.timeout, self.expires_at, self.cancelled, self._countdown = state
+        self._on_cancel = []
+
+    def check(self) -> None:
+        """Raise ``CalculationAborted`` every so often once the work should stop"""
+        self._countdown -= 1
+        if self._countdown > 0:
+            return
+        self._countdown = CHECK_INTERVAL
+        self.raise_if_aborted()
+
+    def raise_if_aborted(self) -> None:
+        """Raise ``CalculationAborted`` right away if the work should stop"""
+        if self.cancelled:
+            raise ClientDisconnected("Client disconnected before the calculation finished")
+        if self.expires_at is not None and time.monotonic() >= self.expires_at:
+            raise DeadlineExceeded(f"Calculation took longer than {self.timeout:g} seconds")
+
+def current_deadline() -> Optional[Deadline]:
+    """Get the deadline of the current request, if any"""
+    return _current_deadline.get()
+
+def set_deadline(deadline: Optional[Deadline]):
+    """Make ``deadline`` apply to the current context; returns a token for ``reset_deadline``"""
+    return _current_deadline.set(deadline)
+
+def reset_deadline(token) -> None:
+    _current_deadline.reset(token)
+
+def checkpoint() -> None:
+    """Abort the current request's work if its deadline passed or it was cancelled"""
+    deadline = _current_deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+def run_with_deadline(deadline: Deadline, func: Callable[[Any], Any], argument: Any) -> Any:
+    """Run ``func(argument)`` under ``deadline``; used to carry deadlines into worker processes"""
+    token = _current_deadline.set(deadline)
+    try:
+        return func(argument)
+    finally:
+        _current_deadline.reset(token)
+
+async def cancel_on_disconnect(receive: Callable, deadline: Deadline) -> None:
+    """Cancel ``deadline`` once the ASGI connection reports a disconnect.
+
+    Meant to run as a task next to a request whose body has been read;
+    cancel the task when the response is ready.
+    """
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            deadline.cancel()
+            return
@@ -0,0 +1,150 @@
+"""Response encoders that write validated results straight to bytes."""
+from typing import Any, Callable, List, Optional
+
+from pydantic import BaseModel
+from pydantic_core import to_json, to_jsonable_python
+
+try:
+    import msgpack
+except ImportError:  # optional; without it every response is JSON
+    msgpack = None
+
+JSON_MEDIA_TYPE = "application/json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+# Accept header values that ask for MessagePack
+MSGPACK_MEDIA_TYPES = (MSGPACK_MEDIA_TYPE, "application/x-msgpack")
+
+def negotiate_media_type(accept: Optional[str]) -> str:
+    """Pick the response media type for an Accept header.
+
+    MessagePack is used when the client lists it with a higher quality
+    than JSON and msgpack is installed; everything else gets JSON.
+    """
+    if not accept or msgpack is None:
+        return JSON_MEDIA_TYPE
+
+    best_type, best_quality = JSON_MEDIA_TYPE, 0.0
+    for entry in accept.split(","):
+        media_type, *params = (part.strip() for part in entry.split(";"))
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        media_type = media_type.lower()
+        if media_type in MSGPACK_MEDIA_TYPES:
+            media_type = MSGPACK_MEDIA_TYPE
+        elif media_type in (JSON_MEDIA_TYPE, "application/*", "*/*"):
+            media_type = JSON_MEDIA_TYPE
+        else:
+            continue
+        if quality > best_quality or (quality == best_quality and media_type == JSON_MEDIA_TYPE):
+            best_type, best_quality = media_type, quality
+    return best_type
+
+def encode_family_tree(root: BaseModel, encode_person: Callable[[Any], bytes]) -> bytes:
+    """Encode a family tree of ``FamilyNodeSchema`` nodes to JSON bytes.
+
+    References stay ``{"ref": ...}`` and other nodes have no ``ref`` key,
+    the shape responses have always had. The node structure is written
+    here and only persons go through pydantic-core. The walk uses an
+    explicit stack, so deep trees do not recurse.
+    """
+    out: List[bytes] = []
+    pending: List[Any] = [root]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, bytes):
+            out.append(item)
+            continue
+        if item.ref is not None:
+            out.append(b'{"ref":' + to_json(item.ref) + b"}")
+            continue
+
+        out.append(b'{"person":')
+        out.append(encode_person(item.person) if item.person is not None else b"null")
+        out.append(b',"spouse":')
+        out.append(encode_person(item.spouse) if item.spouse is not None else b"null")
+        out.append(b',"children":[')
+
+        # Everything after the opening of the child list, in output order
+        rest: List[Any] = []
+        for position, child in enumerate(item.children):
+            if position:
+                rest.append(b",")
+            rest.append(child)
+        rest.append(b'],"parents":')
+        if item.parents is None:
+            rest.append(b"null")
+        else:
+            rest.append(b"{")
+            for position, (parent_type, parent) in enumerate(item.parents.items()):
+                rest.append((b',' if position else b"") + to_json(parent_type) + b":")
+                rest.append(parent)
+            rest.append(b"}")
+        rest.append(b"}")
+        pending.extend(reversed(rest))
+    return b"".join(out)
+
+def pack_response(response: BaseModel, dump_person: Callable[[Any], Any]) -> bytes:
+    """Encode a calculation response to MessagePack, in the shape of its JSON.
+
+    Family trees are walked by ``pack_family_tree``; every other field is
+    dumped in JSON mode and packed as is. Nothing goes through JSON text.
+    """
+    packer = msgpack.Packer(autoreset=False, use_bin_type=True)
+    fields = type(response).model_fields
+    packer.pack_map_header(len(fields))
+    for name in fields:
+        value = getattr(response, name)
+        packer.pack(name)
+        if name == "family_tree":
+            pack_family_tree(packer, value, dump_person)
+        else:
+            packer.pack(to_jsonable_python(value))
+    return packer.bytes()
+
+def pack_family_tree(packer: Any, root: BaseModel, dump_person: Callable[[Any], Any]) -> None:
+    """Pack a family tree of ``FamilyNodeSchema`` nodes, shaped as ``encode_family_tree`` writes it.
+
+    MessagePack gives the length of every map and array up front, so
+    nodes are packed in order as they are reached. ``dump_person`` turns a
+    person into plain data. Like the JSON encoder, the walk uses an
+    explicit stack; it holds nodes and ``(pack, value)`` steps.
+    """
+    pending: List[Any] = [root]
+    while pending:
+        item = pending.pop()
+        if isinstance(item, tuple):
+            pack, value = item
+            pack(value)
+            continue
+        if item.ref is not None:
+            packer.pack_map_header(1)
+            packer.pack("ref")
+            packer.pack(to_jsonable_python(item.ref))
+            continue
+
+        packer.pack_map_header(4)
+        packer.pack("person")
+        packer.pack(dump_person(item.person) if item.person is not None else None)
+        packer.pack("spouse")
+        packer.pack(dump_person(item.spouse) if item.spouse is not None else None)
+        packer.pack("children")
+        packer.pack_array_header(len(item.children))
+
+        # Everything after the child list header, in output order
+        rest: List[Any] = list(item.children)
+        rest.append((packer.pack, "parents"))
+        if item.parents is None:
+            rest.append((packer.pack, None))
+        else:
+            rest.append((packer.pack_map_header, len(item.parents)))
+            for parent_type, parent in item.parents.items():
+                rest.append((packer.pack, to_jsonable_python(parent_type)))
+                rest.append(parent)
+        pending.extend(reversed(rest))
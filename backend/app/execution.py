@@ -0,0 +1,184 @@
+"""Executors used to run CPU-bound inheritance calculations off the event loop."""
+import asyncio
+import contextvars
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+from .deadline import Deadline, current_deadline, run_with_deadline
+from .telemetry import is_timing, merge_stages, run_timed
+
+logger = logging.getLogger(__name__)
+
+# Number of worker processes used for batch calculations and large trees
+PROCESS_WORKERS = max(1, int(os.getenv("CALCULATION_PROCESS_WORKERS", os.cpu_count() or 1)))
+
+# Number of threads used for medium-sized trees
+THREAD_WORKERS = max(1, int(os.getenv("CALCULATION_THREAD_WORKERS", str(min(32, (os.cpu_count() or 1) + 4)))))
+
+# Trees with at most this many nodes are calculated on the event loop
+INLINE_MAX_NODES = int(os.getenv("INLINE_MAX_NODES", "100"))
+
+# Trees with at most this many nodes (and more than INLINE_MAX_NODES) go to the thread pool
+THREAD_MAX_NODES = int(os.getenv("THREAD_MAX_NODES", "5000"))
+
+# Calculations running or waiting in each pool before new ones are turned away
+THREAD_QUEUE_LIMIT = int(os.getenv("THREAD_QUEUE_LIMIT", str(4 * THREAD_WORKERS)))
+PROCESS_QUEUE_LIMIT = int(os.getenv("PROCESS_QUEUE_LIMIT", str(2 * PROCESS_WORKERS)))
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_thread_pool: Optional[ThreadPoolExecutor] = None
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the shared process pool, creating it on first use"""
+    global _process_pool
+    if _process_pool is None:
+        logger.info("Starting calculation process pool with %d workers", PROCESS_WORKERS)
+        # Spawn instead of fork so workers never inherit the event loop's threads and locks
+        _process_pool = ProcessPoolExecutor(
+            max_workers=PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """Return the shared thread pool, creating it on first use"""
+    global _thread_pool
+    if _thread_pool is None:
+        logger.info("Starting calculation thread pool with %d threads", THREAD_WORKERS)
+        _thread_pool = ThreadPoolExecutor(max_workers=THREAD_WORKERS, thread_name_prefix="calculation")
+    return _thread_pool
+
+def shutdown_pools() -> None:
+    """Shut down any executor that has been started"""
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=True, cancel_futures=True)
+        _thread_pool = None
+
+class ExecutionQueueFull(Exception):
+    """Raised when a pool already has as many calculations as its queue limit allows"""
+
+    def __init__(self, tier: str, limit: int):
+        super().__init__(f"Too many calculations waiting for the {tier} pool (limit {limit})")
+        self.tier = tier
+        self.limit = limit
+
+class ExecutionPolicy:
+    """Decides where a calculation runs, based on the size of its family tree.
+
+    - up to ``inline_max_nodes``: inline on the event loop, where handing
+      off would cost more than the calculation
+    - up to ``thread_max_nodes``: in the thread pool, so the event loop
+      keeps serving other requests
+    - anything larger: in the bounded process pool
+
+    The current request's deadline (see ``app.deadline``) applies in
+    every tier, and its stage timings (see ``app.telemetry``) are kept.
+
+    Each pool admits at most its queue limit of running and waiting
+    calculations; beyond that ``ExecutionQueueFull`` is raised right away
+    instead of letting the queue, and every caller's latency, grow.
+    Work still waiting in a pool is withdrawn when its deadline is
+    cancelled, so a disconnected client does not hold on to a slot.
+    """
+
+    def __init__(
+        self,
+        inline_max_nodes: int = INLINE_MAX_NODES,
+        thread_max_nodes: int = THREAD_MAX_NODES,
+        thread_queue_limit: int = THREAD_QUEUE_LIMIT,
+        process_queue_limit: int = PROCESS_QUEUE_LIMIT
+    ):
+        self.inline_max_nodes = inline_max_nodes
+        self.thread_max_nodes = thread_max_nodes
+        self.limits = {"thread": thread_queue_limit, "process": process_queue_limit}
+        self._pending = {"thread": 0, "process": 0}
+        self._counts = {"inline": 0, "thread": 0, "process": 0, "rejected": 0}
+        self._lock = threading.Lock()
+
+    def tier(self, nodes: int) -> str:
+        """Get the tier a tree with ``nodes`` nodes runs in"""
+        if nodes <= self.inline_max_nodes:
+            return "inline"
+        if nodes <= self.thread_max_nodes:
+            return "thread"
+        return "process"
+
+    async def run(self, func: Callable[[Any], Any], argument: Any, nodes: int) -> Any:
+        """Run ``func(argument)`` in the tier for a tree of ``nodes`` nodes"""
+        tier = self.tier(nodes)
+        if tier == "inline":
+            self._count(tier)
+            return func(argument)
+
+        with self._lock:
+            if self._pending[tier] >= self.limits[tier]:
+                self._counts["rejected"] += 1
+                raise ExecutionQueueFull(tier, self.limits[tier])
+            self._pending[tier] += 1
+            self._counts[tier] += 1
+
+        deadline = current_deadline()
+        try:
+            if tier == "thread":
+                # Copy the context so stage timings are still recorded
+                context = contextvars.copy_context()
+                return await self._submit(get_thread_pool(), deadline, context.run, func, argument)
+            # Context variables do not cross into worker processes: the deadline is
+            # passed along and stage timings are sent back with the result
+            if deadline is not None:
+                func = partial(run_with_deadline, deadline, func)
+            if not is_timing():
+                return await self._submit(get_process_pool(), deadline, func, argument)
+            result, stages = await self._submit(get_process_pool(), deadline, partial(run_timed, func), argument)
+            merge_stages(stages)
+            return result
+        finally:
+            with self._lock:
+                self._pending[tier] -= 1
+
+    @staticmethod
+    async def _submit(pool: Executor, deadline: Optional[Deadline], func: Callable, *args: Any) -> Any:
+        """Run ``func(*args)`` in ``pool``, withdrawing it if ``deadline`` is cancelled while queued.
+
+        Work that has already started is not interrupted from here: a thread
+        stops at its next checkpoint, while a worker process does not see the
+        cancellation and finishes (its result is still cached by the caller).
+        """
+        future = pool.submit(func, *args)
+        if deadline is None:
+            return await asyncio.wrap_future(future)
+        deadline.on_cancel(future.cancel)
+        try:
+            return await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            # A withdrawn future cancels this await without cancelling the task
+            if not deadline.cancelled or asyncio.current_task().cancelling():
+                raise
+            deadline.raise_if_aborted()
+            raise
+        finally:
+            deadline.remove_on_cancel(future.cancel)
+
+    def stats(self) -> Dict[str, int]:
+        """Get calculation counts per tier and current pool queue depths"""
+        with self._lock:
+            return {
+                **self._counts,
+                "thread_pending": self._pending["thread"],
+                "process_pending": self._pending["process"],
+            }
+
+    def _count(self, tier: str) -> None:
+        with self._lock:
+            self._counts[tier] += 1
+
+# Policy used by /calculate in this process
+execution_policy = ExecutionPolicy()
@@ -0,0 +1,404 @@
+"""Compact, array-backed family graph used by the calculation core."""
+import hashlib
+from array import array
+from typing import Dict, List, Optional, Set, Tuple
+
+from .models import ParentType
+
+# Marker for a missing mother, father or spouse
+NO_PERSON = -1
+
+class FamilyGraph:
+    """A family tree with person ids interned to integer indices.
+
+    Every person is stored once, however often they appear in the input.
+    Per-person data lives in parallel arrays indexed by that integer:
+
+    - ``alive``: 1 if the person is alive, 0 otherwise
+    - ``mother`` / ``father`` / ``spouse``: index of the relative, or NO_PERSON
+    - ``child_index[child_offsets[i]:child_offsets[i + 1]]``: children of ``i``
+    - ``postorder``: every person, each one after all of their descendants
+    """
+    __slots__ = (
+        "ids", "index", "alive", "mother", "father", "spouse",
+        "child_offsets", "child_index", "postorder", "root", "_fingerprint"
+    )
+
+    def __init__(
+        self,
+        ids: List[str],
+        index: Dict[str, int],
+        alive: bytearray,
+        mother: array,
+        father: array,
+        spouse: array,
+        child_offsets: array,
+        child_index: array,
+        postorder: array,
+        root: int
+    ):
+        self.ids = ids
+        self.index = index
+        self.alive = alive
+        self.mother = mother
+        self.father = father
+        self.spouse = spouse
+        self.child_offsets = child_offsets
+        self.child_index = child_index
+        self.postorder = postorder
+        self.root = root
+        self._fingerprint: Optional[bytes] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def children(self, person: int) -> array:
+        """Get the indices of a person's children"""
+        return self.child_index[self.child_offsets[person]:self.child_offsets[person + 1]]
+
+    def parents(self, person: int) -> Tuple[int, ...]:
+        """Get the indices of a person's known parents, mother first"""
+        return tuple(p for p in (self.mother[person], self.father[person]) if p != NO_PERSON)
+
+    def fingerprint(self) -> bytes:
+        """Get a digest of the graph's shape and liveness.
+
+        Ids and names are not part of it, so families with the same
+        structure share a fingerprint however their members are called.
+        """
+        if self._fingerprint is None:
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(array("i", [len(self.ids), self.root]))
+            for part in (self.alive, self.mother, self.father, self.spouse, self.child_offsets, self.child_index):
+                digest.update(part)
+            self._fingerprint = digest.digest()
+        return self._fingerprint
+
+    @classmethod
+    def from_family_node(cls, root) -> "FamilyGraph":
+        """Build a graph from a nested family tree.
+
+        Works with any node exposing ``person``, ``spouse``, ``children`` and
+        ``parents`` (``FamilyNode`` or ``FamilyNodeSchema``).
+        """
+        builder = FamilyGraphBuilder()
+        seen = {id(root)}
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            person = builder.add_person(node.person.id, node.person.is_alive)
+
+            if node.spouse:
+                builder.set_spouse(person, builder.add_person(node.spouse.id, node.spouse.is_alive))
+
+            for child in node.children:
+                builder.add_child(person, builder.add_person(child.person.id, child.person.is_alive))
+                if id(child) not in seen:
+                    seen.add(id(child))
+                    pending.append(child)
+
+            if node.parents:
+                for parent_type, parent in node.parents.items():
+                    if not parent:
+                        continue
+                    builder.set_parent(
+                        person,
+                        ParentType(parent_type),
+                        builder.add_person(parent.person.id, parent.person.is_alive)
+                    )
+                    if id(parent) not in seen:
+                        seen.add(id(parent))
+                        pending.append(parent)
+
+        return builder.build(builder.index[root.person.id])
+
+    @classmethod
+    def from_persons(cls, persons, root_id: str) -> "FamilyGraph":
+        """Build a graph from a flat persons table.
+
+        Rows expose ``id``, ``is_alive``, ``mother_id``, ``father_id`` and
+        ``spouse_id``. Every person becomes a child of their mother and
+        father, in table order. Unknown or duplicate ids are rejected.
+        """
+        builder = FamilyGraphBuilder()
+        for row in persons:
+            if row.id in builder.index:
+                raise ValueError(f"Duplicate person id '{row.id}'")
+            builder.add_person(row.id, row.is_alive)
+        if root_id not in builder.index:
+            raise ValueError(f"Deceased person '{root_id}' is not in the persons table")
+
+        index = builder.index
+        for row in persons:
+            person = index[row.id]
+            for parent_type, relative_id in (
+                (ParentType.MOTHER, row.mother_id),
+                (ParentType.FATHER, row.father_id),
+                (None, row.spouse_id),
+            ):
+                if relative_id is None:
+                    continue
+                relative = index.get(relative_id)
+                if relative is None:
+                    raise ValueError(f"Person '{row.id}' references unknown person '{relative_id}'")
+                if parent_type is None:
+                    builder.set_spouse(person, relative)
+                else:
+                    builder.set_parent(person, parent_type, relative)
+                    builder.add_child(relative, person)
+
+        return builder.build(index[root_id])
+
+class FamilyGraphBuilder:
+    """Interns persons and relations one at a time, then freezes them into a FamilyGraph"""
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.alive = bytearray()
+        self.mother = array("i")
+        self.father = array("i")
+        self.spouse = array("i")
+        self.children: List[List[int]] = []
+        self._edges: Set[Tuple[int, int]] = set()
+
+    def add_person(self, person_id: str, is_alive: bool) -> int:
+        """Intern a person id and return its index; the first occurrence wins"""
+        person = self.index.get(person_id)
+        if person is not None:
+            return person
+
+        person = len(self.ids)
+        self.ids.append(person_id)
+        self.index[person_id] = person
+        self.alive.append(1 if is_alive else 0)
+        self.mother.append(NO_PERSON)
+        self.father.append(NO_PERSON)
+        self.spouse.append(NO_PERSON)
+        self.children.append([])
+        return person
+
+    def add_child(self, parent: int, child: int) -> None:
+        """Record a parent-child edge, keeping the order children were added in"""
+        if (parent, child) not in self._edges:
+            self._edges.add((parent, child))
+            self.children[parent].append(child)
+
+    def set_parent(self, child: int, parent_type: ParentType, parent: int) -> None:
+        """Record a person's mother or father, unless it is already known"""
+        parents = self.mother if parent_type == ParentType.MOTHER else self.father
+        if parents[child] == NO_PERSON:
+            parents[child] = parent
+
+    def set_spouse(self, person: int, spouse: int) -> None:
+        """Record a person's spouse, unless it is already known"""
+        if self.spouse[person] == NO_PERSON:
+            self.spouse[person] = spouse
+
+    def build(self, root: int) -> FamilyGraph:
+        """Freeze the collected persons into a FamilyGraph rooted at ``root``"""
+        child_offsets = array("i", [0])
+        child_index = array("i")
+        for children in self.children:
+            child_index.extend(children)
+            child_offsets.append(len(child_index))
+
+        return FamilyGraph(
+            ids=self.ids,
+            index=self.index,
+            alive=self.alive,
+            mother=self.mother,
+            father=self.father,
+            spouse=self.spouse,
+            child_offsets=child_offsets,
+            child_index=child_index,
+            postorder=self._postorder(),
+            root=root
+        )
+
+    def _postorder(self) -> array:
+        """Order persons so that descendants come first, rejecting cycles"""
+        UNVISITED, ACTIVE, DONE = 0, 1, 2
+        state = bytearray(len(self.ids))
+        order = array("i")
+        for start in range(len(self.ids)):
+            if state[start] != UNVISITED:
+                continue
+            state[start] = ACTIVE
+            stack = [(start, iter(self.children[start]))]
+            while stack:
+                person, children = stack[-1]
+                for child in children:
+                    if state[child] == ACTIVE:
+                        raise ValueError(
+                            f"Family tree contains a cycle through person '{self.ids[child]}'"
+                        )
+                    if state[child] == UNVISITED:
+                        state[child] = ACTIVE
+                        stack.append((child, iter(self.children[child])))
+                        break
+                else:
+                    stack.pop()
+                    state[person] = DONE
+                    order.append(person)
+        return order
+
+class EditableFamilyGraph:
+    """A copy of a FamilyGraph that can be edited in place.
+
+    Indices stay stable across edits: new persons are appended and removed
+    persons keep their slot, flagged in ``removed``. Besides the children of
+    every person it tracks ``listed_by``, the persons listing them as a
+    child, so edits can be propagated to ancestors.
+    """
+    __slots__ = (
+        "ids", "index", "alive", "removed", "mother", "father", "spouse",
+        "listed_by", "root", "_children", "_referrers", "_references"
+    )
+
+    def __init__(self, graph: FamilyGraph):
+        size = len(graph)
+        self.ids = list(graph.ids)
+        self.index = dict(graph.index)
+        self.alive = bytearray(graph.alive)
+        self.removed = bytearray(size)
+        self.mother = array("i", graph.mother)
+        self.father = array("i", graph.father)
+        self.spouse = array("i", graph.spouse)
+        self.root = graph.root
+        self._children: List[List[int]] = [list(graph.children(person)) for person in range(size)]
+        self.listed_by: List[List[int]] = [[] for _ in range(size)]
+        # Persons having someone as their mother, father or spouse
+        self._referrers: List[List[int]] = [[] for _ in range(size)]
+        # Number of edges of any kind pointing at a person
+        self._references = array("i", [0]) * size
+
+        for person in range(size):
+            for child in self._children[person]:
+                self.listed_by[child].append(person)
+                self._references[child] += 1
+            for relatives in (self.mother, self.father, self.spouse):
+                if relatives[person] != NO_PERSON:
+                    self._referrers[relatives[person]].append(person)
+                    self._references[relatives[person]] += 1
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def children(self, person: int) -> List[int]:
+        """Get the indices of a person's children"""
+        return self._children[person]
+
+    def parents(self, person: int) -> Tuple[int, ...]:
+        """Get the indices of a person's known parents, mother first"""
+        return tuple(p for p in (self.mother[person], self.father[person]) if p != NO_PERSON)
+
+    def person(self, person_id: str) -> int:
+        """Get the index of a person id, rejecting unknown ids"""
+        person = self.index.get(person_id)
+        if person is None:
+            raise ValueError(f"Unknown person '{person_id}'")
+        return person
+
+    def set_alive(self, person: int, is_alive: bool) -> None:
+        """Mark a person as alive or deceased"""
+        self.alive[person] = 1 if is_alive else 0
+
+    def add_child(self, parent: int, child_id: str, is_alive: bool) -> int:
+        """Add a child under a person and return its index.
+
+        A known ``child_id`` links the existing person, like a repeated id in
+        a nested tree; an edge that would make a person their own ancestor is
+        rejected.
+        """
+        child = self.index.get(child_id)
+        if child is None:
+            child = self._add_person(child_id, is_alive)
+        elif child in self._children[parent]:
+            return child
+        elif self._is_descendant(parent, child):
+            raise ValueError(f"Family tree contains a cycle through person '{child_id}'")
+
+        self._children[parent].append(child)
+        self.listed_by[child].append(parent)
+        self._references[child] += 1
+        return child
+
+    def remove(self, person: int) -> List[int]:
+        """Remove a person together with everyone only reachable through them.
+
+        Returns the indices of all removed persons, ``person`` first.
+        """
+        if person == self.root:
+            raise ValueError("The deceased person cannot be removed from their family tree")
+
+        self._detach(person)
+        removed = []
+        pending = [person]
+        while pending:
+            current = pending.pop()
+            removed.append(current)
+            self.removed[current] = 1
+            self.alive[current] = 0
+            del self.index[self.ids[current]]
+
+            for child in self._children[current]:
+                self.listed_by[child].remove(current)
+                self._release(child, pending)
+            self._children[current] = []
+
+            for relatives in (self.mother, self.father, self.spouse):
+                relative = relatives[current]
+                if relative != NO_PERSON:
+                    relatives[current] = NO_PERSON
+                    self._referrers[relative].remove(current)
+                    self._release(relative, pending)
+
+        return removed
+
+    def _add_person(self, person_id: str, is_alive: bool) -> int:
+        person = len(self.ids)
+        self.ids.append(person_id)
+        self.index[person_id] = person
+        self.alive.append(1 if is_alive else 0)
+        self.removed.append(0)
+        self.mother.append(NO_PERSON)
+        self.father.append(NO_PERSON)
+        self.spouse.append(NO_PERSON)
+        self._children.append([])
+        self.listed_by.append([])
+        self._referrers.append([])
+        self._references.append(0)
+        return person
+
+    def _is_descendant(self, person: int, ancestor: int) -> bool:
+        """Check whether ``person`` is ``ancestor`` or one of their descendants"""
+        seen = {ancestor}
+        pending = [ancestor]
+        while pending:
+            current = pending.pop()
+            if current == person:
+                return True
+            for child in self._children[current]:
+                if child not in seen:
+                    seen.add(child)
+                    pending.append(child)
+        return False
+
+    def _detach(self, person: int) -> None:
+        """Drop every edge pointing at a person"""
+        for parent in self.listed_by[person]:
+            self._children[parent].remove(person)
+        for referrer in self._referrers[person]:
+            for relatives in (self.mother, self.father, self.spouse):
+                if relatives[referrer] == person:
+                    relatives[referrer] = NO_PERSON
+        self.listed_by[person] = []
+        self._referrers[person] = []
+        self._references[person] = 0
+
+    def _release(self, person: int, pending: List[int]) -> None:
+        """Drop one edge pointing at a person, queueing them for removal once none is left"""
+        self._references[person] -= 1
+        if self._references[person] == 0 and person != self.root:
+            pending.append(person)
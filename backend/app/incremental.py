@@ -0,0 +1,123 @@
+"""Incremental recalculation of a family graph under single-field edits."""
+from typing import Dict, Optional, Set, Tuple
+
+from .calculations import InheritanceCalculator
+from .graph import EditableFamilyGraph, FamilyGraph
+from .liveness import LivenessIndex
+from .plans import SharePlan
+
+class ShareUpdate:
+    """Shares after an edit, and the heirs whose share changed"""
+
+    def __init__(
+        self,
+        shares: Dict[str, float],
+        total_distributed: float,
+        changed: Dict[str, Tuple[float, float]]
+    ):
+        self.shares = shares
+        self.total_distributed = total_distributed
+        # Person id -> (share before the edit, share after it)
+        self.changed = changed
+
+class IncrementalCalculator(InheritanceCalculator):
+    """A calculation kept alive across edits to its family graph.
+
+    Every edit marks the persons it touched and all of their ancestors as
+    dirty. Recalculating drops only their memoized descendant splits, so the
+    splits of untouched branches are reused when the plan is recompiled.
+    Liveness changes update the liveness index along the person's
+    ancestors; adding or removing persons rebuilds it. Changing the
+    estate value reuses the plan as is.
+    """
+
+    def __init__(self, graph: FamilyGraph, total_value: float):
+        super().__init__(graph=EditableFamilyGraph(graph), total_value=total_value, plan_cache=None)
+        self._dirty: Set[int] = set(range(len(self.graph)))
+        self._plan: Optional[SharePlan] = None
+        self._current: Dict[str, float] = {}
+
+    def recalculate(self) -> ShareUpdate:
+        """Calculate the shares, reporting which heirs changed since the last call"""
+        result = self.calculate()
+        shares = result.share_map()
+        previous = self._current
+
+        changed = {}
+        for person_id, share in shares.items():
+            if previous.get(person_id, 0) != share:
+                changed[person_id] = (previous.get(person_id, 0), share)
+        for person_id, share in previous.items():
+            if person_id not in shares:
+                changed[person_id] = (share, 0)
+
+        self._current = shares
+        return ShareUpdate(shares, result.total_distributed, changed)
+
+    def set_alive(self, person_id: str, is_alive: bool) -> ShareUpdate:
+        """Mark a person as alive or deceased and recalculate"""
+        person = self.graph.person(person_id)
+        if bool(self.graph.alive[person]) != is_alive:
+            self.graph.set_alive(person, is_alive)
+            if self._liveness is not None:
+                self._liveness.set_alive(person, is_alive)
+            self._mark_dirty(person)
+        return self.recalculate()
+
+    def add_child(self, parent_id: str, child_id: str, is_alive: bool = True) -> ShareUpdate:
+        """Add a child under a person and recalculate"""
+        parent = self.graph.person(parent_id)
+        self.graph.add_child(parent, child_id, is_alive)
+        self._liveness = None
+        self._mark_dirty(parent)
+        return self.recalculate()
+
+    def remove_person(self, person_id: str) -> ShareUpdate:
+        """Remove a person and everyone only reachable through them, then recalculate"""
+        graph = self.graph
+        person = graph.person(person_id)
+        parents = list(graph.listed_by[person])
+
+        for removed in graph.remove(person):
+            self._descendant_memo.pop(removed, None)
+            self._dirty.discard(removed)
+
+        for parent in parents:
+            if not graph.removed[parent]:
+                self._mark_dirty(parent)
+        self._liveness = None
+        # Removing a parent or spouse changes the heir class even when no branch changes
+        self._plan = None
+        return self.recalculate()
+
+    def set_total_value(self, total_value: float) -> ShareUpdate:
+        """Change the estate value and recalculate without recompiling the plan"""
+        self.total_value = total_value
+        return self.recalculate()
+
+    def share_plan(self) -> SharePlan:
+        """Get the share plan, recompiling it only after edits"""
+        if self._plan is None or self._dirty:
+            self._plan = self.compile_plan()
+        return self._plan
+
+    def _mark_dirty(self, person: int):
+        """Mark a person and all of their ancestors as dirty"""
+        listed_by = self.graph.listed_by
+        dirty = self._dirty
+        dirty.add(person)
+        pending = [person]
+        while pending:
+            for parent in listed_by[pending.pop()]:
+                if parent not in dirty:
+                    dirty.add(parent)
+                    pending.append(parent)
+
+    def _annotate(self):
+        """Rebuild the liveness index if needed, forget dirty splits and classify the heirs"""
+        if self._liveness is None:
+            self._liveness = LivenessIndex(self.graph)
+        for person in self._dirty:
+            self._descendant_memo.pop(person, None)
+        self._dirty = set()
+        self._heir_degree = self._classify_heirs(self.graph.root)
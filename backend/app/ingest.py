@@ -0,0 +1,133 @@
+"""Reading and checking raw request bodies before they are parsed."""
+import os
+import re
+import zlib
+from array import array
+from itertools import accumulate
+from typing import List, Optional
+
+from fastapi import HTTPException, Request
+
+# Largest request body accepted, in bytes after decompression
+REQUEST_MAX_BYTES = int(os.getenv("REQUEST_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# Deepest nesting of JSON objects and arrays accepted in a request body. Each
+# generation of a nested tree is two levels; pydantic validation stops at 253
+# generations, which is 509 levels.
+REQUEST_MAX_DEPTH = int(os.getenv("REQUEST_MAX_DEPTH", "509"))
+
+_JSON_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.DOTALL)
+# Opening brackets map to +1 and closing ones to -1 when read as signed bytes
+_BRACKET_STEPS = bytes.maketrans(b"{[}]", b"\x01\x01\xff\xff")
+_NOT_BRACKETS = bytes(byte for byte in range(256) if byte not in b"{[}]")
+_NOT_STRUCTURE = bytes(byte for byte in range(256) if byte not in b'{[}]"')
+# Everything up to and including the next bracket outside a string
+_NEXT_BRACKET = re.compile(rb'[^][{}"]*+(?:"(?:[^"\\]++|\\.)*+"[^][{}"]*+)*+([][{}])', re.DOTALL)
+
+def too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Request body is larger than {limit} bytes")
+
+async def read_body(request: Request, max_bytes: Optional[int] = None) -> bytearray:
+    """Read a request body, inflating it if it is gzip-encoded.
+
+    The limit applies to the decoded body and is enforced while reading,
+    so oversized bodies and gzip bombs are turned away with a 413 without
+    ever being held in memory.
+    """
+    if max_bytes is None:
+        max_bytes = REQUEST_MAX_BYTES
+    encoding = request.headers.get("content-encoding", "identity").strip().lower()
+    if encoding == "gzip":
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding in ("identity", ""):
+        decompressor = None
+    else:
+        raise HTTPException(status_code=415, detail=f"Unsupported content encoding: {encoding}")
+
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_bytes:
+        raise too_large(max_bytes)
+
+    body = bytearray()
+    async for chunk in request.stream():
+        if decompressor is not None:
+            try:
+                chunk = decompressor.decompress(chunk, max_bytes + 1 - len(body))
+            except zlib.error:
+                raise HTTPException(status_code=400, detail="Request body is not valid gzip")
+            if decompressor.unconsumed_tail:
+                raise too_large(max_bytes)
+        body += chunk
+        if len(body) > max_bytes:
+            raise too_large(max_bytes)
+
+    if decompressor is not None and not decompressor.eof:
+        raise HTTPException(status_code=400, detail="Request body is truncated gzip")
+    return body
+
+def json_depth(raw: bytes) -> int:
+    """Get the deepest nesting of objects and arrays in a JSON document without parsing it.
+
+    Brackets inside strings do not count. Usually no string holds a
+    bracket or an escaped quote: then keeping only brackets and quotes
+    leaves every string as an adjacent pair of quotes that one
+    ``replace`` removes. Otherwise string literals are blanked out with a
+    regular expression first. Either way the depth is then summed in C.
+    """
+    structure = None
+    if b'\\"' not in raw:
+        structure = raw.translate(None, _NOT_STRUCTURE).replace(b'""', b"")
+        if b'"' in structure:
+            structure = None
+    if structure is None:
+        structure = _JSON_STRING.sub(b"", raw).translate(None, _NOT_BRACKETS)
+
+    steps = array("b")
+    steps.frombytes(structure.translate(_BRACKET_STEPS))
+    return max(accumulate(steps), default=0)
+
+def estimate_nodes(raw: bytes) -> int:
+    """Estimate the nodes of a nested request, or the rows of a flat one, without parsing it.
+
+    Every nested node opens with a ``"person"`` or ``"ref"`` key and every
+    row of a persons table has an ``"id"``; counting them is a few passes
+    in C. The estimate only picks where a request is calculated, so the
+    rare miscount (say, a name spelled ``"person"``) costs nothing else.
+    """
+    nodes = raw.count(b'"person"') + raw.count(b'"ref"')
+    return nodes or raw.count(b'"id"')
+
+def split_json_array(raw: bytes) -> List[bytes]:
+    """Split a JSON array of objects into the raw bytes of each object without parsing them.
+
+    Only brackets outside strings are looked at, so every item can be
+    checked and parsed on its own, wherever it is calculated; a malformed
+    item is left for its own parse to report. Raises ``ValueError`` if
+    the body is not an array of objects.
+    """
+    body = bytes(raw).strip()
+    if not body.startswith(b"[") or not body.endswith(b"]"):
+        raise ValueError("Request body must be a JSON array")
+    items = []
+    depth = 0
+    start = end = 1
+    for match in _NEXT_BRACKET.finditer(body, 1, len(body) - 1):
+        if match.group(1) in b"{[":
+            if depth == 0:
+                if body[end:match.start(1)].strip() != (b"," if items else b""):
+                    raise ValueError("Batch items must be JSON objects")
+                start = match.start(1)
+            depth += 1
+        else:
+            depth -= 1
+            if depth < 0:
+                raise ValueError("Request body must be a JSON array")
+            if depth == 0:
+                end = match.end()
+                items.append(body[start:end])
+    if depth:
+        # The last item never closed; its own parse reports where
+        items.append(body[start:-1])
+    elif body[end:-1].strip():
+        raise ValueError("Batch items must be JSON objects")
+    return items
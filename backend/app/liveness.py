@@ -0,0 +1,77 @@
+"""Subtree liveness index over a family graph."""
+import heapq
+from array import array
+from typing import Dict, List
+
+class LivenessIndex:
+    """Counts of living persons in every branch, kept up to date under liveness changes.
+
+    Every person is indexed once, however many parents list them. Counts
+    are built children first in one pass over the graph, so a branch
+    shared by several parents is counted in each of them, matching the
+    living-descendant counts of the calculator. Looking up a branch is
+    O(1); changing someone's liveness walks their ancestors once, in
+    topological order, each ancestor getting the change times the number
+    of ways down to that person.
+    """
+    __slots__ = ("_alive", "_living", "_listed_by", "_rank")
+
+    def __init__(self, graph):
+        size = len(graph)
+        listed_by: List[List[int]] = [[] for _ in range(size)]
+        unresolved = array("i", [0]) * size
+        for person in range(size):
+            children = graph.children(person)
+            unresolved[person] = len(children)
+            for child in children:
+                listed_by[child].append(person)
+
+        # Children before parents: a person is ready once all of their children are
+        self._alive = bytearray(graph.alive)
+        self._living = [0] * size
+        self._rank = array("i", [0]) * size
+        self._listed_by = listed_by
+        ready = [person for person in range(size) if not unresolved[person]]
+        rank = 0
+        while ready:
+            person = ready.pop()
+            self._rank[person] = rank
+            rank += 1
+            self._living[person] = self._alive[person] + sum(
+                self._living[child] for child in graph.children(person)
+            )
+            for parent in listed_by[person]:
+                unresolved[parent] -= 1
+                if not unresolved[parent]:
+                    ready.append(parent)
+        if rank < size:
+            raise ValueError("Family tree contains a cycle")
+
+    def living(self, person: int) -> int:
+        """Count the living persons in a branch, the person included"""
+        return self._living[person]
+
+    def has_living(self, person: int) -> bool:
+        """Check if a person is alive or has any living descendants"""
+        return self._living[person] > 0
+
+    def set_alive(self, person: int, is_alive: bool) -> None:
+        """Change a person's liveness in every branch they appear in"""
+        alive = 1 if is_alive else 0
+        delta = alive - self._alive[person]
+        if not delta:
+            return
+        self._alive[person] = alive
+
+        # An ancestor is updated once every branch between it and the person has been
+        changes: Dict[int, int] = {person: delta}
+        pending = [(self._rank[person], person)]
+        while pending:
+            _, current = heapq.heappop(pending)
+            change = changes.pop(current)
+            self._living[current] += change
+            for parent in self._listed_by[current]:
+                if parent not in changes:
+                    changes[parent] = 0
+                    heapq.heappush(pending, (self._rank[parent], parent))
+                changes[parent] += change
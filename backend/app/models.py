@@ -1,6 +1,6 @@
 from enum import Enum
 from typing import List, Optional, Dict
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 
 class ParentType(str, Enum):
     MOTHER = "mother"
@@ -11,21 +11,27 @@ class MarriageInfo(BaseModel):
     is_current: bool = True
 
 class Person(BaseModel):
-    """Base class for representing a person in the family tree."""
+    """Base class for representing a person in the family tree.
+
+    Persons are immutable; calculated shares are kept in a separate
+    ``ShareLedger`` keyed by person id.
+    """
+    model_config = ConfigDict(frozen=True)
+
     id: str
     name: str
     is_alive: bool = True
     marriage_info: Optional[MarriageInfo] = None
     parent_id: Optional[str] = None
-    share: float = 0
-    share_ratio: float = 0
-
-    def get_share(self) -> float:
-        """Get this person's share of the inheritance."""
-        return self.share
 
 class FamilyNode(BaseModel):
-    """Represents a node in the family tree."""
+    """Represents a node in the family tree.
+
+    Nodes are immutable so a tree can be cached, shared between threads
+    and calculated concurrently.
+    """
+    model_config = ConfigDict(frozen=True)
+
     person: Person
     spouse: Optional[Person] = None
     children: List['FamilyNode'] = []
@@ -53,11 +59,13 @@ class FamilyNode(BaseModel):
                         if sibling_node.person.is_alive:
                             siblings.append(sibling_node.person)
                         else:
-                            # Add living children of deceased siblings
+                            # Add living children of deceased siblings, as copies
+                            # pointing at the sibling they inherit through
                             for child_node in sibling_node.children:
                                 if child_node.person.is_alive:
-                                    child_node.person.parent_id = sibling_node.person.id
-                                    siblings.append(child_node.person)
+                                    siblings.append(child_node.person.model_copy(
+                                        update={"parent_id": sibling_node.person.id}
+                                    ))
         return list({s.id: s for s in siblings}.values())  # Remove duplicates
 
     def get_living_parents(self) -> List[Person]:
@@ -86,44 +94,33 @@ class FamilyNode(BaseModel):
         
         # Add spouse if alive
         if self.spouse and self.spouse.is_alive:
-            self.spouse.share = 0  # Reset share
             heirs.append(self.spouse)
 
         # Add living descendants
         descendants = self.get_living_descendants()
-        for descendant in descendants:
-            descendant.share = 0  # Reset share
         heirs.extend(descendants)
 
         # If no descendants, add parents and their descendants
         if not descendants:
             parents = self.get_living_parents()
-            for parent in parents:
-                parent.share = 0  # Reset share
             heirs.extend(parents)
 
+            siblings = []
             if len(parents) < 2:  # If not both parents are alive
                 siblings = self.get_living_siblings()
-                for sibling in siblings:
-                    sibling.share = 0  # Reset share
                 heirs.extend(siblings)
 
             # If no parents or siblings, add grandparents and uncles
             if not (parents or siblings):
-                grandparents = self.get_living_grandparents()
-                for grandparent in grandparents:
-                    grandparent.share = 0  # Reset share
-                heirs.extend(grandparents)
-
-                uncles = self.get_living_uncles()
-                for uncle in uncles:
-                    uncle.share = 0  # Reset share
-                heirs.extend(uncles)
+                heirs.extend(self.get_living_grandparents())
+                heirs.extend(self.get_living_uncles())
 
         return heirs
 
 class FamilyTree(BaseModel):
     """Represents the entire family tree with the deceased person as the root."""
+    model_config = ConfigDict(frozen=True)
+
     root: FamilyNode
 
     def get_living_heirs(self) -> List[Person]:
@@ -0,0 +1,105 @@
+"""Estate-value-independent share plans and their cache."""
+import os
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+from typing import Dict, List, Optional, Tuple
+
+# Maximum number of share plans kept by the default cache
+SHARE_PLAN_CACHE_SIZE = int(os.getenv("SHARE_PLAN_CACHE_SIZE", "1024"))
+
+CENT = Fraction(1, 100)
+
+class SharePlan:
+    """The exact fraction of the estate each heir receives.
+
+    Heirs are graph indices in the order they were given their share, so
+    one plan serves every family graph with the same fingerprint.
+    """
+    __slots__ = ("heirs", "fractions")
+
+    def __init__(self, heirs: List[int], fractions: List[Fraction]):
+        self.heirs = heirs
+        self.fractions = fractions
+
+    def __len__(self) -> int:
+        return len(self.heirs)
+
+    def apply(self, total_value: float) -> Tuple[List[Tuple[int, float]], float]:
+        """Turn the plan into amounts for an estate value.
+
+        Amounts are rounded to cents with the largest remainder method: every
+        amount is rounded down, then the cents still missing from the
+        rounded total go to the heirs who lost the most, earlier heirs
+        first on ties. Amounts add up exactly to the distributed total and
+        none is more than a cent away from its exact value.
+        Returns ``([(heir, amount), ...], total_distributed)``.
+        """
+        if not self.heirs:
+            return [], 0
+
+        value = Fraction(total_value)
+        exact = [value * fraction / CENT for fraction in self.fractions]
+        cents = [amount.numerator // amount.denominator for amount in exact]
+        total_cents = round(sum(exact))
+        leftover = total_cents - sum(cents)
+        by_remainder = sorted(range(len(exact)), key=lambda position: cents[position] - exact[position])
+        for position in by_remainder[:leftover]:
+            cents[position] += 1
+
+        amounts = [(heir, float(amount * CENT)) for heir, amount in zip(self.heirs, cents)]
+        return amounts, float(total_cents * CENT)
+
+class SharePlanCache:
+    """Thread-safe LRU cache of share plans keyed by family graph fingerprint"""
+
+    def __init__(self, max_entries: int = SHARE_PLAN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._plans: "OrderedDict[bytes, SharePlan]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._plans)
+
+    def get(self, fingerprint: bytes) -> Optional[SharePlan]:
+        """Get a cached plan, marking it as recently used"""
+        with self._lock:
+            plan = self._plans.get(fingerprint)
+            if plan is None:
+                self.misses += 1
+                return None
+            self._plans.move_to_end(fingerprint)
+            self.hits += 1
+            return plan
+
+    def put(self, fingerprint: bytes, plan: SharePlan) -> None:
+        """Store a plan, evicting the least recently used ones beyond the limit"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._plans[fingerprint] = plan
+            self._plans.move_to_end(fingerprint)
+            while len(self._plans) > self.max_entries:
+                self._plans.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        """Get hit/miss counters and current usage"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._plans),
+                "max_entries": self.max_entries,
+            }
+
+    def clear(self) -> None:
+        """Drop every cached plan and reset the counters"""
+        with self._lock:
+            self._plans.clear()
+            self.hits = 0
+            self.misses = 0
+
+# Cache shared by every calculator in this process
+share_plan_cache = SharePlanCache()
@@ -0,0 +1,85 @@
+"""Compact, URL-safe encodings of calculation requests for cacheable GET URLs.
+
+A scenario is the rules version, a dot, and the request's canonical JSON
+as raw deflate in unpadded URL-safe base64. Carrying the version means a
+change to the rules gives every request a new URL, so results cached
+under the old rules are never served for new links.
+"""
+import base64
+import binascii
+import hashlib
+import os
+import zlib
+from typing import Optional, Tuple
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+from .calculations import RULES_VERSION
+from .ingest import REQUEST_MAX_BYTES, too_large
+
+# Cache-Control sent with GET calculation responses; a URL always gives the same result
+SCENARIO_CACHE_CONTROL = os.getenv("SCENARIO_CACHE_CONTROL", "public, max-age=31536000, immutable")
+
+def canonical_json(request: BaseModel) -> bytes:
+    """Serialize a validated request in canonical form.
+
+    Fields come in model order and fields left at their defaults are
+    dropped, so equal requests serialize to the same bytes however their
+    JSON was laid out and validating the result gives the request back.
+    """
+    return request.model_dump_json(exclude_defaults=True).encode()
+
+def encode_scenario(request: BaseModel) -> str:
+    """Encode a validated request as a scenario for the current rules version"""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    compressed = compressor.compress(canonical_json(request)) + compressor.flush()
+    return RULES_VERSION + "." + base64.urlsafe_b64encode(compressed).rstrip(b"=").decode("ascii")
+
+def decode_scenario(scenario: str, max_bytes: Optional[int] = None) -> Tuple[str, bytes]:
+    """Decode a scenario into the rules version it was made for and its JSON.
+
+    The version is empty for scenarios without one. Like request bodies,
+    the decoded JSON is limited to ``max_bytes`` (REQUEST_MAX_BYTES by
+    default) while it is inflated.
+    """
+    if max_bytes is None:
+        max_bytes = REQUEST_MAX_BYTES
+    version, _, payload = scenario.rpartition(".")
+    try:
+        compressed = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Scenario is not valid URL-safe base64")
+
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    try:
+        raw = decompressor.decompress(compressed, max_bytes + 1)
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Scenario is not valid deflate data")
+    if decompressor.unconsumed_tail or len(raw) > max_bytes:
+        raise too_large(max_bytes)
+    if not decompressor.eof:
+        raise HTTPException(status_code=400, detail="Scenario is truncated")
+    return version, raw
+
+def scenario_etag(raw: bytes, view: str) -> str:
+    """Get the strong ETag of a scenario's response under the current rules.
+
+    Responses are byte for byte the same for the same canonical JSON, view
+    and rules version, so the tag is known before anything is calculated.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (RULES_VERSION.encode(), view.encode(), raw):
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return '"' + digest.hexdigest() + '"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Tell whether an If-None-Match header names an ETag (compared weakly, as RFC 9110 asks)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
@@ -0,0 +1,235 @@
+"""Cache of serialized calculation results shared by the worker processes of a container."""
+import fcntl
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from typing import Callable, Dict, Iterator, Optional
+
+from .cache import RESULT_CACHE_TTL_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Size of the shared data area holding response bodies, in bytes; 0 disables the shared cache.
+# The default stays well below Docker's 64 MB /dev/shm, which the process pools' semaphores use too.
+SHARED_RESULT_CACHE_BYTES = int(os.getenv("SHARED_RESULT_CACHE_BYTES", str(16 * 1024 * 1024)))
+
+# Number of index slots, i.e. the most entries the shared cache can hold
+SHARED_RESULT_CACHE_SLOTS = int(os.getenv(
+    "SHARED_RESULT_CACHE_SLOTS", str(max(64, SHARED_RESULT_CACHE_BYTES // 4096))
+))
+
+# File backing the shared cache. Unset, an unlinked temporary file is used,
+# which is shared by processes forked after it was created (see serve.py);
+# set it to share the cache between processes started separately.
+SHARED_RESULT_CACHE_PATH = os.getenv("SHARED_RESULT_CACHE_PATH")
+
+# Slots probed for a key before an existing entry is replaced
+PROBES = 8
+
+_MAGIC = b"MIRASRC1"
+# magic, slot count, data size, write head (total bytes ever reserved)
+_HEADER = struct.Struct("<8sIxxxxQQ")
+_HEAD_OFFSET = 24
+_HEAD = struct.Struct("<Q")
+# sequence, key digest, data offset (in head terms), length, crc32, expiry
+_SLOT = struct.Struct("<I4x16sQIId")
+
+class SharedResultCache:
+    """Fixed-size cache in a shared memory mapping, usable from many processes at once.
+
+    Values go into a ring buffer: each write reserves space at the head,
+    overwriting the oldest values, so the cache evicts first-in,
+    first-out and never grows. An open-addressed index maps a digest of
+    the key to a value's position. Writers take a process lock (plus a
+    thread lock, as POSIX record locks only exclude other processes).
+    Readers take no lock: each index slot carries a sequence number
+    that is odd while it is being written, a value is only trusted if
+    the slot's sequence did not change and the head did not pass over it
+    while it was copied, and a CRC catches anything else. A read that
+    races a write is simply a miss.
+
+    The whole file is allocated up front; if that fails, for instance
+    because ``/dev/shm`` is too small, the cache is disabled instead of
+    the process dying with SIGBUS on a later write. Expiry times are
+    wall-clock times, so processes started separately agree on them.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = SHARED_RESULT_CACHE_BYTES,
+        slots: int = SHARED_RESULT_CACHE_SLOTS,
+        ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+        path: Optional[str] = SHARED_RESULT_CACHE_PATH,
+        clock: Callable[[], float] = time.time
+    ):
+        self.max_bytes = max_bytes
+        self.slots = slots
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data_start = _HEADER.size + slots * _SLOT.size
+        self._map = None
+        if max_bytes <= 0:
+            return
+
+        if path is None:
+            self._file = tempfile.TemporaryFile(dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+        else:
+            self._file = open(path, "a+b")
+        size = self._data_start + max_bytes
+        with self._process_lock():
+            try:
+                os.posix_fallocate(self._file.fileno(), 0, size)
+            except OSError as e:
+                logger.warning("Shared result cache disabled, cannot allocate %d bytes: %s", size, e)
+            else:
+                self._map = mmap.mmap(self._file.fileno(), size)
+                if _HEADER.unpack_from(self._map)[:3] != (_MAGIC, slots, max_bytes):
+                    self._reset()
+        if self._map is None:
+            self._file.close()
+
+    def get(self, key: bytes) -> Optional[bytes]:
+        """Get a cached value if it has not expired or been overwritten"""
+        if self._map is None:
+            return None
+        digest = self._digest(key)
+        for slot in self._probe(digest):
+            position = _HEADER.size + slot * _SLOT.size
+            sequence, slot_key, offset, length, crc, expires_at = _SLOT.unpack_from(self._map, position)
+            if slot_key != digest or sequence % 2 or length == 0:
+                continue
+            if expires_at <= self._clock() or not self._is_intact(offset):
+                break
+            start = self._data_start + offset % self.max_bytes
+            value = self._map[start:start + length]
+            if (
+                _SLOT.unpack_from(self._map, position)[0] == sequence
+                and self._is_intact(offset)
+                and zlib.crc32(value) == crc
+            ):
+                self.hits += 1
+                return value
+            break
+        self.misses += 1
+        return None
+
+    def put(self, key: bytes, value: bytes) -> None:
+        """Store a value, overwriting the oldest values if the data area is full"""
+        if self._map is None or not value or len(value) > self.max_bytes // 4:
+            return
+        digest = self._digest(key)
+        with self._lock, self._process_lock():
+            head = _HEAD.unpack_from(self._map, _HEAD_OFFSET)[0]
+            slot = self._choose_slot(digest, head)
+
+            # Values never wrap around the end of the data area
+            offset = head
+            if offset % self.max_bytes + len(value) > self.max_bytes:
+                offset += self.max_bytes - offset % self.max_bytes
+            _HEAD.pack_into(self._map, _HEAD_OFFSET, offset + len(value))
+            start = self._data_start + offset % self.max_bytes
+            self._map[start:start + len(value)] = value
+
+            position = _HEADER.size + slot * _SLOT.size
+            sequence = _SLOT.unpack_from(self._map, position)[0]
+            struct.pack_into("<I", self._map, position, sequence + 1)
+            _SLOT.pack_into(
+                self._map, position, sequence + 1, digest, offset, len(value),
+                zlib.crc32(value), self._clock() + self.ttl_seconds
+            )
+            struct.pack_into("<I", self._map, position, sequence + 2)
+
+    def clear(self) -> None:
+        """Drop every entry, in every process, and reset this process's counters"""
+        self.hits = self.misses = 0
+        if self._map is None:
+            return
+        with self._lock, self._process_lock():
+            self._reset()
+
+    def stats(self) -> Dict[str, int]:
+        """Get this process's hit/miss counters and the shared usage"""
+        if self._map is None:
+            return {"enabled": False}
+        head = _HEAD.unpack_from(self._map, _HEAD_OFFSET)[0]
+        now = self._clock()
+        entries = 0
+        for slot in range(self.slots):
+            _, _, offset, length, _, expires_at = _SLOT.unpack_from(self._map, _HEADER.size + slot * _SLOT.size)
+            if length and expires_at > now and offset >= head - self.max_bytes:
+                entries += 1
+        return {
+            "enabled": True,
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "slots": self.slots,
+            "bytes_written": head,
+            "max_bytes": self.max_bytes,
+        }
+
+    def _digest(self, key: bytes) -> bytes:
+        return hashlib.blake2b(key, digest_size=16).digest()
+
+    def _probe(self, digest: bytes) -> Iterator[int]:
+        first = int.from_bytes(digest[:8], "little") % self.slots
+        return (slot % self.slots for slot in range(first, first + min(PROBES, self.slots)))
+
+    def _is_intact(self, offset: int) -> bool:
+        """Tell whether the value written at ``offset`` has not been overwritten since"""
+        return offset >= _HEAD.unpack_from(self._map, _HEAD_OFFSET)[0] - self.max_bytes
+
+    def _choose_slot(self, digest: bytes, head: int) -> int:
+        """Pick the slot for a key: its own, else an unused or dead one, else the oldest"""
+        now = self._clock()
+        oldest, oldest_offset = None, None
+        for slot in self._probe(digest):
+            _, slot_key, offset, length, _, expires_at = _SLOT.unpack_from(self._map, _HEADER.size + slot * _SLOT.size)
+            if slot_key == digest or length == 0 or expires_at <= now or offset < head - self.max_bytes:
+                return slot
+            if oldest is None or offset < oldest_offset:
+                oldest, oldest_offset = slot, offset
+        return oldest
+
+    def _reset(self) -> None:
+        """Write an empty header and index; callers hold the locks"""
+        self._map[:self._data_start] = bytes(self._data_start)
+        _HEADER.pack_into(self._map, 0, _MAGIC, self.slots, self.max_bytes, 0)
+
+    def _process_lock(self) -> "_FileLock":
+        return _FileLock(self._file.fileno())
+
+class _FileLock:
+    """Exclusive POSIX record lock on the first byte of a file"""
+
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    def __enter__(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, 0)
+
+    def __exit__(self, *exc_info):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, 0)
+
+_shared_result_cache: Optional[SharedResultCache] = None
+
+def get_shared_result_cache() -> SharedResultCache:
+    """Return the cache of /calculate response bodies shared by the workers, mapping it on first use.
+
+    Only web workers use it; calculation pool processes import this module
+    without mapping a cache of their own. ``serve.py`` maps it before
+    forking, so every worker shares the same one.
+    """
+    global _shared_result_cache
+    if _shared_result_cache is None:
+        _shared_result_cache = SharedResultCache()
+    return _shared_result_cache
@@ -0,0 +1,146 @@
+"""Sampled per-request stage timings and structured log formatting."""
+import json
+import logging
+import os
+import random
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# "json" switches logs to one JSON object per line and enables stage timings
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+
+# Fraction of requests whose stage timings are recorded and logged
+TIMING_SAMPLE_RATE = float(os.getenv("TIMING_SAMPLE_RATE", "0.01"))
+
+_current_timings: ContextVar[Optional["StageTimings"]] = ContextVar("stage_timings", default=None)
+
+class StageTimings:
+    """Wall-clock time spent in each named stage of one request"""
+    __slots__ = ("started", "last", "stages")
+
+    def __init__(self):
+        self.started = self.last = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    def mark(self, stage: str) -> None:
+        """Attribute the time since the previous mark to ``stage``"""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + (now - self.last)
+        self.last = now
+
+    def merge(self, stages: Dict[str, float]) -> None:
+        """Add stages timed elsewhere since the previous mark.
+
+        Whatever part of that time the stages do not cover, such as
+        queueing for a worker process and pickling, is recorded as
+        ``offload``.
+        """
+        now = time.perf_counter()
+        for stage, seconds in stages.items():
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        overhead = max(0.0, now - self.last - sum(stages.values()))
+        self.stages["offload"] = self.stages.get("offload", 0.0) + overhead
+        self.last = now
+
+    def as_dict(self) -> Dict[str, float]:
+        """Get stage durations and the total in milliseconds"""
+        timings = {f"{stage}_ms": round(seconds * 1000, 3) for stage, seconds in self.stages.items()}
+        timings["total_ms"] = round((self.last - self.started) * 1000, 3)
+        return timings
+
+def mark_stage(stage: str) -> None:
+    """Record the end of a stage if the current request is being timed"""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.mark(stage)
+
+def is_timing() -> bool:
+    """Tell whether the current request is being timed"""
+    return _current_timings.get() is not None
+
+def run_timed(func: Callable[[Any], Any], argument: Any) -> Tuple[Any, Dict[str, float]]:
+    """Run ``func(argument)`` with stage timing, returning its result and stage durations.
+
+    Context variables do not cross into worker processes, so work sent to
+    one is wrapped in this and its stages merged back with ``merge_stages``.
+    """
+    timings = StageTimings()
+    token = _current_timings.set(timings)
+    try:
+        return func(argument), timings.stages
+    finally:
+        _current_timings.reset(token)
+
+def merge_stages(stages: Dict[str, float]) -> None:
+    """Add stages timed in a worker process to the current request's timings"""
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.merge(stages)
+
+class StageTimingMiddleware:
+    """ASGI middleware that times a sample of requests and logs one line per timed request.
+
+    The endpoint marks its own stages with ``mark_stage``; the time between
+    the last mark and the start of the response is recorded as ``serialize``.
+    Requests that are not sampled only pay for one random number.
+    """
+
+    def __init__(self, app, sample_rate: Optional[float] = None):
+        self.app = app
+        if sample_rate is None:
+            sample_rate = TIMING_SAMPLE_RATE if LOG_FORMAT == "json" else 0.0
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or random.random() >= self.sample_rate:
+            await self.app(scope, receive, send)
+            return
+
+        timings = StageTimings()
+        status_code = None
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                timings.mark("serialize")
+            await send(message)
+
+        token = _current_timings.set(timings)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current_timings.reset(token)
+            logger.info("request timings", extra={"fields": {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status_code": status_code,
+                **timings.as_dict()
+            }})
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as single-line JSON objects"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+def configure_logging(level: str = "INFO") -> None:
+    """Configure root logging in the format selected by LOG_FORMAT"""
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    logging.basicConfig(level=level.upper(), handlers=[handler], force=True)
@@ -1,11 +1,10 @@
+import os
 import uvicorn
-import logging
+from app.telemetry import configure_logging
 
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+# Configure logging; set LOG_LEVEL=DEBUG for verbose output
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+configure_logging(LOG_LEVEL)
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -14,6 +13,6 @@ if __name__ == "__main__":
         port=8000,
         reload=True,
         workers=1,
-        log_level="debug",  # Set Uvicorn log level to debug
+        log_level=LOG_LEVEL.lower(),
         access_log=True     # Enable access logging
-    ) 
\ No newline at end of file
+    )
@@ -0,0 +1,152 @@
+"""Production entry point: a pre-forking supervisor for uvicorn workers.
+
+The application, its modules and pydantic schemas are imported once in the
+supervisor. ``gc.freeze()`` then moves every object into the permanent
+generation so the garbage collector never writes to those pages, and
+forked workers keep sharing them copy-on-write. Workers serve one listening
+socket opened by the supervisor, which restarts any worker that dies and
+forwards SIGTERM/SIGINT for a graceful shutdown.
+
+Each worker starts its own calculation process pool on first use. Unless
+CALCULATION_PROCESS_WORKERS is set, the CPUs are divided between the
+workers' pools, so all of them together start one pool process per CPU
+rather than one per CPU each.
+
+Use ``run.py`` for development with auto-reload.
+"""
+import gc
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import uvicorn
+from app.telemetry import configure_logging
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8080"))
+
+# Number of worker processes; defaults to the CPUs available to this process
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0")) or len(os.sched_getaffinity(0))
+
+# Seconds a worker gets to finish its requests after SIGTERM
+GRACEFUL_TIMEOUT = float(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+logger = logging.getLogger("serve")
+
+def size_process_pools(workers: int) -> None:
+    """Split the CPUs between the process pools of ``workers`` workers, unless configured.
+
+    Must run before the application is imported, which reads the setting.
+    """
+    if "CALCULATION_PROCESS_WORKERS" not in os.environ:
+        per_worker = max(1, len(os.sched_getaffinity(0)) // workers)
+        os.environ["CALCULATION_PROCESS_WORKERS"] = str(per_worker)
+
+def preload():
+    """Import the application and build everything workers would otherwise build lazily"""
+    from app.api import app
+    from app.shared_cache import get_shared_result_cache
+    # Map the shared result cache now, so every forked worker uses the same one
+    get_shared_result_cache()
+    # Generates the pydantic JSON schemas of every endpoint
+    app.openapi()
+    return app
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """Open the listening socket shared by all workers"""
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+def run_worker(app, sock: socket.socket) -> None:
+    """Serve requests in a forked worker until told to stop"""
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    config = uvicorn.Config(
+        app,
+        log_level=LOG_LEVEL.lower(),
+        access_log=False,
+        timeout_graceful_shutdown=int(GRACEFUL_TIMEOUT),
+    )
+    uvicorn.Server(config).run(sockets=[sock])
+
+def spawn_worker(app, sock: socket.socket) -> int:
+    """Fork a worker and return its pid"""
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            run_worker(app, sock)
+        except BaseException:
+            logger.exception("Worker %d crashed", os.getpid())
+            status = 1
+        finally:
+            os._exit(status)
+    logger.info("Started worker %d", pid)
+    return pid
+
+def main() -> None:
+    configure_logging(LOG_LEVEL)
+    size_process_pools(WEB_CONCURRENCY)
+    app = preload()
+    sock = bind_socket(HOST, PORT)
+
+    # Objects created so far live as long as the workers; keep the collector off their pages
+    gc.collect()
+    gc.freeze()
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    logger.info("Serving on %s:%d with %d workers", HOST, PORT, WEB_CONCURRENCY)
+    workers = {spawn_worker(app, sock) for _ in range(WEB_CONCURRENCY)}
+
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid = 0
+        if pid in workers:
+            workers.discard(pid)
+            logger.warning("Worker %d exited with status %d, restarting", pid, os.waitstatus_to_exitcode(status))
+            # Avoid a fork loop when workers fail right at startup
+            time.sleep(1)
+            workers.add(spawn_worker(app, sock))
+        else:
+            time.sleep(0.5)
+
+    logger.info("Shutting down %d workers", len(workers))
+    for pid in workers:
+        os.kill(pid, signal.SIGTERM)
+    deadline = time.monotonic() + GRACEFUL_TIMEOUT
+    while workers and time.monotonic() < deadline:
+        try:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            workers.clear()
+            break
+        if pid:
+            workers.discard(pid)
+        else:
+            time.sleep(0.1)
+    for pid in workers:
+        logger.warning("Killing worker %d after the graceful timeout", pid)
+        os.kill(pid, signal.SIGKILL)
+    sock.close()
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
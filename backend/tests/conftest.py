@@ -5,6 +5,22 @@ Pytest configuration file for inheritance distribution calculator tests.
 import os
 import sys
 import pytest
+from fastapi.testclient import TestClient
 
 # Add the parent directory to PYTHONPATH so that we can import from app
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))) 
\ No newline at end of file
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+@pytest.fixture(autouse=True)
+def clear_result_cache():
+    """Start every test with empty result caches"""
+    from app.cache import result_cache
+    from app.shared_cache import get_shared_result_cache
+    result_cache.clear()
+    get_shared_result_cache().clear()
+
+@pytest.fixture(scope="module")
+def client():
+    """Test client of the app, started once per test module"""
+    from app.api import app
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,46 @@
+import asyncio
+from app.admission import AdmissionLimiter, admission_limiter
+from tests.test_api import make_request
+
+def test_limiter_queues_then_rejects():
+    """Test case: requests beyond the limit wait, and beyond the queue are rejected"""
+    limiter = AdmissionLimiter(max_in_flight=1, max_waiting=1, wait_timeout=5)
+
+    async def burst():
+        assert await limiter.acquire()
+        queued = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert not await limiter.acquire()
+
+        limiter.release()
+        assert await queued
+        limiter.release()
+
+    asyncio.run(burst())
+    assert limiter.stats() == {"admitted": 2, "queued": 1, "rejected": 1, "in_flight": 0, "waiting": 0}
+
+def test_limiter_rejects_after_the_wait_timeout():
+    """Test case: a request that waits too long for a slot is turned away"""
+    limiter = AdmissionLimiter(max_in_flight=1, max_waiting=5, wait_timeout=0.01)
+
+    async def wait_too_long():
+        assert await limiter.acquire()
+        admitted = await limiter.acquire()
+        limiter.release()
+        return admitted
+
+    assert not asyncio.run(wait_too_long())
+    assert limiter.stats()["in_flight"] == 0
+    assert limiter.stats()["waiting"] == 0
+
+def test_calculate_returns_503_when_saturated(client, monkeypatch):
+    """Test case: a saturated worker answers 503 with Retry-After and leaves other endpoints alone"""
+    monkeypatch.setattr(admission_limiter, "max_in_flight", 0)
+    monkeypatch.setattr(admission_limiter, "max_waiting", 0)
+
+    response = client.post("/calculate", json=make_request(estate_value=1000))
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert "detail" in response.json()
+    assert client.get("/metrics").json()["admission"]["rejected"] >= 1
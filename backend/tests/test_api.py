@@ -0,0 +1,401 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+from app.api import (
+    FamilyNodeSchema, RefResolver, calculate_ndjson_line, classify_heirs, convert_schema_to_model,
+    fill_response_tree, prune_family_tree
+)
+from app.calculations import InheritanceCalculator
+from app.execution import execution_policy
+from app.graph import FamilyGraph
+from app.models import ParentType
+
+def make_request(estate_value=1000000, children_alive=(True, True), spouse_alive=True):
+    """Build a /calculate payload for a deceased person with a spouse and children"""
+    family_tree = {
+        "person": {"id": "d1", "name": "Deceased", "is_alive": False},
+        "children": [
+            {"person": {"id": f"c{i}", "name": f"Child{i}", "is_alive": alive, "parent_id": "d1"}}
+            for i, alive in enumerate(children_alive, start=1)
+        ]
+    }
+    if spouse_alive is not None:
+        family_tree["spouse"] = {"id": "s1", "name": "Spouse", "is_alive": spouse_alive}
+    return {"estate_value": estate_value, "family_tree": family_tree}
+
+def test_calculate_spouse_with_children(client):
+    """Test case: /calculate returns the tree with shares and a summary"""
+    response = client.post("/calculate", json=make_request())
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["total_distributed"] == 1000000
+    assert body["summary"]["s1"]["share"] == 250000
+    assert body["summary"]["c1"]["share"] == 375000
+    assert body["summary"]["c2"]["share_percentage"] == 37.5
+    assert body["family_tree"]["children"][0]["person"]["share"] == 375000
+
+def test_calculate_flat_persons_table(client):
+    """Test case: a flat persons table gives the same shares as the nested tree
+
+    Family structure:
+    - Deceased person (no spouse, no children)
+    - Mother (deceased) with Sibling1 (alive)
+    - Father (alive)
+    - Maternal grandmother (alive)
+    """
+    response = client.post("/calculate", json={
+        "estate_value": 1000000,
+        "deceased_id": "d1",
+        "persons": [
+            {"id": "d1", "name": "Deceased", "is_alive": False, "mother_id": "m1", "father_id": "f1"},
+            {"id": "m1", "name": "Mother", "is_alive": False, "mother_id": "gm1"},
+            {"id": "f1", "name": "Father"},
+            {"id": "gm1"},
+            {"id": "sib1", "name": "Sibling1", "mother_id": "m1"},
+        ]
+    })
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [person["share"] for person in body["persons"]] == [0, 0, 500000, 0, 500000]
+    assert body["summary"] == {
+        "f1": {"name": "Father", "relation": "father", "share": 500000, "share_percentage": 50},
+        "sib1": {"name": "Sibling1", "relation": "child", "share": 500000, "share_percentage": 50},
+    }
+
+def test_calculate_flat_rejects_unknown_references(client):
+    """Test case: references to persons missing from the table are a 400"""
+    response = client.post("/calculate", json={
+        "estate_value": 1000,
+        "deceased_id": "d1",
+        "persons": [{"id": "d1", "is_alive": False}, {"id": "c1", "father_id": "x1"}]
+    })
+
+    assert response.status_code == 400
+    assert "unknown person 'x1'" in response.json()["detail"]
+
+    response = client.post("/calculate", json={
+        "estate_value": 1000,
+        "deceased_id": "d1",
+        "persons": [{"id": "d1", "is_alive": False}, {"id": "d1"}]
+    })
+    assert response.status_code == 400
+
+def test_calculate_resolves_refs_to_shared_nodes(client):
+    """Test case: refs stand in for a full sibling and for the deceased
+
+    Family structure:
+    - Deceased person (no spouse, no children)
+    - Mother (deceased) with children: Deceased (ref), Sibling1 (deceased, with Nephew1)
+    - Father (deceased) with children: Deceased (ref), Sibling1 (ref)
+
+    Expected shares:
+    - Nephew1: 1,000,000 TL
+    """
+    response = client.post("/calculate", json={
+        "estate_value": 1000000,
+        "family_tree": {
+            "person": {"id": "d1", "name": "Deceased", "is_alive": False},
+            "parents": {
+                "mother": {
+                    "person": {"id": "m1", "name": "Mother", "is_alive": False},
+                    "children": [
+                        {"ref": "d1"},
+                        {
+                            "person": {"id": "sib1", "name": "Sibling1", "is_alive": False},
+                            "children": [{"person": {"id": "n1", "name": "Nephew1"}}]
+                        }
+                    ]
+                },
+                "father": {
+                    "person": {"id": "f1", "name": "Father", "is_alive": False},
+                    "children": [{"ref": "d1"}, {"ref": "sib1"}]
+                }
+            }
+        }
+    })
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["summary"] == {
+        "n1": {"name": "Nephew1", "relation": "child", "share": 1000000, "share_percentage": 100}
+    }
+    assert body["family_tree"]["parents"]["father"]["children"] == [{"ref": "d1"}, {"ref": "sib1"}]
+    assert "ref" not in body["family_tree"]
+
+def test_convert_links_refs_to_one_node():
+    """Test case: a ref converts to the very node it points to"""
+    root_node = convert_schema_to_model(FamilyNodeSchema.model_validate({
+        "person": {"id": "d1", "name": "Deceased", "is_alive": False},
+        "parents": {
+            "mother": {"person": {"id": "m1", "name": "Mother"}, "children": [{"ref": "d1"}]}
+        }
+    }))
+
+    assert root_node.parents[ParentType.MOTHER].children[0] is root_node
+
+def test_calculate_rejects_bad_refs(client):
+    """Test case: unknown refs are a 400, refs with their own data a 422"""
+    family_tree = {
+        "person": {"id": "d1", "name": "Deceased", "is_alive": False},
+        "children": [{"ref": "x1"}]
+    }
+    response = client.post("/calculate", json={"estate_value": 1000, "family_tree": family_tree})
+    assert response.status_code == 400
+    assert "unknown person 'x1'" in response.json()["detail"]
+
+    family_tree["children"] = [{"ref": "d1", "person": {"id": "c1", "name": "Child1"}}]
+    response = client.post("/calculate", json={"estate_value": 1000, "family_tree": family_tree})
+    assert response.status_code == 422
+
+def make_three_generation_tree(child_alive=False, parent_alive=False, sibling_alive=False):
+    """Deceased with a child, both parents with a sibling, and maternal grandparents with an uncle"""
+    return {
+        "person": {"id": "d1", "name": "Deceased", "is_alive": False},
+        "spouse": {"id": "s1", "name": "Spouse"},
+        "children": [{"person": {"id": "c1", "name": "Child1", "is_alive": child_alive}}],
+        "parents": {
+            "mother": {
+                "person": {"id": "m1", "name": "Mother", "is_alive": parent_alive},
+                "children": [{"ref": "d1"}, {"person": {"id": "sib1", "name": "Sibling1", "is_alive": sibling_alive}}],
+                "parents": {
+                    "mother": {
+                        "person": {"id": "gm1", "name": "Grandmother", "is_alive": False},
+                        "children": [
+                            {"ref": "m1"},
+                            {
+                                "person": {"id": "u1", "name": "Uncle1"},
+                                "children": [{"person": {"id": "cz1", "name": "Cousin1"}}]
+                            }
+                        ]
+                    },
+                    "father": {"person": {"id": "gf1", "name": "Grandfather"}}
+                }
+            },
+            "father": {"person": {"id": "f1", "name": "Father", "is_alive": False}}
+        }
+    }
+
+@pytest.mark.parametrize("alive, heir_class", [
+    ({"child_alive": True}, 1),
+    ({"parent_alive": True}, 2),
+    ({"sibling_alive": True}, 2),
+    ({}, 3),
+])
+def test_pruned_conversion_matches_full_conversion(client, alive, heir_class):
+    """Test case: dropping branches without heirs does not change any share"""
+    family_tree = make_three_generation_tree(**alive)
+    schema = FamilyNodeSchema.model_validate(family_tree)
+    resolve = RefResolver(schema)
+    assert classify_heirs(schema, resolve) == heir_class
+
+    graph = FamilyGraph.from_family_node(convert_schema_to_model(schema))
+    expected = InheritanceCalculator(graph=graph, total_value=1000000, plan_cache=None).calculate().share_map()
+
+    response = client.post("/calculate", json={"estate_value": 1000000, "family_tree": family_tree})
+
+    assert response.status_code == 200
+    assert {person_id: item["share"] for person_id, item in response.json()["summary"].items()} == expected
+
+def test_prune_drops_the_ancestor_side_when_children_inherit():
+    """Test case: with living children only the descendant side is converted"""
+    schema = FamilyNodeSchema.model_validate(make_three_generation_tree(child_alive=True))
+    resolve = RefResolver(schema)
+
+    pruned = prune_family_tree(schema, classify_heirs(schema, resolve), resolve)
+
+    assert pruned.parents is None
+    assert pruned.children[0] is schema.children[0]
+    assert schema.parents["mother"].parents is not None
+
+def test_prune_keeps_only_grandparents_and_uncles_for_third_degree():
+    """Test case: third degree heirs convert without siblings or cousins"""
+    schema = FamilyNodeSchema.model_validate(make_three_generation_tree())
+    resolve = RefResolver(schema)
+
+    pruned = prune_family_tree(schema, 3, resolve)
+    mother = pruned.parents["mother"]
+    grandmother = mother.parents["mother"]
+
+    assert pruned.children == [] and mother.children == []
+    assert [uncle.person.id for uncle in grandmother.children] == ["u1"]
+    assert grandmother.children[0].children == []
+
+def test_calculate_fills_heirs_repeated_in_pruned_branches(client):
+    """Test case: a person listed twice carries the share in both places
+
+    The deceased is repeated, with their child, in the mother's child
+    list; that branch is pruned for a first degree calculation.
+    """
+    child = {"person": {"id": "c1", "name": "Child1"}}
+    family_tree = {
+        "person": {"id": "d1", "name": "Deceased", "is_alive": False},
+        "children": [child],
+        "parents": {
+            "mother": {
+                "person": {"id": "m1", "name": "Mother"},
+                "children": [{"person": {"id": "d1", "name": "Deceased", "is_alive": False}, "children": [child]}]
+            }
+        }
+    }
+
+    response = client.post("/calculate", json={"estate_value": 1000, "family_tree": family_tree})
+
+    tree = response.json()["family_tree"]
+    copies = [tree["children"][0]["person"], tree["parents"]["mother"]["children"][0]["children"][0]["person"]]
+    assert [(copy["share"], copy["share_percentage"]) for copy in copies] == [(1000, 100), (1000, 100)]
+
+def test_fill_response_tree_fills_shares_and_summary_together():
+    """Test case: shares, percentages and summary come from one pass
+
+    A full sibling listed under both parents is filled in both places.
+    """
+    tree = FamilyNodeSchema.model_validate({
+        "person": {"id": "d1", "name": "Deceased", "is_alive": False},
+        "spouse": {"id": "s1", "name": "Spouse"},
+        "parents": {
+            "mother": {
+                "person": {"id": "m1", "name": "Mother", "is_alive": False},
+                "children": [{"person": {"id": "sib1", "name": "Sibling1"}}]
+            },
+            "father": {
+                "person": {"id": "f1", "name": "Father"},
+                "children": [{"person": {"id": "sib1", "name": "Sibling1"}}]
+            }
+        }
+    })
+
+    summary = fill_response_tree(tree, {"s1": 500, "f1": 250, "sib1": 250}, 1000)
+
+    assert list(summary) == ["s1", "sib1", "f1"]
+    assert summary["f1"] == {"name": "Father", "relation": "father", "share": 250, "share_percentage": 25}
+    assert summary["sib1"]["relation"] == "child"
+    assert tree.spouse.share_percentage == 50
+    assert tree.parents["mother"].children[0].person.share == 250
+    assert tree.parents["father"].children[0].person.share_percentage == 25
+    assert tree.person.share_percentage is None
+
+def test_calculate_batch_keeps_order_and_isolates_errors(client):
+    """Test case: one bad item does not fail the batch
+
+    Items:
+    - 0: spouse with two children
+    - 1: negative estate value (validation error)
+    - 2: invalid parent type (bad request)
+    - 3: only children
+    """
+    bad_parent = make_request()
+    bad_parent["family_tree"]["parents"] = {
+        "uncle": {"person": {"id": "u1", "name": "Uncle"}}
+    }
+    items = [
+        make_request(),
+        make_request(estate_value=-5),
+        bad_parent,
+        make_request(estate_value=600, spouse_alive=None, children_alive=(True, True, True)),
+    ]
+
+    response = client.post("/calculate/batch", json=items)
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [item["index"] for item in results] == [0, 1, 2, 3]
+
+    assert results[0]["error"] is None
+    assert results[0]["result"]["summary"]["s1"]["share"] == 250000
+
+    assert results[1]["result"] is None
+    assert results[1]["error"]["status_code"] == 422
+
+    assert results[2]["result"] is None
+    assert results[2]["error"]["status_code"] == 400
+    assert "Invalid parent type" in results[2]["error"]["detail"]
+
+    assert results[3]["result"]["summary"]["c3"]["share"] == 200
+
+def test_calculate_batch_reports_failed_calculations_per_item(client, monkeypatch):
+    """Test case: an item whose calculation itself fails (e.g. a broken pool) becomes an error entry"""
+    run = execution_policy.run
+
+    async def break_second(func, raw, nodes):
+        if b"600" in raw:
+            raise BrokenProcessPool("A worker process terminated abruptly")
+        return await run(func, raw, nodes)
+
+    monkeypatch.setattr(execution_policy, "run", break_second)
+    items = [make_request(), make_request(estate_value=600)]
+
+    response = client.post("/calculate/batch", json=items)
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0]["result"]["summary"]["s1"]["share"] == 250000
+    assert results[1]["error"]["status_code"] == 500
+    assert "terminated abruptly" in results[1]["error"]["detail"]
+
+def test_calculate_batch_rejects_oversized_batches(client, monkeypatch):
+    """Test case: batches above the configured limit are rejected up front"""
+    monkeypatch.setattr("app.api.BATCH_MAX_ITEMS", 2)
+
+    response = client.post("/calculate/batch", json=[make_request()] * 3)
+
+    assert response.status_code == 413
+
+def test_calculate_stream_returns_one_line_per_record(client):
+    """Test case: NDJSON records are answered line by line in order
+
+    Records:
+    - 0: spouse with two children
+    - 1: not JSON
+    - 2: only children
+    """
+    body = b"\n".join([
+        json.dumps(make_request()).encode(),
+        b"{not json",
+        b"",
+        json.dumps(make_request(estate_value=600, spouse_alive=None, children_alive=(True, True, True))).encode(),
+    ]) + b"\n"
+
+    response = client.post("/calculate/stream", content=body)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 3
+    assert lines[0]["summary"]["s1"]["share"] == 250000
+    assert lines[1]["error"]["status_code"] == 400
+    assert lines[2]["summary"]["c3"]["share"] == 200
+
+def test_calculate_stream_survives_records_that_never_ran(client, monkeypatch):
+    """Test case: a record whose calculation future fails becomes an error line"""
+    def fail_second(line):
+        if b"600" in line:
+            raise BrokenProcessPool("A worker process terminated abruptly")
+        return calculate_ndjson_line(line)
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr("app.api.get_process_pool", lambda: pool)
+    monkeypatch.setattr("app.api.calculate_ndjson_line", fail_second)
+    body = b"\n".join(json.dumps(item).encode() for item in [
+        make_request(), make_request(estate_value=600), make_request()
+    ])
+
+    try:
+        response = client.post("/calculate/stream", content=body)
+    finally:
+        pool.shutdown()
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line.get("error", {}).get("status_code") for line in lines] == [None, 500, None]
+
+def test_calculate_stream_skips_oversized_records(client, monkeypatch):
+    """Test case: a record above the size limit becomes an error line"""
+    monkeypatch.setattr("app.api.STREAM_MAX_LINE_BYTES", 64)
+    body = json.dumps(make_request()).encode() + b"\n" + b'{"short": 1}\n'
+
+    response = client.post("/calculate/stream", content=body)
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["error"]["status_code"] for line in lines] == [413, 422]
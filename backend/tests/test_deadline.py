@@ -0,0 +1,130 @@
+import asyncio
+import pickle
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import app.api as api
+from app.calculations import InheritanceCalculator
+from app.deadline import (
+    CHECK_INTERVAL, ClientDisconnected, Deadline, DeadlineExceeded,
+    cancel_on_disconnect, reset_deadline, set_deadline
+)
+import app.execution as execution
+from app.execution import ExecutionPolicy, execution_policy
+from app.graph import FamilyGraphBuilder
+
+def make_wide_request(children: int):
+    """Build a /calculate payload for a deceased person with many living children"""
+    return {
+        "estate_value": 1000,
+        "family_tree": {
+            "person": {"id": "d1", "name": "Deceased", "is_alive": False},
+            "children": [{"person": {"id": f"c{i}", "name": f"Child{i}"}} for i in range(children)]
+        }
+    }
+
+def expired_deadline() -> Deadline:
+    deadline = Deadline(1)
+    deadline.expires_at = 0
+    return deadline
+
+def test_checkpoints_look_at_the_clock_every_interval():
+    """Test case: an expired deadline is noticed within one check interval"""
+    deadline = expired_deadline()
+
+    for _ in range(CHECK_INTERVAL - 1):
+        deadline.check()
+    with pytest.raises(DeadlineExceeded):
+        deadline.check()
+
+def test_cancel_is_noticed_at_the_next_checkpoint():
+    """Test case: a disconnect aborts the work at the very next checkpoint"""
+    deadline = Deadline(None)
+    received = iter([{"type": "http.request", "body": b""}, {"type": "http.disconnect"}])
+
+    async def receive():
+        return next(received)
+
+    asyncio.run(cancel_on_disconnect(receive, deadline))
+
+    with pytest.raises(ClientDisconnected):
+        deadline.check()
+
+def test_cancel_callbacks_stay_in_this_process():
+    """Test case: cancel callbacks run once and are not pickled along with the deadline"""
+    deadline = Deadline(None)
+    calls = []
+    deadline.on_cancel(lambda: calls.append("first"))
+    copy = pickle.loads(pickle.dumps(deadline))
+
+    deadline.cancel()
+    deadline.cancel()
+    deadline.on_cancel(lambda: calls.append("late"))
+    copy.cancel()
+
+    assert calls == ["first", "late"]
+
+def test_cancel_withdraws_queued_work(monkeypatch):
+    """Test case: a cancelled deadline withdraws work still waiting for a pool slot"""
+    pool = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(execution, "get_thread_pool", lambda: pool)
+    policy = ExecutionPolicy(inline_max_nodes=0)
+    release = threading.Event()
+    ran = []
+
+    async def run_pair():
+        busy = asyncio.create_task(policy.run(lambda _: release.wait(5), None, nodes=5))
+        deadline = Deadline(None)
+        token = set_deadline(deadline)
+        try:
+            queued = asyncio.create_task(policy.run(ran.append, "queued", nodes=5))
+        finally:
+            reset_deadline(token)
+        await asyncio.sleep(0.05)
+        deadline.cancel()
+        with pytest.raises(ClientDisconnected):
+            await queued
+        release.set()
+        return await busy
+
+    try:
+        assert asyncio.run(run_pair()) is True
+    finally:
+        pool.shutdown()
+    assert ran == []
+    assert policy.stats()["thread_pending"] == 0
+
+def test_calculator_stops_at_the_deadline():
+    """Test case: a long descendant walk is abandoned once the deadline passed"""
+    builder = FamilyGraphBuilder()
+    previous = builder.add_person("d1", is_alive=False)
+    for generation in range(1, 2000):
+        person = builder.add_person(f"g{generation}", is_alive=False)
+        builder.add_child(previous, person)
+        previous = person
+    builder.add_child(previous, builder.add_person("heir", is_alive=True))
+    calculator = InheritanceCalculator(graph=builder.build(0), total_value=1000, plan_cache=None)
+
+    token = set_deadline(expired_deadline())
+    try:
+        with pytest.raises(DeadlineExceeded):
+            calculator.calculate()
+    finally:
+        reset_deadline(token)
+
+    assert calculator.calculate().share_map() == {"heir": 1000}
+
+@pytest.mark.parametrize("tier", ["inline", "thread", "process"])
+def test_calculate_returns_408_past_the_deadline(client, monkeypatch, tier):
+    """Test case: /calculate answers 408 when the calculation outlives its deadline, in any tier"""
+    monkeypatch.setattr(api, "CALCULATION_TIMEOUT", 1e-9)
+    monkeypatch.setattr(execution_policy, "inline_max_nodes", 1000 if tier == "inline" else 0)
+    monkeypatch.setattr(execution_policy, "thread_max_nodes", 0 if tier == "process" else 1000)
+    before = execution_policy.stats()
+
+    # Small enough to be dispatched before the first look at the clock
+    response = client.post("/calculate", json=make_wide_request(CHECK_INTERVAL // 2))
+
+    assert response.status_code == 408
+    assert execution_policy.stats()[tier] == before[tier] + 1
+    assert "longer than" in response.json()["detail"]
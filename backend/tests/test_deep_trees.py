@@ -0,0 +1,81 @@
+import json
+from fastapi.testclient import TestClient
+from app.api import FamilyNodeSchema, app, PersonSchema, convert_schema_to_model, fill_response_tree
+from app.calculations import InheritanceCalculator
+from app.graph import FamilyGraph
+from app.models import Estate, FamilyTree
+
+GENERATIONS = 50000
+
+def build_deep_schema(generations: int) -> FamilyNodeSchema:
+    """Build a chain of deceased descendants ending in one living heir"""
+    node = FamilyNodeSchema(person=PersonSchema(id=f"g{generations}", name="Last Heir"))
+    for generation in range(generations - 1, 0, -1):
+        node = FamilyNodeSchema(
+            person=PersonSchema(id=f"g{generation}", name=f"Generation {generation}", is_alive=False),
+            children=[node]
+        )
+    return FamilyNodeSchema(
+        person=PersonSchema(id="d1", name="Deceased", is_alive=False),
+        spouse=PersonSchema(id="s1", name="Spouse"),
+        children=[node]
+    )
+
+def test_deep_tree_converts_and_calculates_without_recursion():
+    """Test case: First Degree - 50,000 generations deep
+
+    Family structure:
+    - Deceased person
+    - Spouse (alive)
+    - 49,999 generations of deceased descendants
+        - Last heir (alive)
+
+    Expected shares:
+    - Spouse: 250,000 TL (1/4)
+    - Last heir: 750,000 TL (3/4)
+    """
+    schema = build_deep_schema(GENERATIONS)
+
+    root_node = convert_schema_to_model(schema)
+    estate = Estate(total_value=1000000, family_tree=FamilyTree(root=root_node))
+    calculator = InheritanceCalculator(estate)
+    result = calculator.calculate()
+
+    assert len(calculator.graph) == GENERATIONS + 2
+    assert result.share_map() == {"s1": 250000, f"g{GENERATIONS}": 750000}
+
+    # Shares are kept in the ledger; the converted tree is left untouched
+    node = root_node
+    while node.children:
+        node = node.children[0]
+    assert result.ledger[node.person.id] == 750000
+
+    shares = result.share_map()
+    summary = fill_response_tree(schema, shares, 1000000)
+
+    assert summary[f"g{GENERATIONS}"]["relation"] == "child"
+    assert summary[f"g{GENERATIONS}"]["share_percentage"] == 75
+    assert summary["s1"]["share"] == 250000
+
+def test_deep_graph_from_schema():
+    """Test case: the compact graph can be built straight from a deep schema"""
+    graph = FamilyGraph.from_family_node(build_deep_schema(GENERATIONS))
+
+    result = InheritanceCalculator(graph=graph, total_value=1000).calculate()
+
+    assert result.share_map() == {"s1": 250, f"g{GENERATIONS}": 750}
+
+def test_deep_nested_request_through_the_api():
+    """Test case: a 200-generation nested chain is parsed, cached, calculated and echoed back"""
+    heir = {"person": {"id": "g200", "name": "Last Heir"}}
+    node = heir
+    for generation in range(199, 0, -1):
+        node = {"person": {"id": f"g{generation}", "name": f"Generation {generation}", "is_alive": False},
+                "children": [node]}
+    family_tree = {"person": {"id": "d1", "name": "Deceased", "is_alive": False}, "children": [node]}
+    body = json.dumps({"estate_value": 1000, "family_tree": family_tree})
+
+    response = TestClient(app).post("/calculate", content=body, headers={"Content-Type": "application/json"})
+
+    assert response.status_code == 200
+    assert response.json()["summary"]["g200"]["share"] == 1000
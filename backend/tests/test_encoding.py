@@ -0,0 +1,73 @@
+import json
+import pytest
+from app.api import PersonSchema, ResponseView, calculate_request, encode_response, parse_calculation_request
+from app.encoding import JSON_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, negotiate_media_type, pack_response
+from tests.test_api import make_request, make_three_generation_tree
+
+def node_shape(node: dict) -> dict:
+    """Reshape a dumped family node like responses have it: refs alone, other nodes without ref"""
+    if node["ref"] is not None:
+        return {"ref": node["ref"]}
+    parents = node["parents"]
+    return {
+        "person": node["person"],
+        "spouse": node["spouse"],
+        "children": [node_shape(child) for child in node["children"]],
+        "parents": None if parents is None else {key: node_shape(parent) for key, parent in parents.items()},
+    }
+
+def expected_json(response) -> bytes:
+    """Encode a response the slow way, from ``model_dump``, for comparison with the encoder"""
+    data = response.model_dump(mode="json")
+    if "family_tree" in data:
+        data["family_tree"] = node_shape(data["family_tree"])
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+
+PAYLOADS = [
+    make_request(),
+    make_request(spouse_alive=None),
+    {"estate_value": 777.7, "family_tree": make_three_generation_tree(sibling_alive=True)},
+    {"estate_value": 1000, "deceased_id": "d1", "persons": [
+        {"id": "d1", "is_alive": False}, {"id": "c1", "name": "Child1", "mother_id": "d1"}
+    ]},
+]
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_encoder_matches_model_dump(payload):
+    """Test case: the direct encoder gives the same JSON as dumping the model, refs and parents included"""
+    response = calculate_request(parse_calculation_request(json.dumps(payload).encode()))
+
+    assert encode_response(response) == expected_json(response)
+
+@pytest.mark.parametrize("view", list(ResponseView))
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_msgpack_encoder_matches_json(payload, view):
+    """Test case: packing a response gives the same data as its JSON, refs and parents included"""
+    msgpack = pytest.importorskip("msgpack")
+    response = calculate_request(parse_calculation_request(json.dumps(payload).encode()), view)
+
+    packed = pack_response(response, lambda person: PersonSchema.__pydantic_serializer__.to_python(person, mode="json"))
+
+    assert msgpack.unpackb(packed) == json.loads(encode_response(response))
+
+def test_negotiation_prefers_json_unless_msgpack_ranks_higher():
+    """Test case: MessagePack is only picked when the client prefers it"""
+    pytest.importorskip("msgpack")
+
+    assert negotiate_media_type(None) == JSON_MEDIA_TYPE
+    assert negotiate_media_type("*/*") == JSON_MEDIA_TYPE
+    assert negotiate_media_type("application/msgpack") == MSGPACK_MEDIA_TYPE
+    assert negotiate_media_type("application/json, application/x-msgpack") == JSON_MEDIA_TYPE
+    assert negotiate_media_type("application/json;q=0.5, application/msgpack") == MSGPACK_MEDIA_TYPE
+    assert negotiate_media_type("text/html") == JSON_MEDIA_TYPE
+
+def test_calculate_answers_in_msgpack_when_asked(client):
+    """Test case: a MessagePack response decodes to the JSON response"""
+    msgpack = pytest.importorskip("msgpack")
+    as_json = client.post("/calculate", json=make_request())
+
+    as_msgpack = client.post("/calculate", json=make_request(), headers={"Accept": "application/msgpack"})
+
+    assert as_msgpack.headers["content-type"] == MSGPACK_MEDIA_TYPE
+    assert as_msgpack.headers["vary"] == "Accept"
+    assert msgpack.unpackb(as_msgpack.content) == as_json.json()
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import pytest
+from app.cache import result_cache
+from app.shared_cache import get_shared_result_cache
+from app.execution import ExecutionPolicy, ExecutionQueueFull, execution_policy
+from app.ingest import REQUEST_MAX_DEPTH, estimate_nodes
+from tests.test_api import make_request
+from tests.test_ingest import make_chain_request
+
+def test_policy_routes_by_node_count():
+    """Test case: node count thresholds pick the tier"""
+    policy = ExecutionPolicy(inline_max_nodes=10, thread_max_nodes=100)
+
+    assert policy.tier(1) == "inline"
+    assert policy.tier(10) == "inline"
+    assert policy.tier(11) == "thread"
+    assert policy.tier(100) == "thread"
+    assert policy.tier(101) == "process"
+
+def test_policy_rejects_when_the_queue_is_full():
+    """Test case: a pool at its queue limit turns new calculations away"""
+    policy = ExecutionPolicy(inline_max_nodes=0, thread_queue_limit=1)
+
+    async def run_two():
+        started = asyncio.Event()
+        release = asyncio.Event()
+        loop = asyncio.get_running_loop()
+
+        def wait_for_release(_):
+            loop.call_soon_threadsafe(started.set)
+            asyncio.run_coroutine_threadsafe(release.wait(), loop).result()
+            return "done"
+
+        first = asyncio.create_task(policy.run(wait_for_release, None, nodes=5))
+        await started.wait()
+        with pytest.raises(ExecutionQueueFull):
+            await policy.run(lambda _: "second", None, nodes=5)
+        release.set()
+        return await first
+
+    assert asyncio.run(run_two()) == "done"
+    assert policy.stats() == {"inline": 0, "thread": 1, "process": 0, "rejected": 1,
+                              "thread_pending": 0, "process_pending": 0}
+
+def test_calculate_offloads_medium_and_large_trees(client, monkeypatch):
+    """Test case: offloaded calculations give the same response as inline ones"""
+    inline = client.post("/calculate", json=make_request(estate_value=1000)).json()
+    result_cache.clear()
+    get_shared_result_cache().clear()
+
+    monkeypatch.setattr(execution_policy, "inline_max_nodes", 0)
+    before = execution_policy.stats()
+    threaded = client.post("/calculate", json=make_request(estate_value=1000)).json()
+    assert execution_policy.stats()["thread"] == before["thread"] + 1
+
+    monkeypatch.setattr(execution_policy, "thread_max_nodes", 0)
+    offloaded = client.post("/calculate", json=make_request(estate_value=1000, children_alive=(True, False)))
+    assert execution_policy.stats()["process"] == before["process"] + 1
+
+    assert threaded == inline
+    assert offloaded.json()["summary"]["c1"]["share"] == 750
+
+def test_requests_are_parsed_in_the_process_tier(client, monkeypatch):
+    """Test case: the process tier gets raw bytes, so deep trees pass and request errors come back intact"""
+    monkeypatch.setattr(execution_policy, "inline_max_nodes", 0)
+    monkeypatch.setattr(execution_policy, "thread_max_nodes", 0)
+    before = execution_policy.stats()["process"]
+
+    generations = (REQUEST_MAX_DEPTH - 3) // 2
+    deep = client.post("/calculate", content=json.dumps(make_chain_request(generations)))
+    invalid = client.post("/calculate", json={"estate_value": -1, "family_tree": make_request()["family_tree"]})
+    bad_parent = client.post("/calculate", json={"estate_value": 1000, "family_tree": {
+        "person": {"id": "d1", "name": "Deceased", "is_alive": False},
+        "parents": {"uncle": {"person": {"id": "u1", "name": "Uncle"}}}
+    }})
+
+    assert execution_policy.stats()["process"] == before + 3
+    assert deep.status_code == 200
+    assert deep.json()["summary"][f"g{generations}"]["share"] == 1000
+    assert invalid.status_code == 422
+    assert invalid.json()["detail"][0]["loc"][:2] == ["body", "nested"]
+    assert bad_parent.status_code == 400
+
+def test_tier_is_estimated_from_the_raw_body():
+    """Test case: nodes and persons table rows are counted without parsing"""
+    nested = json.dumps(make_request()).encode()
+    flat = json.dumps({"estate_value": 1, "deceased_id": "d1", "persons": [
+        {"id": "d1", "is_alive": False}, {"id": "c1", "name": "Child1", "mother_id": "d1"}
+    ]}).encode()
+
+    assert estimate_nodes(nested) == len(nested.split(b'"person"')) - 1
+    assert estimate_nodes(json.dumps(make_chain_request(5)).encode()) == 6
+    assert estimate_nodes(flat) == 2
+
+def test_calculate_returns_503_when_the_pool_is_full(client, monkeypatch):
+    """Test case: a full pool answers 503 with Retry-After"""
+    monkeypatch.setattr(execution_policy, "inline_max_nodes", 0)
+    monkeypatch.setitem(execution_policy.limits, "thread", 0)
+
+    response = client.post("/calculate", json=make_request(estate_value=123))
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
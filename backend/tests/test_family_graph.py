@@ -0,0 +1,127 @@
+import pytest
+from app.api import FamilyNodeSchema, convert_schema_to_model
+from app.models import FamilyNode, Person, ParentType
+from app.graph import FamilyGraph, NO_PERSON
+from app.calculations import InheritanceCalculator
+
+def test_graph_interns_ids_and_keeps_child_order():
+    """Test case: persons are interned once and children keep their order"""
+    root_node = FamilyNode(
+        person=Person(id="d1", name="Deceased", is_alive=False),
+        spouse=Person(id="s1", name="Spouse"),
+        children=[
+            FamilyNode(person=Person(id="c1", name="Child1")),
+            FamilyNode(
+                person=Person(id="c2", name="Child2", is_alive=False),
+                children=[FamilyNode(person=Person(id="gc1", name="Grandchild1"))]
+            ),
+        ],
+        parents={ParentType.MOTHER: FamilyNode(person=Person(id="m1", name="Mother"))}
+    )
+
+    graph = FamilyGraph.from_family_node(root_node)
+
+    assert len(graph) == 6
+    root = graph.index["d1"]
+    assert graph.root == root
+    assert [graph.ids[child] for child in graph.children(root)] == ["c1", "c2"]
+    assert graph.ids[graph.spouse[root]] == "s1"
+    assert graph.ids[graph.mother[root]] == "m1"
+    assert graph.father[root] == NO_PERSON
+    assert graph.alive[graph.index["c2"]] == 0
+
+    # Descendants always come before their ancestors
+    position = {person: i for i, person in enumerate(graph.postorder)}
+    assert position[graph.index["gc1"]] < position[graph.index["c2"]] < position[root]
+
+def test_graph_rejects_cycles():
+    """Test case: a person listed as their own descendant is rejected"""
+    root_node = FamilyNode(
+        person=Person(id="d1", name="Deceased", is_alive=False),
+        children=[
+            FamilyNode(
+                person=Person(id="c1", name="Child1", is_alive=False),
+                children=[FamilyNode(person=Person(id="d1", name="Deceased", is_alive=False))]
+            )
+        ]
+    )
+
+    with pytest.raises(ValueError, match="cycle"):
+        FamilyGraph.from_family_node(root_node)
+
+def test_full_sibling_listed_under_both_parents_inherits_both_halves():
+    """Test case: a full sibling repeated under both parents is one heir
+
+    Family structure:
+    - Deceased person (no spouse, no children)
+    - Mother (deceased) with children: Sibling1
+    - Father (deceased) with children: Sibling1, Half Sibling1
+
+    Expected shares:
+    - Sibling1: 750,000 TL (mother's half and half of father's half)
+    - Half Sibling1: 250,000 TL
+    """
+    root_node = FamilyNode(
+        person=Person(id="d1", name="Deceased", is_alive=False),
+        parents={
+            ParentType.MOTHER: FamilyNode(
+                person=Person(id="m1", name="Mother", is_alive=False),
+                children=[FamilyNode(person=Person(id="sib1", name="Sibling1"))]
+            ),
+            ParentType.FATHER: FamilyNode(
+                person=Person(id="f1", name="Father", is_alive=False),
+                children=[
+                    FamilyNode(person=Person(id="sib1", name="Sibling1")),
+                    FamilyNode(person=Person(id="hs1", name="Half Sibling1")),
+                ]
+            ),
+        }
+    )
+
+    graph = FamilyGraph.from_family_node(root_node)
+    result = InheritanceCalculator(graph=graph, total_value=1000000).calculate()
+
+    assert result.total_distributed == 1000000
+    assert result.share_map() == {"sib1": 750000, "hs1": 250000}
+
+def test_identical_subtrees_are_converted_once():
+    """Test case: a sibling branch listed under both parents becomes one shared node
+
+    Family structure:
+    - Deceased person
+    - Mother (deceased) and Father (deceased), both listing:
+        - Sibling1 (deceased)
+            - Nephew1 (alive)
+            - Nephew2 (alive)
+
+    Expected shares:
+    - Nephew1: 500,000 TL
+    - Nephew2: 500,000 TL
+    """
+    sibling = {
+        "person": {"id": "sib1", "name": "Sibling1", "is_alive": False},
+        "children": [
+            {"person": {"id": "n1", "name": "Nephew1"}},
+            {"person": {"id": "n2", "name": "Nephew2"}},
+        ]
+    }
+    schema = FamilyNodeSchema.model_validate({
+        "person": {"id": "d1", "name": "Deceased", "is_alive": False},
+        "parents": {
+            "mother": {"person": {"id": "m1", "name": "Mother", "is_alive": False}, "children": [sibling]},
+            "father": {"person": {"id": "f1", "name": "Father", "is_alive": False}, "children": [sibling]},
+        }
+    })
+
+    root_node = convert_schema_to_model(schema)
+
+    mother_node = root_node.parents[ParentType.MOTHER]
+    father_node = root_node.parents[ParentType.FATHER]
+    assert mother_node.children[0] is father_node.children[0]
+
+    calculator = InheritanceCalculator(graph=FamilyGraph.from_family_node(root_node), total_value=1000000, plan_cache=None)
+    result = calculator.calculate()
+
+    assert result.share_map() == {"n1": 500000, "n2": 500000}
+    # The sibling's branch was split once and reused for the second parent
+    assert list(calculator._descendant_memo) == [calculator.graph.index["sib1"]]
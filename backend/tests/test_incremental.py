@@ -0,0 +1,114 @@
+import pytest
+from app.models import FamilyNode, Person, ParentType
+from app.graph import FamilyGraph, FamilyGraphBuilder
+from app.calculations import InheritanceCalculator
+from app.incremental import IncrementalCalculator
+
+def make_graph() -> FamilyGraph:
+    """Deceased with a living spouse, two children and a mother with a second child
+
+    - Child1 (alive)
+    - Child2 (deceased) with Grandchild1 (alive) and Grandchild2 (deceased)
+    - Mother (deceased) with Sibling1 (alive)
+    """
+    root_node = FamilyNode(
+        person=Person(id="d1", name="Deceased", is_alive=False),
+        spouse=Person(id="s1", name="Spouse"),
+        children=[
+            FamilyNode(person=Person(id="c1", name="Child1")),
+            FamilyNode(
+                person=Person(id="c2", name="Child2", is_alive=False),
+                children=[
+                    FamilyNode(person=Person(id="gc1", name="Grandchild1")),
+                    FamilyNode(person=Person(id="gc2", name="Grandchild2", is_alive=False)),
+                ]
+            ),
+        ],
+        parents={
+            ParentType.MOTHER: FamilyNode(
+                person=Person(id="m1", name="Mother", is_alive=False),
+                children=[FamilyNode(person=Person(id="sib1", name="Sibling1"))]
+            )
+        }
+    )
+    return FamilyGraph.from_family_node(root_node)
+
+def full_shares(calculator: IncrementalCalculator):
+    """Recalculate the edited graph from scratch"""
+    edited = calculator.graph
+    builder = FamilyGraphBuilder()
+    for person, person_id in enumerate(edited.ids):
+        if not edited.removed[person]:
+            builder.add_person(person_id, edited.alive[person])
+    for person, person_id in enumerate(edited.ids):
+        if edited.removed[person]:
+            continue
+        for child in edited.children(person):
+            builder.add_child(builder.index[person_id], builder.index[edited.ids[child]])
+        for parent_type, parents in ((ParentType.MOTHER, edited.mother), (ParentType.FATHER, edited.father)):
+            if parents[person] >= 0:
+                builder.set_parent(builder.index[person_id], parent_type, builder.index[edited.ids[parents[person]]])
+        if edited.spouse[person] >= 0:
+            builder.set_spouse(builder.index[person_id], builder.index[edited.ids[edited.spouse[person]]])
+
+    graph = builder.build(builder.index[edited.ids[edited.root]])
+    return InheritanceCalculator(graph=graph, total_value=calculator.total_value, plan_cache=None).calculate().share_map()
+
+def test_edits_match_full_recalculation():
+    """Test case: every kind of edit gives the same shares as starting over"""
+    calculator = IncrementalCalculator(make_graph(), total_value=1000000)
+
+    update = calculator.recalculate()
+    assert update.shares == {"s1": 250000, "c1": 375000, "gc1": 375000}
+    assert update.changed == {person_id: (0, share) for person_id, share in update.shares.items()}
+
+    update = calculator.add_child("gc2", "ggc1")
+    assert update.shares == full_shares(calculator)
+    assert update.changed == {"gc1": (375000, 187500), "ggc1": (0, 187500)}
+
+    update = calculator.set_alive("c1", False)
+    assert update.shares == full_shares(calculator)
+    assert update.changed == {"c1": (375000, 0), "gc1": (187500, 375000), "ggc1": (187500, 375000)}
+
+    update = calculator.remove_person("c2")
+    assert update.shares == full_shares(calculator) == {"s1": 500000, "sib1": 250000}
+    assert "gc1" not in calculator.graph.index
+
+    update = calculator.set_total_value(10)
+    assert update.shares == {"s1": 5, "sib1": 2.5}
+    assert update.total_distributed == 7.5
+
+def test_untouched_branches_keep_their_memoized_split():
+    """Test case: an edit in one branch does not recompute the split of another"""
+    calculator = IncrementalCalculator(make_graph(), total_value=1000000)
+    calculator.add_child("c2", "gc3")
+    graph = calculator.graph
+    c2_split = calculator._descendant_memo[graph.index["c2"]]
+
+    calculator.add_child("c1", "gc4", is_alive=False)
+    assert calculator._descendant_memo[graph.index["c2"]] is c2_split
+
+    calculator.add_child("gc2", "ggc1")
+    assert calculator._descendant_memo[graph.index["c2"]] is not c2_split
+
+def test_estate_value_change_reuses_the_plan():
+    """Test case: only changing the estate value does not recompile"""
+    calculator = IncrementalCalculator(make_graph(), total_value=1000000)
+    calculator.recalculate()
+    plan = calculator._plan
+
+    update = calculator.set_total_value(2000)
+
+    assert calculator._plan is plan
+    assert update.changed == {"s1": (250000, 500), "c1": (375000, 750), "gc1": (375000, 750)}
+
+def test_invalid_edits_are_rejected():
+    """Test case: cycles, unknown persons and removing the deceased raise ValueError"""
+    calculator = IncrementalCalculator(make_graph(), total_value=1000000)
+
+    with pytest.raises(ValueError, match="cycle"):
+        calculator.add_child("gc1", "c2")
+    with pytest.raises(ValueError, match="Unknown person"):
+        calculator.set_alive("x1", True)
+    with pytest.raises(ValueError, match="cannot be removed"):
+        calculator.remove_person("d1")
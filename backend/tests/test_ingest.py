@@ -0,0 +1,136 @@
+import gzip
+import json
+import pytest
+import app.api as api
+from app.execution import execution_policy
+from app.ingest import REQUEST_MAX_DEPTH, json_depth, split_json_array
+from tests.test_api import make_request
+
+def make_chain_request(generations: int):
+    """Build a /calculate payload for a chain of deceased descendants ending in one living heir"""
+    node = {"person": {"id": f"g{generations}", "name": "Last Heir"}}
+    for generation in range(generations - 1, 0, -1):
+        node = {"person": {"id": f"g{generation}", "name": f"Generation {generation}", "is_alive": False},
+                "children": [node]}
+    return {
+        "estate_value": 1000,
+        "family_tree": {"person": {"id": "d1", "name": "Deceased", "is_alive": False}, "children": [node]}
+    }
+
+def post_raw(client, body: bytes, **headers):
+    return client.post("/calculate", content=body, headers={"content-type": "application/json", **headers})
+
+def test_json_depth_ignores_brackets_in_strings():
+    """Test case: only structural brackets count towards the depth"""
+    assert json_depth(b'{"a": [1, {"b": "}}]]"}], "c": "\\"[[[["}') == 3
+    assert json_depth(b'{"a": [{"b": "x"}], "c": {}}') == 3
+    assert json_depth(b'[]') == 1
+    assert json_depth(b'42') == 0
+
+def test_split_json_array_keeps_items_raw():
+    """Test case: a batch body is split at its top-level objects only"""
+    assert split_json_array(b' [ {"a": "}{[", "b": [1, {}]} , {"c": "\\"}"} ] ') == [
+        b'{"a": "}{[", "b": [1, {}]}', b'{"c": "\\"}"}'
+    ]
+    assert split_json_array(b"[]") == []
+    assert split_json_array(b'[{"a": [[[}]') == [b'{"a": [[[}']
+    for body in (b"{}", b"[1]", b"[{}, 1]", b"[{} {}]", b"[{}]]", b"[{},]"):
+        with pytest.raises(ValueError):
+            split_json_array(body)
+
+def test_gzip_body_gives_the_same_response(client):
+    """Test case: a gzip-encoded body is inflated before validation"""
+    body = json.dumps(make_request()).encode()
+    plain = post_raw(client, body)
+
+    compressed = post_raw(client, gzip.compress(body), **{"content-encoding": "gzip"})
+
+    assert compressed.status_code == 200
+    assert compressed.content == plain.content
+
+def test_body_limits_and_encodings(client, monkeypatch):
+    """Test case: oversized and undecodable bodies are rejected before parsing"""
+    body = json.dumps(make_request()).encode()
+    monkeypatch.setattr("app.ingest.REQUEST_MAX_BYTES", len(body) - 1)
+
+    assert post_raw(client, body).status_code == 413
+    # The limit applies to the inflated body, however small the compressed one is
+    assert post_raw(client, gzip.compress(body), **{"content-encoding": "gzip"}).status_code == 413
+    assert post_raw(client, body, **{"content-encoding": "br"}).status_code == 415
+    assert post_raw(client, gzip.compress(body)[:20], **{"content-encoding": "gzip"}).status_code == 400
+
+def test_invalid_json_is_a_422(client):
+    """Test case: malformed JSON is reported like any other body validation error"""
+    response = post_raw(client, b'{"estate_value": 1000, "family_tree": ')
+
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["type"] == "json_invalid"
+    assert response.json()["detail"][0]["loc"][0] == "body"
+
+def test_nesting_is_limited_before_parsing(client, monkeypatch):
+    """Test case: deep trees calculate up to REQUEST_MAX_DEPTH levels and are a 422 beyond"""
+    body = json.dumps(make_chain_request(100)).encode()
+
+    response = post_raw(client, body)
+    assert response.status_code == 200
+    assert response.json()["summary"]["g100"]["share"] == 1000
+
+    # A lower limit applies to bodies that are not already cached
+    monkeypatch.setattr(api, "REQUEST_MAX_DEPTH", 150)
+    api.result_cache.clear()
+    api.get_shared_result_cache().clear()
+    response = post_raw(client, body)
+    assert response.status_code == 422
+    assert "nested" in response.json()["detail"]
+
+@pytest.mark.parametrize("inline_max_nodes, thread_max_nodes", [(10**6, 10**6), (0, 10**6), (0, 0)])
+def test_default_depth_limit_is_supported_in_every_tier(client, monkeypatch, inline_max_nodes, thread_max_nodes):
+    """Test case: a chain right at the default REQUEST_MAX_DEPTH calculates inline, in threads and in processes"""
+    generations = (REQUEST_MAX_DEPTH - 3) // 2
+    body = json.dumps(make_chain_request(generations)).encode()
+    assert json_depth(body) == REQUEST_MAX_DEPTH
+    monkeypatch.setattr(execution_policy, "inline_max_nodes", inline_max_nodes)
+    monkeypatch.setattr(execution_policy, "thread_max_nodes", thread_max_nodes)
+
+    response = post_raw(client, body)
+    assert response.status_code == 200
+    assert response.json()["summary"][f"g{generations}"]["share"] == 1000
+
+    response = post_raw(client, json.dumps(make_chain_request(generations + 1)).encode())
+    assert response.status_code == 422
+    assert "nested" in response.json()["detail"]
+
+def test_batch_items_are_checked_and_fail_on_their_own(client, monkeypatch):
+    """Test case: too deep or unparseable batch items do not fail the others, in any tier"""
+    monkeypatch.setattr(execution_policy, "inline_max_nodes", 0)
+    monkeypatch.setattr(execution_policy, "thread_max_nodes", 0)
+    body = b"[" + b",".join([
+        json.dumps(make_request()).encode(),
+        json.dumps(make_chain_request(300)).encode(),
+        b"{" + b"[" * 100000,
+    ]) + b"]"
+
+    response = client.post("/calculate/batch", content=gzip.compress(body),
+                           headers={"content-type": "application/json", "content-encoding": "gzip"})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert results[0]["result"]["summary"]["s1"]["share"] == 250000
+    assert results[1]["error"]["status_code"] == 422
+    assert "levels deep" in results[1]["error"]["detail"]
+    assert results[2]["error"]["status_code"] == 422
+    assert client.post("/calculate/batch", json={"not": "a list"}).status_code == 422
+
+def test_stream_records_are_checked_and_fail_on_their_own(client):
+    """Test case: a too deeply nested NDJSON record is an error line and the stream goes on"""
+    valid = json.dumps(make_request()).encode()
+    body = b"\n".join([valid, b"[" * 100000, valid]) + b"\n"
+
+    response = client.post("/calculate/stream", content=body)
+
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lines) == 3
+    assert lines[1]["error"]["status_code"] == 422
+    assert lines[0] == lines[2]
+    assert lines[0]["summary"]["s1"]["share"] == 250000
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+from app.models import FamilyNode, Person, ParentType
+from app.graph import FamilyGraph
+from app.liveness import LivenessIndex
+from app.calculations import InheritanceCalculator
+
+def make_graph() -> FamilyGraph:
+    """Deceased with a deceased child, and a full sibling listed under both parents
+
+    - Child1 (deceased) with Grandchild1 (alive) and Grandchild2 (deceased)
+    - Mother and Father (both deceased) each listing Sibling1 (deceased) with Nephew1 (alive)
+    """
+    sibling = FamilyNode(
+        person=Person(id="sib1", name="Sibling1", is_alive=False),
+        children=[FamilyNode(person=Person(id="n1", name="Nephew1"))]
+    )
+    root_node = FamilyNode(
+        person=Person(id="d1", name="Deceased", is_alive=False),
+        children=[
+            FamilyNode(
+                person=Person(id="c1", name="Child1", is_alive=False),
+                children=[
+                    FamilyNode(person=Person(id="gc1", name="Grandchild1")),
+                    FamilyNode(person=Person(id="gc2", name="Grandchild2", is_alive=False)),
+                ]
+            )
+        ],
+        parents={
+            ParentType.MOTHER: FamilyNode(person=Person(id="m1", name="Mother", is_alive=False), children=[sibling]),
+            ParentType.FATHER: FamilyNode(person=Person(id="f1", name="Father", is_alive=False), children=[sibling]),
+        }
+    )
+    return FamilyGraph.from_family_node(root_node)
+
+def test_branch_counts():
+    """Test case: every branch counts its living persons"""
+    graph = make_graph()
+    index = LivenessIndex(graph)
+    living = {person_id: index.living(graph.index[person_id]) for person_id in graph.ids}
+
+    assert living == {"d1": 1, "c1": 1, "gc1": 1, "gc2": 0, "m1": 1, "f1": 1, "sib1": 1, "n1": 1}
+    assert not index.has_living(graph.index["gc2"])
+
+def test_toggles_update_every_branch():
+    """Test case: a liveness change reaches every parent listing the person"""
+    graph = make_graph()
+    index = LivenessIndex(graph)
+
+    index.set_alive(graph.index["n1"], False)
+    index.set_alive(graph.index["gc2"], True)
+
+    assert not index.has_living(graph.index["m1"])
+    assert not index.has_living(graph.index["f1"])
+    assert index.living(graph.index["c1"]) == 2
+    assert index.living(graph.index["d1"]) == 2
+
+    index.set_alive(graph.index["sib1"], True)
+    assert index.has_living(graph.index["m1"]) and index.has_living(graph.index["f1"])
+
+def make_pedigree_table(generations: int, children: int, grandchildren: int):
+    """Flat persons table: ten generations of ancestors above the deceased and a large family below
+
+    Every person lists both parents, so each branch below the deceased is
+    reachable from every one of the ancestors at the top.
+    """
+    rows = [SimpleNamespace(id="d1", is_alive=False, mother_id="a1_0", father_id="a1_1", spouse_id="s1")]
+    rows.append(SimpleNamespace(id="s1", is_alive=True, mother_id=None, father_id=None, spouse_id="d1"))
+    for generation in range(1, generations + 1):
+        for position in range(2 ** generation):
+            has_parents = generation < generations
+            rows.append(SimpleNamespace(
+                id=f"a{generation}_{position}", is_alive=False, spouse_id=None,
+                mother_id=f"a{generation + 1}_{2 * position}" if has_parents else None,
+                father_id=f"a{generation + 1}_{2 * position + 1}" if has_parents else None,
+            ))
+    for child in range(children):
+        rows.append(SimpleNamespace(id=f"c{child}", is_alive=False, mother_id="s1", father_id="d1", spouse_id=None))
+        for grandchild in range(grandchildren):
+            rows.append(SimpleNamespace(
+                id=f"g{child}_{grandchild}", is_alive=True, mother_id=None, father_id=f"c{child}", spouse_id=None
+            ))
+    return rows
+
+def test_multi_generation_flat_table():
+    """Test case: a ten-generation pedigree with a thousand descendants is indexed once per person"""
+    rows = make_pedigree_table(generations=10, children=10, grandchildren=100)
+    graph = FamilyGraph.from_persons(rows, "d1")
+    index = LivenessIndex(graph)
+    top = graph.index["a10_0"]
+
+    assert len(graph) == 3058
+    assert index.living(top) == index.living(graph.index["d1"]) == 1000
+    assert index.living(graph.index["s1"]) == 1001
+
+    for grandchild in range(100):
+        index.set_alive(graph.index[f"g3_{grandchild}"], False)
+    assert not index.has_living(graph.index["c3"])
+    assert index.living(top) == 900
+
+    shares = InheritanceCalculator(graph=graph, total_value=1000, plan_cache=None).calculate().share_map()
+    assert shares["s1"] == 250
+    assert all(abs(shares[f"g{child}_0"] - 0.75) < 1e-9 for child in range(10))
@@ -1,4 +1,6 @@
 import pytest
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import ValidationError
 from app.models import (
     Estate, FamilyTree, FamilyNode, Person,
     ParentType, MarriageInfo
@@ -42,7 +44,7 @@ def test_spouse_only():
     result = calculator.calculate()
 
     assert result.total_distributed == 1000000
-    assert spouse.share == 1000000  # Spouse gets everything
+    assert result.ledger[spouse.id] == 1000000  # Spouse gets everything
 
 def test_spouse_with_children():
     """Test case: Basic nuclear family
@@ -102,9 +104,9 @@ def test_spouse_with_children():
     result = calculator.calculate()
 
     assert result.total_distributed == 1000000
-    assert spouse.share == 250000   # Spouse: 1/4
-    assert child1.share == 375000   # Child1: 3/8
-    assert child2.share == 375000   # Child2: 3/8
+    assert result.ledger[spouse.id] == 250000   # Spouse: 1/4
+    assert result.ledger[child1.id] == 375000   # Child1: 3/8
+    assert result.ledger[child2.id] == 375000   # Child2: 3/8
 
 def test_first_degree_with_half_siblings():
     """Test case: First Degree with Half-Siblings
@@ -202,11 +204,11 @@ def test_first_degree_with_half_siblings():
     result = calculator.calculate()
 
     assert result.total_distributed == 1000000
-    assert spouse.share == 250000  # Spouse: 1/4
-    assert child1.share == 250000  # Child1: 1/4
-    assert grandchild1.share == 125000  # Grandchild1: 1/8
-    assert grandchild2.share == 125000  # Grandchild2: 1/8
-    assert child3.share == 250000  # Child3: 1/4
+    assert result.ledger[spouse.id] == 250000  # Spouse: 1/4
+    assert result.ledger[child1.id] == 250000  # Child1: 1/4
+    assert result.ledger[grandchild1.id] == 125000  # Grandchild1: 1/8
+    assert result.ledger[grandchild2.id] == 125000  # Grandchild2: 1/8
+    assert result.ledger[child3.id] == 250000  # Child3: 1/4
 
 def test_parents_with_spouse():
     """Test case: Both parents alive with spouse
@@ -264,9 +266,9 @@ def test_parents_with_spouse():
     result = calculator.calculate()
 
     assert result.total_distributed == 1000000
-    assert spouse.share == 500000   # Spouse: 1/2
-    assert mother.share == 250000   # Mother: 1/4
-    assert father.share == 250000   # Father: 1/4
+    assert result.ledger[spouse.id] == 500000   # Spouse: 1/2
+    assert result.ledger[mother.id] == 250000   # Mother: 1/4
+    assert result.ledger[father.id] == 250000   # Father: 1/4
 
 def test_complex_second_degree_with_multiple_marriages():
     """Test case: Complex Second Degree with Multiple Marriages
@@ -409,11 +411,11 @@ def test_complex_second_degree_with_multiple_marriages():
     def assert_share(actual: float, expected: float, tolerance: float = 1.0):
         assert abs(actual - expected) < tolerance, f"Expected {expected}, got {actual}"
 
-    assert_share(spouse.share, 500000)    # Spouse: 1/2
-    assert_share(full_sibling1.share, 125000)   # Full Sibling1: 1/8
-    assert_share(nephew1.share, 125000)    # Nephew1: 1/8
-    assert_share(half_sibling1.share, 125000)   # Half Sibling1: 1/8
-    assert_share(half_nephew1.share, 125000)   # Half Nephew1: 1/8
+    assert_share(result.ledger[spouse.id], 500000)    # Spouse: 1/2
+    assert_share(result.ledger[full_sibling1.id], 125000)   # Full Sibling1: 1/8
+    assert_share(result.ledger[nephew1.id], 125000)    # Nephew1: 1/8
+    assert_share(result.ledger[half_sibling1.id], 125000)   # Half Sibling1: 1/8
+    assert_share(result.ledger[half_nephew1.id], 125000)   # Half Nephew1: 1/8
 
 def test_third_degree_with_previous_marriage_children():
     """Test case: Third Degree with Previous Marriage Children
@@ -520,10 +522,10 @@ def test_third_degree_with_previous_marriage_children():
     def assert_share(actual: float, expected: float, tolerance: float = 1.0):
         assert abs(actual - expected) < tolerance, f"Expected {expected}, got {actual}"
 
-    assert_share(spouse.share, 750000)    # Spouse: 3/4
-    assert_share(maternal_grandmother.share, 125000)   # Grandmother: 1/8
-    assert_share(uncle1.share, 62500)    # Uncle1: 1/16
-    assert_share(uncle2.share, 62500)   # Uncle2: 1/16 
+    assert_share(result.ledger[spouse.id], 750000)    # Spouse: 3/4
+    assert_share(result.ledger[maternal_grandmother.id], 125000)   # Grandmother: 1/8
+    assert_share(result.ledger[uncle1.id], 62500)    # Uncle1: 1/16
+    assert_share(result.ledger[uncle2.id], 62500)   # Uncle2: 1/16 
 
 def test_second_degree_with_half_siblings():
     """Test case: Second Degree with Half-Siblings
@@ -613,10 +615,10 @@ def test_second_degree_with_half_siblings():
     result = calculator.calculate()
 
     assert result.total_distributed == 1000000
-    assert spouse.share == 500000  # Spouse: 1/2
-    assert mother.share == 250000  # Mother: 1/4
-    assert sibling1.share == 125000  # Sibling1: 1/8
-    assert sibling2.share == 125000  # Sibling2: 1/8
+    assert result.ledger[spouse.id] == 500000  # Spouse: 1/2
+    assert result.ledger[mother.id] == 250000  # Mother: 1/4
+    assert result.ledger[sibling1.id] == 125000  # Sibling1: 1/8
+    assert result.ledger[sibling2.id] == 125000  # Sibling2: 1/8
 
 def test_complex_first_degree_multiple_marriages():
     """Test case: Complex First Degree with Multiple Marriages
@@ -742,12 +744,12 @@ def test_complex_first_degree_multiple_marriages():
         assert abs(actual - expected) < tolerance
 
     assert result.total_distributed == 1000000
-    assert_share(current_spouse.share, 250000)  # Current Spouse: 1/4
-    assert_share(child1.share, 187500)  # Child1: 3/16
-    assert_share(grandchild1.share, 187500)  # Grandchild1: 3/16
-    assert_share(child3.share, 187500)  # Child3: 3/16
-    assert_share(grandchild2.share, 93750)  # Grandchild2: 3/32
-    assert_share(grandchild3.share, 93750)  # Grandchild3: 3/32 
+    assert_share(result.ledger[current_spouse.id], 250000)  # Current Spouse: 1/4
+    assert_share(result.ledger[child1.id], 187500)  # Child1: 3/16
+    assert_share(result.ledger[grandchild1.id], 187500)  # Grandchild1: 3/16
+    assert_share(result.ledger[child3.id], 187500)  # Child3: 3/16
+    assert_share(result.ledger[grandchild2.id], 93750)  # Grandchild2: 3/32
+    assert_share(result.ledger[grandchild3.id], 93750)  # Grandchild3: 3/32 
 
 def test_first_degree_only_children():
     """Test case: First Degree - Only Children
@@ -835,10 +837,10 @@ def test_first_degree_only_children():
         assert abs(actual - expected) < tolerance, f"Expected {expected}, got {actual}"
 
     assert result.total_distributed == 1000000
-    assert_share(child1.share, 333333.33)  # Child1: 1/3
-    assert_share(child2.share, 333333.33)  # Child2: 1/3
-    assert_share(grandchild1.share, 166666.67)  # Grandchild1: 1/6
-    assert_share(grandchild2.share, 166666.67)  # Grandchild2: 1/6
+    assert_share(result.ledger[child1.id], 333333.33)  # Child1: 1/3
+    assert_share(result.ledger[child2.id], 333333.33)  # Child2: 1/3
+    assert_share(result.ledger[grandchild1.id], 166666.67)  # Grandchild1: 1/6
+    assert_share(result.ledger[grandchild2.id], 166666.67)  # Grandchild2: 1/6
 
 def test_second_degree_only_parents():
     """Test case: Second Degree - Only Parents
@@ -890,8 +892,8 @@ def test_second_degree_only_parents():
         assert abs(actual - expected) < tolerance, f"Expected {expected}, got {actual}"
 
     assert result.total_distributed == 1000000
-    assert_share(mother.share, 500000)  # Mother: 1/2
-    assert_share(father.share, 500000)  # Father: 1/2
+    assert_share(result.ledger[mother.id], 500000)  # Mother: 1/2
+    assert_share(result.ledger[father.id], 500000)  # Father: 1/2
 
 def test_second_degree_one_parent_with_siblings():
     """Test case: Second Degree - One Parent with Siblings
@@ -1002,11 +1004,11 @@ def test_second_degree_one_parent_with_siblings():
         assert abs(actual - expected) < tolerance, f"Expected {expected}, got {actual}"
 
     assert result.total_distributed == 1000000
-    assert_share(mother.share, 500000)  # Mother: 1/2
-    assert_share(sibling1.share, 166666)  # Full Sibling1: 1/6
-    assert_share(sibling2.share, 166666)  # Full Sibling2: 1/6
-    assert_share(nephew1.share, 83333)  # Nephew1: 1/12
-    assert_share(nephew2.share, 83333)  # Nephew2: 1/12 
+    assert_share(result.ledger[mother.id], 500000)  # Mother: 1/2
+    assert_share(result.ledger[sibling1.id], 166666)  # Full Sibling1: 1/6
+    assert_share(result.ledger[sibling2.id], 166666)  # Full Sibling2: 1/6
+    assert_share(result.ledger[nephew1.id], 83333)  # Nephew1: 1/12
+    assert_share(result.ledger[nephew2.id], 83333)  # Nephew2: 1/12 
 
 def test_third_degree_only_grandparents():
     """Test case: Third Degree - Only Grandparents
@@ -1090,9 +1092,9 @@ def test_third_degree_only_grandparents():
         assert abs(actual - expected) < tolerance, f"Expected {expected}, got {actual}"
 
     assert result.total_distributed == 1000000
-    assert_share(maternal_grandmother.share, 250000)  # Maternal Grandmother: 1/4
-    assert_share(maternal_grandfather.share, 250000)  # Maternal Grandfather: 1/4
-    assert_share(paternal_grandmother.share, 500000)  # Paternal Grandmother: 1/2
+    assert_share(result.ledger[maternal_grandmother.id], 250000)  # Maternal Grandmother: 1/4
+    assert_share(result.ledger[maternal_grandfather.id], 250000)  # Maternal Grandfather: 1/4
+    assert_share(result.ledger[paternal_grandmother.id], 500000)  # Paternal Grandmother: 1/2
 
 def test_third_degree_grandparents_and_uncles():
     """Test case: Third Degree - Grandparents and Uncles
@@ -1201,8 +1203,8 @@ def test_third_degree_grandparents_and_uncles():
         assert abs(actual - expected) < tolerance, f"Expected {expected}, got {actual}"
 
     assert result.total_distributed == 1000000
-    assert_share(maternal_grandmother.share, 500000)  # Maternal Grandmother: 1/2
-    assert_share(uncle1.share, 500000)  # Uncle1: 1/2
+    assert_share(result.ledger[maternal_grandmother.id], 500000)  # Maternal Grandmother: 1/2
+    assert_share(result.ledger[uncle1.id], 500000)  # Uncle1: 1/2
 
 def test_first_degree_complex_multiple_lines():
     """Test case: First Degree - Complex Multiple Lines
@@ -1349,13 +1351,13 @@ def test_first_degree_complex_multiple_lines():
         assert abs(actual - expected) <= 1.0, f"Expected {expected}, got {actual}"
 
     assert result.total_distributed == 1000000
-    assert_share(child1.share, 333333.33)  # Child1: 1/3
-    assert_share(grandchild1.share, 166666.67)  # Grandchild1: 1/6
-    assert_share(great_grandchild1.share, 83333.33)  # Great-grandchild1: 1/12
-    assert_share(great_grandchild2.share, 83333.33)  # Great-grandchild2: 1/12
-    assert_share(grandchild3.share, 111111.11)  # Grandchild3: 1/9
-    assert_share(grandchild4.share, 111111.11)  # Grandchild4: 1/9
-    assert_share(grandchild5.share, 111111.11)  # Grandchild5: 1/9
+    assert_share(result.ledger[child1.id], 333333.33)  # Child1: 1/3
+    assert_share(result.ledger[grandchild1.id], 166666.67)  # Grandchild1: 1/6
+    assert_share(result.ledger[great_grandchild1.id], 83333.33)  # Great-grandchild1: 1/12
+    assert_share(result.ledger[great_grandchild2.id], 83333.33)  # Great-grandchild2: 1/12
+    assert_share(result.ledger[grandchild3.id], 111111.11)  # Grandchild3: 1/9
+    assert_share(result.ledger[grandchild4.id], 111111.11)  # Grandchild4: 1/9
+    assert_share(result.ledger[grandchild5.id], 111111.11)  # Grandchild5: 1/9
 
 def test_second_degree_complex_mixed_siblings():
     """Test case: Second Degree - Complex Mixed Siblings
@@ -1522,12 +1524,12 @@ def test_second_degree_complex_mixed_siblings():
         assert abs(actual - expected) < tolerance, f"Expected {expected}, got {actual}"
 
     assert result.total_distributed == 1000000
-    assert_share(full_sibling1.share, 250000)  # Full Sibling1: 1/4
-    assert_share(nephew1.share, 125000)  # Nephew1: 1/8
-    assert_share(grand_nephew1.share, 125000)  # Grand-nephew1: 1/8
-    assert_share(half_sibling1.share, 250000)  # Half Sibling1: 1/4
-    assert_share(half_nephew1.share, 125000)  # Half Nephew1: 1/8
-    assert_share(half_nephew2.share, 125000)  # Half Nephew2: 1/8 
+    assert_share(result.ledger[full_sibling1.id], 250000)  # Full Sibling1: 1/4
+    assert_share(result.ledger[nephew1.id], 125000)  # Nephew1: 1/8
+    assert_share(result.ledger[grand_nephew1.id], 125000)  # Grand-nephew1: 1/8
+    assert_share(result.ledger[half_sibling1.id], 250000)  # Half Sibling1: 1/4
+    assert_share(result.ledger[half_nephew1.id], 125000)  # Half Nephew1: 1/8
+    assert_share(result.ledger[half_nephew2.id], 125000)  # Half Nephew2: 1/8 
 
 def test_third_degree_complex_mixed_uncles():
     """Test case: Third Degree - Complex Mixed Uncles or aunts
@@ -1754,8 +1756,111 @@ def test_third_degree_complex_mixed_uncles():
 
 
     # Maternal side
-    assert_share(maternal_grandmother.share, 250000)  # Maternal Grandmother: 1/4
-    assert_share(uncle1.share, 125000)  # Uncle1: 1/8
-    assert_share(uncle3.share, 125000)  # Uncle3: 1/8
+    assert_share(result.ledger[maternal_grandmother.id], 250000)  # Maternal Grandmother: 1/4
+    assert_share(result.ledger[uncle1.id], 125000)  # Uncle1: 1/8
+    assert_share(result.ledger[uncle3.id], 125000)  # Uncle3: 1/8
     # Paternal side
-    assert_share(uncle5.share, 500000)  # Uncle5: 1/2
+    assert_share(result.ledger[uncle5.id], 500000)  # Uncle5: 1/2
+
+def test_wide_tree_of_deceased_branches():
+    """Test case: First Degree - Many Deceased Branches
+
+    Family structure:
+    - Deceased person
+    - 10,000 deceased children
+        - Each with one living grandchild
+
+    Expected shares:
+    - Each grandchild: 100 TL (1/10,000)
+    - Living-descendant counts are annotated once for every node
+    """
+    deceased = Person(id="d1", name="Deceased", is_alive=False)
+
+    grandchildren = []
+    children = []
+    for i in range(10000):
+        grandchild = Person(id=f"gc{i}", name=f"Grandchild{i}", parent_id=f"c{i}")
+        grandchildren.append(grandchild)
+        children.append(FamilyNode(
+            person=Person(id=f"c{i}", name=f"Child{i}", parent_id="d1", is_alive=False),
+            children=[FamilyNode(person=grandchild)]
+        ))
+
+    root_node = FamilyNode(person=deceased, children=children)
+
+    # Create family tree
+    family_tree = FamilyTree(root=root_node)
+    estate = Estate(total_value=1000000, family_tree=family_tree)
+
+    # Calculate inheritance
+    calculator = InheritanceCalculator(estate)
+    result = calculator.calculate()
+
+    assert abs(result.total_distributed - 1000000) < 1.0
+    assert len(calculator.graph) == 20001
+    assert calculator._liveness.living(calculator.graph.index["d1"]) == 10000
+    assert all(abs(result.ledger[grandchild.id] - 100) < 1.0 for grandchild in grandchildren)
+
+def test_same_tree_calculated_concurrently():
+    """Test case: one immutable tree is calculated from several threads at once
+
+    Family structure:
+    - Deceased person
+    - Spouse (living)
+    - Child1 (deceased) with Grandchild1 and Grandchild2 (living)
+    - Child2 (living)
+
+    Expected shares (for every estate value v):
+    - Spouse: v/4, Child2: 3v/8, Grandchild1 and Grandchild2: 3v/16 each
+    """
+    grandchild1 = Person(id="gc1", name="Grandchild1", parent_id="c1")
+    grandchild2 = Person(id="gc2", name="Grandchild2", parent_id="c1")
+    root_node = FamilyNode(
+        person=Person(id="d1", name="Deceased", is_alive=False),
+        spouse=Person(id="s1", name="Spouse"),
+        children=[
+            FamilyNode(
+                person=Person(id="c1", name="Child1", is_alive=False, parent_id="d1"),
+                children=[FamilyNode(person=grandchild1), FamilyNode(person=grandchild2)]
+            ),
+            FamilyNode(person=Person(id="c2", name="Child2", parent_id="d1")),
+        ]
+    )
+    family_tree = FamilyTree(root=root_node)
+
+    def calculate(total_value):
+        estate = Estate(total_value=total_value, family_tree=family_tree)
+        return InheritanceCalculator(estate).calculate().ledger.heirs()
+
+    values = [16000 * (i + 1) for i in range(32)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(calculate, values))
+
+    for value, shares in zip(values, results):
+        assert shares == {"s1": value / 4, "c2": value * 3 / 8, "gc1": value * 3 / 16, "gc2": value * 3 / 16}
+    assert "share" not in Person.model_fields
+
+    with pytest.raises(ValidationError):
+        grandchild1.is_alive = False
+
+def test_heir_queries_leave_the_tree_untouched():
+    """Test case: nephews inheriting through a deceased sibling are returned as copies"""
+    nephew = Person(id="n1", name="Nephew1")
+    root_node = FamilyNode(
+        person=Person(id="d1", name="Deceased", is_alive=False),
+        parents={
+            ParentType.MOTHER: FamilyNode(
+                person=Person(id="m1", name="Mother", is_alive=False),
+                children=[FamilyNode(
+                    person=Person(id="sib1", name="Sibling1", is_alive=False),
+                    children=[FamilyNode(person=nephew)]
+                )]
+            ),
+            ParentType.FATHER: None
+        }
+    )
+
+    heirs = FamilyTree(root=root_node).get_living_heirs()
+
+    assert [(heir.id, heir.parent_id) for heir in heirs] == [("n1", "sib1")]
+    assert nephew.parent_id is None
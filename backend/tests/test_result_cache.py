@@ -0,0 +1,241 @@
+import asyncio
+import errno
+import gzip
+import json
+import os
+import subprocess
+import sys
+from fastapi.testclient import TestClient
+import app.api as api
+from app.api import app
+from app.cache import ResultCache, SingleFlight, result_cache
+from app.deadline import ClientDisconnected
+from app.shared_cache import SharedResultCache
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REQUEST = {
+    "estate_value": 1000,
+    "family_tree": {
+        "person": {"id": "d1", "name": "Deceased", "is_alive": False},
+        "children": [{"person": {"id": "c1", "name": "Child1"}}]
+    }
+}
+
+def test_repeat_request_is_served_from_cache(monkeypatch):
+    """Test case: an identical request skips conversion and calculation"""
+    client = TestClient(app)
+    first = client.post("/calculate", json=REQUEST)
+
+    def fail(request):
+        raise AssertionError("calculation should not run for a cached request")
+    monkeypatch.setattr("app.api.run_calculation", fail)
+    second = client.post("/calculate", json=REQUEST)
+
+    assert second.status_code == 200
+    assert second.content == first.content
+    stats = client.get("/metrics").json()["result_cache"]
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+def test_changed_liveness_or_estate_value_is_a_miss():
+    """Test case: liveness and estate value are part of the cache key"""
+    client = TestClient(app)
+    client.post("/calculate", json=REQUEST)
+    client.post("/calculate", json={**REQUEST, "estate_value": 2000})
+    deceased_child = {
+        "estate_value": 1000,
+        "family_tree": {
+            **REQUEST["family_tree"],
+            "children": [{"person": {"id": "c1", "name": "Child1", "is_alive": False}}]
+        }
+    }
+    client.post("/calculate", json=deceased_child)
+
+    stats = client.get("/metrics").json()["result_cache"]
+    assert (stats["hits"], stats["misses"]) == (0, 3)
+
+def test_cache_key_is_hashed_from_the_raw_body(monkeypatch):
+    """Test case: the key comes from the decompressed body, never from re-serializing the request"""
+    client = TestClient(app)
+    body = json.dumps(REQUEST).encode()
+    client.post("/calculate", content=body, headers={"Content-Type": "application/json"})
+
+    def fail(*args, **kwargs):
+        raise AssertionError("the request should not be serialized again")
+    monkeypatch.setattr(api.InheritanceRequest, "model_dump_json", fail)
+    client.post("/calculate", content=gzip.compress(body), headers={
+        "Content-Type": "application/json", "Content-Encoding": "gzip"
+    })
+
+    stats = client.get("/metrics").json()["result_cache"]
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+def test_entries_expire_after_ttl():
+    """Test case: expired entries are dropped on lookup"""
+    now = [0.0]
+    cache = ResultCache(max_bytes=100, ttl_seconds=10, clock=lambda: now[0])
+    cache.put(b"k", b"value")
+
+    now[0] = 9.9
+    assert cache.get(b"k") == b"value"
+    now[0] = 10.0
+    assert cache.get(b"k") is None
+    assert cache.stats()["bytes"] == 0
+
+def test_memory_cap_evicts_least_recently_used():
+    """Test case: the total size of cached values stays under max_bytes"""
+    cache = ResultCache(max_bytes=10, ttl_seconds=60)
+    cache.put(b"a", b"1234")
+    cache.put(b"b", b"1234")
+    cache.get(b"a")
+    cache.put(b"c", b"1234")
+    cache.put(b"huge", b"x" * 11)
+
+    assert cache.get(b"b") is None
+    assert cache.get(b"a") == b"1234"
+    assert cache.get(b"c") == b"1234"
+    assert cache.get(b"huge") is None
+    assert cache.stats()["bytes"] == 8
+    assert cache.stats()["evictions"] == 1
+
+def test_concurrent_identical_calls_share_one_computation():
+    """Test case: callers arriving while a computation runs get its result"""
+    flight = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return b"body"
+
+    async def burst():
+        return await asyncio.gather(*(flight.run(b"key", compute) for _ in range(5)))
+
+    assert asyncio.run(burst()) == [b"body"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"leaders": 1, "coalesced": 4, "in_flight": 0}
+
+def test_errors_are_shared_but_a_disconnected_leader_is_replaced():
+    """Test case: waiters get the leader's error, unless the leader's client went away"""
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("bad tree")
+
+    async def disconnect():
+        await asyncio.sleep(0.01)
+        raise ClientDisconnected("gone")
+
+    async def succeed():
+        return b"body"
+
+    async def run_pair(leader, follower):
+        first = asyncio.create_task(flight.run(b"key", leader))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(flight.run(b"key", follower))
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    leader_error, follower_error = asyncio.run(run_pair(fail, succeed))
+    assert isinstance(leader_error, ValueError) and follower_error is leader_error
+
+    leader_error, follower_result = asyncio.run(run_pair(disconnect, succeed))
+    assert isinstance(leader_error, ClientDisconnected)
+    assert follower_result == b"body"
+    assert flight.stats() == {"leaders": 3, "coalesced": 1, "in_flight": 0}
+
+def test_cache_hits_skip_parsing(client, monkeypatch):
+    """Test case: a cached result is found from the raw body, without parsing it again"""
+    first = client.post("/calculate", json=REQUEST)
+
+    def fail(raw):
+        raise AssertionError("a cached request was parsed")
+    monkeypatch.setattr(api, "parse_calculation_request", fail)
+    second = client.post("/calculate", json=REQUEST)
+
+    assert second.status_code == 200
+    assert second.content == first.content
+
+def test_shared_cache_is_seen_by_forked_workers():
+    """Test case: entries written by one process are read by another, both ways"""
+    cache = SharedResultCache(max_bytes=4096, slots=16)
+    cache.put(b"parent", b"from parent")
+
+    pid = os.fork()
+    if pid == 0:
+        seen = cache.get(b"parent") == b"from parent"
+        cache.put(b"child", b"from child")
+        os._exit(0 if seen else 1)
+    _, status = os.waitpid(pid, 0)
+
+    assert status == 0
+    assert cache.get(b"child") == b"from child"
+
+def test_shared_cache_overwrites_oldest_values_and_expires():
+    """Test case: the data area is a ring, so old values give way, and entries expire"""
+    now = [0.0]
+    cache = SharedResultCache(max_bytes=1000, slots=16, ttl_seconds=10, clock=lambda: now[0])
+    for index in range(5):
+        cache.put(b"k%d" % index, bytes([index]) * 250)
+
+    assert cache.get(b"k0") is None
+    assert [cache.get(b"k%d" % index) for index in range(1, 5)] == [bytes([i]) * 250 for i in range(1, 5)]
+    assert cache.stats()["entries"] == 4
+
+    now[0] = 10.0
+    assert cache.get(b"k4") is None
+
+def test_shared_cache_is_disabled_when_it_cannot_be_allocated(monkeypatch):
+    """Test case: a cache that does not fit is turned off instead of failing on a later write"""
+    def no_space(fd, offset, length):
+        raise OSError(errno.ENOSPC, "No space left on device")
+    monkeypatch.setattr(os, "posix_fallocate", no_space)
+
+    cache = SharedResultCache(max_bytes=4096, slots=16)
+    cache.put(b"key", b"value")
+
+    assert cache.get(b"key") is None
+    assert cache.stats() == {"enabled": False}
+
+def test_shared_cache_file_is_shared_by_separate_processes(tmp_path):
+    """Test case: a process started on its own reads entries, expiry included, through the cache file"""
+    path = str(tmp_path / "results")
+    cache = SharedResultCache(max_bytes=4096, slots=16, path=path)
+    cache.put(b"key", b"value")
+
+    script = (
+        "from app.shared_cache import SharedResultCache; "
+        f"print(SharedResultCache(max_bytes=4096, slots=16, path={path!r}).get(b'key'))"
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, check=True, cwd=BACKEND)
+
+    assert output.stdout.strip() == b"b'value'"
+
+def test_shared_cache_is_only_mapped_when_used():
+    """Test case: importing the app, as calculation pool processes do, maps no shared cache"""
+    script = "import app.api, app.shared_cache as shared; print(shared._shared_result_cache)"
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, check=True, cwd=BACKEND)
+
+    assert output.stdout.strip() == b"None"
+
+def test_shared_cache_rejects_corrupted_values():
+    """Test case: a value that changed under its index entry is a miss, not garbage"""
+    cache = SharedResultCache(max_bytes=1000, slots=16)
+    cache.put(b"key", b"value")
+    cache._map[cache._data_start] = ord("V")
+
+    assert cache.get(b"key") is None
+
+def test_other_workers_results_are_served_from_the_shared_cache(monkeypatch):
+    """Test case: a result missing from the local cache is taken from the shared one"""
+    client = TestClient(app)
+    first = client.post("/calculate", json=REQUEST)
+    result_cache.clear()
+
+    def fail(request):
+        raise AssertionError("calculation should not run for a result another worker cached")
+    monkeypatch.setattr("app.api.run_calculation", fail)
+    second = client.post("/calculate", json=REQUEST)
+
+    assert second.content == first.content
+    assert client.get("/metrics").json()["shared_result_cache"]["hits"] == 1
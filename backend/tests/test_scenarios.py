@@ -0,0 +1,130 @@
+import base64
+import json
+import zlib
+import pytest
+from fastapi import HTTPException
+import app.api as api
+from app.calculations import RULES_VERSION
+from app.scenarios import decode_scenario, etag_matches
+from tests.test_api import make_request, make_three_generation_tree
+
+def create_scenario(client, payload) -> dict:
+    response = client.post("/scenarios", json=payload)
+    assert response.status_code == 200
+    return response.json()
+
+def test_equal_requests_get_the_same_scenario(client):
+    """Test case: key order, whitespace and explicit defaults do not change the scenario"""
+    payload = make_request()
+    reordered = json.loads(json.dumps(payload, sort_keys=True))
+    reordered["family_tree"]["spouse"]["is_alive"] = True
+
+    assert create_scenario(client, payload) == create_scenario(client, reordered)
+
+@pytest.mark.parametrize("payload", [
+    make_request(),
+    {"estate_value": 777.7, "family_tree": make_three_generation_tree(sibling_alive=True)},
+    {"estate_value": 1000, "deceased_id": "d1", "persons": [
+        {"id": "d1", "is_alive": False}, {"id": "c1", "name": "Child1", "mother_id": "d1"}
+    ]},
+])
+def test_get_returns_the_post_response_with_cache_headers(client, payload):
+    """Test case: GET on a scenario gives /calculate's bytes, an ETag and a long Cache-Control"""
+    path = create_scenario(client, payload)["path"]
+
+    first = client.get(path)
+    second = client.get(path)
+
+    assert first.status_code == 200
+    assert first.content == second.content == client.post("/calculate", json=payload).content
+    assert first.headers["etag"] == second.headers["etag"]
+    assert "max-age=31536000" in first.headers["cache-control"]
+
+def test_matching_etag_answers_304(client):
+    """Test case: a conditional GET with the current ETag gets an empty 304"""
+    path = create_scenario(client, make_request())["path"] + "?view=shares"
+    etag = client.get(path).headers["etag"]
+
+    response = client.get(path, headers={"If-None-Match": f'W/"other", {etag}'})
+
+    assert response.status_code == 304
+    assert response.content == b""
+    assert response.headers["etag"] == etag
+
+def test_304_is_answered_without_calculating(client, monkeypatch):
+    """Test case: a matching If-None-Match is answered before anything is calculated"""
+    path = create_scenario(client, make_request())["path"]
+    etag = client.get(path).headers["etag"]
+
+    def fail(*args, **kwargs):
+        raise AssertionError("calculated a conditional request")
+    monkeypatch.setattr(api, "run_calculation", fail)
+    api.result_cache.clear()
+    api.get_shared_result_cache().clear()
+
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 304
+
+def test_etag_depends_on_the_view(client):
+    """Test case: each view of a scenario has its own ETag"""
+    path = create_scenario(client, make_request())["path"]
+
+    assert client.get(path).headers["etag"] != client.get(path + "?view=shares").headers["etag"]
+
+def make_scenario(payload, prefix: str = "") -> str:
+    """Encode a request's JSON as written, behind an optional version prefix"""
+    compressed = zlib.compress(json.dumps(payload, indent=2).encode())[2:-4]
+    return prefix + base64.urlsafe_b64encode(compressed).decode().rstrip("=")
+
+def test_scenarios_carry_the_rules_version(client):
+    """Test case: new scenarios start with the current rules version"""
+    assert create_scenario(client, make_request())["scenario"].startswith(RULES_VERSION + ".")
+
+def test_non_canonical_scenario_is_redirected(client):
+    """Test case: a scenario of non-canonical JSON redirects to the canonical URL, keeping the query"""
+    payload = make_request()
+    canonical = create_scenario(client, payload)["path"]
+
+    response = client.get(
+        f"/calculate/{make_scenario(payload, RULES_VERSION + '.')}?view=summary", follow_redirects=False
+    )
+
+    assert response.status_code == 308
+    assert response.headers["location"] == canonical + "?view=summary"
+
+@pytest.mark.parametrize("prefix", ["", "0."])
+def test_scenario_of_other_rules_is_redirected(client, prefix):
+    """Test case: scenarios without the current rules version redirect, even if the ETag matches"""
+    payload = make_request()
+    canonical = create_scenario(client, payload)["path"]
+    etag = client.get(canonical).headers["etag"]
+    scenario = prefix + canonical.rsplit("/", 1)[1].split(".", 1)[1]
+
+    response = client.get(f"/calculate/{scenario}", headers={"If-None-Match": etag}, follow_redirects=False)
+
+    assert response.status_code == 308
+    assert response.headers["location"] == canonical
+
+@pytest.mark.parametrize("scenario, status_code", [
+    ("not*base64", 400),
+    (base64.urlsafe_b64encode(b"plain text").decode(), 400),
+])
+def test_invalid_scenarios_are_rejected(client, scenario, status_code):
+    """Test case: scenarios that do not decode answer 400"""
+    assert client.get(f"/calculate/{scenario}").status_code == status_code
+
+def test_decoded_size_is_limited():
+    """Test case: a scenario inflating past the limit is turned away"""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    bomb = compressor.compress(b" " * 100000) + compressor.flush()
+
+    with pytest.raises(HTTPException) as raised:
+        decode_scenario(base64.urlsafe_b64encode(bomb).decode(), max_bytes=1000)
+    assert raised.value.status_code == 413
+
+def test_etag_matching():
+    """Test case: If-None-Match lists, weak tags and wildcards all match"""
+    assert etag_matches('"a", "b"', '"b"')
+    assert etag_matches('W/"b"', '"b"')
+    assert etag_matches("*", '"b"')
+    assert not etag_matches(None, '"b"')
+    assert not etag_matches('"a"', '"b"')
@@ -0,0 +1,99 @@
+import pytest
+from fractions import Fraction
+from app.models import FamilyNode, Person
+from app.graph import FamilyGraph
+from app.calculations import InheritanceCalculator
+from app.plans import SharePlan, SharePlanCache
+
+def make_graph(prefix: str, names: str = "Person", child2_alive: bool = True) -> FamilyGraph:
+    """Deceased with a living spouse and three children"""
+    root_node = FamilyNode(
+        person=Person(id=f"{prefix}d", name=f"{names} Deceased", is_alive=False),
+        spouse=Person(id=f"{prefix}s", name=f"{names} Spouse"),
+        children=[
+            FamilyNode(person=Person(id=f"{prefix}c1", name=f"{names} Child1")),
+            FamilyNode(person=Person(id=f"{prefix}c2", name=f"{names} Child2", is_alive=child2_alive)),
+            FamilyNode(person=Person(id=f"{prefix}c3", name=f"{names} Child3")),
+        ]
+    )
+    return FamilyGraph.from_family_node(root_node)
+
+def test_plan_holds_exact_fractions():
+    """Test case: spouse with three children compiles to exact fractions"""
+    graph = make_graph("a")
+
+    plan = InheritanceCalculator(graph=graph, total_value=1, plan_cache=None).compile_plan()
+
+    assert {graph.ids[heir]: fraction for heir, fraction in zip(plan.heirs, plan.fractions)} == {
+        "as": Fraction(1, 4),
+        "ac1": Fraction(1, 4),
+        "ac2": Fraction(1, 4),
+        "ac3": Fraction(1, 4),
+    }
+
+def test_plan_is_reused_for_same_shape_and_new_estate_values():
+    """Test case: names, ids and estate values do not affect the cached plan"""
+    cache = SharePlanCache()
+    first = make_graph("a", names="Smith")
+    second = make_graph("b", names="Jones")
+    assert first.fingerprint() == second.fingerprint()
+
+    result1 = InheritanceCalculator(graph=first, total_value=1000000, plan_cache=cache).calculate()
+    result2 = InheritanceCalculator(graph=second, total_value=100, plan_cache=cache).calculate()
+
+    assert (cache.hits, cache.misses, len(cache)) == (1, 1, 1)
+    assert result2.plan is result1.plan
+    assert result1.share_map() == {"as": 250000, "ac1": 250000, "ac2": 250000, "ac3": 250000}
+    assert result2.share_map() == {"bs": 25, "bc1": 25, "bc2": 25, "bc3": 25}
+
+def test_liveness_changes_the_fingerprint():
+    """Test case: a different alive flag compiles a different plan"""
+    cache = SharePlanCache()
+    living = make_graph("a")
+    deceased_child = make_graph("a", child2_alive=False)
+    assert living.fingerprint() != deceased_child.fingerprint()
+
+    result = InheritanceCalculator(graph=deceased_child, total_value=1000, plan_cache=cache).calculate()
+
+    assert cache.misses == 1
+    assert result.share_map() == {"as": 250, "ac1": 375, "ac3": 375}
+
+def test_applied_plan_rounds_to_cents_and_adds_up():
+    """Test case: thirds are rounded to cents and still add up to the estate"""
+    graph = make_graph("a")
+    plan = InheritanceCalculator(graph=graph, total_value=1, plan_cache=None).compile_plan()
+
+    amounts, total = plan.apply(100)
+
+    assert [amount for _, amount in amounts] == [25, 25, 25, 25]
+    amounts, total = plan.apply(100.01)
+    assert total == 100.01
+    assert sum(round(amount * 100) for _, amount in amounts) == 10001
+
+@pytest.mark.parametrize("total_value, expected_cents", [
+    (0.01, [1, 0, 0, 0, 0, 0, 0, 0, 0]),
+    (0.06, [1, 1, 1, 1, 1, 1, 0, 0, 0]),
+    (1000, [11112] + [11111] * 8),
+])
+def test_rounding_spreads_leftover_cents_by_largest_remainder(total_value, expected_cents):
+    """Test case: nine equal heirs are each within a cent of their exact share
+
+    Rounding every share to the nearest cent would hand out nine cents of
+    a six-cent estate, leaving the last heir with minus two cents.
+    """
+    plan = SharePlan(list(range(9)), [Fraction(1, 9)] * 9)
+
+    amounts, total = plan.apply(total_value)
+
+    assert [round(amount * 100) for _, amount in amounts] == expected_cents
+    assert total == total_value
+
+def test_plan_cache_evicts_least_recently_used():
+    """Test case: the cache keeps at most max_entries plans"""
+    cache = SharePlanCache(max_entries=1)
+    InheritanceCalculator(graph=make_graph("a"), total_value=10, plan_cache=cache).calculate()
+    InheritanceCalculator(graph=make_graph("a", child2_alive=False), total_value=10, plan_cache=cache).calculate()
+
+    assert len(cache) == 1
+    InheritanceCalculator(graph=make_graph("a"), total_value=10, plan_cache=cache).calculate()
+    assert (cache.hits, cache.misses) == (0, 3)
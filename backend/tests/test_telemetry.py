@@ -0,0 +1,66 @@
+import json
+import logging
+from fastapi.testclient import TestClient
+from app.api import app
+from app.execution import execution_policy
+from app.telemetry import JsonFormatter, StageTimingMiddleware
+
+REQUEST = {
+    "estate_value": 1000,
+    "family_tree": {
+        "person": {"id": "d1", "name": "Deceased", "is_alive": False},
+        "children": [{"person": {"id": "c1", "name": "Child1"}}]
+    }
+}
+
+def timing_records(caplog):
+    return [record for record in caplog.records if record.name == "app.telemetry"]
+
+def test_sampled_request_logs_every_stage(caplog):
+    """Test case: a sampled /calculate request logs one line with all stage timings"""
+    client = TestClient(StageTimingMiddleware(app, sample_rate=1.0))
+
+    with caplog.at_level(logging.INFO, logger="app.telemetry"):
+        response = client.post("/calculate", json=REQUEST)
+
+    assert response.status_code == 200
+    records = timing_records(caplog)
+    assert len(records) == 1
+    fields = records[0].fields
+    assert fields["path"] == "/calculate"
+    assert fields["status_code"] == 200
+    for stage in ("parse", "convert", "calculate", "build", "serialize", "total"):
+        assert fields[f"{stage}_ms"] >= 0
+
+    entry = json.loads(JsonFormatter().format(records[0]))
+    assert entry["message"] == "request timings"
+    assert entry["calculate_ms"] == fields["calculate_ms"]
+
+def test_stages_of_offloaded_calculations_are_merged(caplog, monkeypatch):
+    """Test case: stages timed in a worker process reach the request's log line"""
+    monkeypatch.setattr(execution_policy, "inline_max_nodes", 0)
+    monkeypatch.setattr(execution_policy, "thread_max_nodes", 0)
+    client = TestClient(StageTimingMiddleware(app, sample_rate=1.0))
+    before = execution_policy.stats()["process"]
+
+    with caplog.at_level(logging.INFO, logger="app.telemetry"):
+        response = client.post("/calculate", json=REQUEST)
+
+    assert response.status_code == 200
+    assert execution_policy.stats()["process"] == before + 1
+    fields = timing_records(caplog)[0].fields
+    assert fields["calculate_ms"] > 0
+    for stage in ("convert", "build", "serialize", "offload"):
+        assert fields[f"{stage}_ms"] >= 0
+    stages = sum(value for name, value in fields.items() if name.endswith("_ms") and name != "total_ms")
+    assert stages <= fields["total_ms"] + 0.01
+
+def test_unsampled_request_logs_nothing(caplog):
+    """Test case: requests outside the sample are not timed"""
+    client = TestClient(StageTimingMiddleware(app, sample_rate=0.0))
+
+    with caplog.at_level(logging.INFO, logger="app.telemetry"):
+        response = client.post("/calculate", json=REQUEST)
+
+    assert response.status_code == 200
+    assert timing_records(caplog) == []
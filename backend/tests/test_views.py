@@ -0,0 +1,47 @@
+import json
+import pytest
+from app.api import ResponseView, calculate_request, encode_response, parse_calculation_request
+from tests.test_api import make_request, make_three_generation_tree
+from tests.test_encoding import expected_json
+
+FLAT_REQUEST = {"estate_value": 1000, "deceased_id": "d1", "persons": [
+    {"id": "d1", "is_alive": False},
+    {"id": "s1", "name": "Spouse", "spouse_id": "d1"},
+    {"id": "c1", "name": "Child1", "mother_id": "d1"},
+]}
+
+@pytest.mark.parametrize("payload", [make_request(), FLAT_REQUEST])
+def test_views_project_the_full_response(client, payload):
+    """Test case: every view returns its part of the full response and nothing else"""
+    full = client.post("/calculate", json=payload).json()
+    table = "persons" if "persons" in payload else "family_tree"
+
+    summary = client.post("/calculate?view=summary", json=payload).json()
+    shares = client.post("/calculate?view=shares", json=payload).json()
+    tree = client.post("/calculate?view=tree", json=payload).json()
+
+    assert summary == {"total_distributed": full["total_distributed"], "summary": full["summary"]}
+    assert tree == {"total_distributed": full["total_distributed"], table: full[table]}
+    assert set(shares) == {"total_distributed", "shares"}
+    assert shares["shares"] == {heir: entry["share"] for heir, entry in full["summary"].items()}
+
+def test_unknown_view_is_rejected(client):
+    """Test case: a view that does not exist answers 422"""
+    response = client.post("/calculate?view=everything", json=make_request())
+
+    assert response.status_code == 422
+
+@pytest.mark.parametrize("view", list(ResponseView))
+def test_view_encoding_matches_model_dump(view):
+    """Test case: the direct encoder gives the same JSON as dumping the model in every view"""
+    raw = json.dumps({"estate_value": 777.7, "family_tree": make_three_generation_tree(sibling_alive=True)})
+    response = calculate_request(parse_calculation_request(raw.encode()), view)
+
+    assert encode_response(response) == expected_json(response)
+
+def test_batch_items_use_the_view(client):
+    """Test case: /calculate/batch returns every item in the requested view"""
+    response = client.post("/calculate/batch?view=shares", json=[make_request(), FLAT_REQUEST])
+
+    results = response.json()["results"]
+    assert [set(item["result"]) for item in results] == [{"total_distributed", "shares"}] * 2